@@ -41,3 +41,10 @@ elif re.match(r"^vocms127\.cern\.ch$", myhost):
 data.extconfigurl = 'http://git.cern.ch/pubweb/?p=CAFServicesConfig.git;a=blob_plain;f=cmsweb-rest-config.json'
 #data.loggingLevel = 10
 #data.loggingFile = '/tmp/CRAB.log'
+# per process cache of the task status read from the schedd webdir: number of tasks,
+# seconds during which it is used without revalidating it, max size of the files of one
+# task and max size of the files of all the cached tasks
+#data.statusCacheSize = 200
+#data.statusCacheTTL = 10
+#data.statusCacheMaxBytes = 20 * 1024 * 1024
+#data.statusCacheTotalBytes = 200 * 1024 * 1024
@@ -134,9 +134,10 @@ import os
 import sys
 import json
 import tarfile
+import zipfile
 from ast import literal_eval
 
-def readFileFromTarball(file, tarball):
+def readFileFromArchive(file, archive, tarball):
     content = '{}'
     if os.path.isfile(file):
         #This is only for Debugging
@@ -144,19 +145,32 @@ def readFileFromTarball(file, tarball):
         with open(file, 'r') as f:
             content = f.read()
         return literal_eval(content)
-    elif not os.path.exists(tarball):
-        raise RuntimeError("Error getting %s file location" % tarball)
+    elif not os.path.exists(archive):
+        if os.path.exists(tarball):
+            # jobs prepared by older crab clients (preparelocal) only have the tarball
+            return readFileFromTarball(file, tarball)
+        raise RuntimeError("Error getting %s file location" % archive)
+    # the zip central directory gives direct access to the member of this job
+    zip_file = zipfile.ZipFile(archive)
+    try:
+        content = zip_file.read(file).decode('utf-8')
+    except KeyError as er:
+        #Don`t exit due to KeyError, print error. EventBased and FileBased does not have run and lumis
+        print('Failed to get information from archive %s and file %s. Error : %s' %(archive, file, er))
+    finally:
+        zip_file.close()
+    return literal_eval(content)
+
+def readFileFromTarball(file, tarball):
+    content = '{}'
     tar_file = tarfile.open(tarball)
-    for member in tar_file.getmembers():
-        try:
-            f = tar_file.extractfile(file)
-            content = f.read()
-            break
-        except KeyError as er:
-            #Don`t exit due to KeyError, print error. EventBased and FileBased does not have run and lumis
-            print('Failed to get information from tarball %s and file %s. Error : %s' %(tarball, file, er))
-            break
-    tar_file.close()
+    try:
+        content = tar_file.extractfile(file).read().decode('utf-8')
+    except KeyError as er:
+        #Don`t exit due to KeyError, print error. EventBased and FileBased does not have run and lumis
+        print('Failed to get information from tarball %s and file %s. Error : %s' %(tarball, file, er))
+    finally:
+        tar_file.close()
     return literal_eval(content)
 
 print("Beginning TweakPSet")
@@ -188,10 +202,10 @@ if opts.oneEventMode in ["1", "True", True] :
 
 runAndLumis = {}
 if opts.runAndLumis:
-    runAndLumis = readFileFromTarball(opts.runAndLumis, 'run_and_lumis.tar.gz')
+    runAndLumis = readFileFromArchive(opts.runAndLumis, 'run_and_lumis.zip', 'run_and_lumis.tar.gz')
 inputFile = {}
 if opts.inputFile:
-    inputFile = readFileFromTarball(opts.inputFile, 'input_files.tar.gz')
+    inputFile = readFileFromArchive(opts.inputFile, 'input_files.zip', 'input_files.tar.gz')
 pset = SetupCMSSWPsetCore( opts.location, inputFile, runAndLumis, agentNumber, lfnBase, outputMods,\
                            literal_eval(opts.firstEvent), literal_eval(opts.lastEvent), literal_eval(opts.firstLumi),\
                            literal_eval(opts.firstRun), opts.seeding, literal_eval(opts.lheInputFiles), opts.oneEventMode, \
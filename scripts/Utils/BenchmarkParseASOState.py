@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Time HTCondorDataWorkflow.parseASOState on synthetic aso_status.json files in the
+Oracle format written by the post-jobs, to check that it scales linearly with the
+number of transfer documents.
+
+Each job has --filesPerJob documents, all 'done' for half of the jobs and one of
+them still 'submitted' for the other half. Run it where the REST dependencies are
+available, with src/python in PYTHONPATH, e.g.:
+  PYTHONPATH=src/python python scripts/Utils/BenchmarkParseASOState.py --docs 1000 10000 100000
+"""
+from __future__ import print_function
+from __future__ import division
+
+import json
+import time
+import argparse
+import tempfile
+
+from CRABInterface.HTCondorDataWorkflow import HTCondorDataWorkflow
+
+
+def makeTask(nDocs, filesPerJob):
+    """ Build the aso_status content and the node state for a task with nDocs transfer documents """
+    nJobs = max(nDocs // filesPerJob, 1)
+    results = {}
+    nodes = {}
+    for doc in range(nDocs):
+        jobid = doc // filesPerJob + 1
+        state = 'submitted' if jobid % 2 and doc % filesPerJob == 0 else 'done'
+        docid = '%064x' % doc
+        results[docid] = [{'id': docid, 'jobid': jobid, 'state': state, 'start_time': 0, 'last_update': 0}]
+    for jobid in range(1, nJobs + 1):
+        nodes[str(jobid)] = {'State': 'transferring'}
+    return {'query_timestamp': time.time(), 'query_succeded': True, 'query_jobid': 1, 'results': results}, nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='number of transfer documents in aso_status.json')
+    parser.add_argument('--filesPerJob', type=int, default=2)
+    args = parser.parse_args()
+
+    # parseASOState only needs the ASO database url, skip the REST initialization
+    workflow = HTCondorDataWorkflow.__new__(HTCondorDataWorkflow)
+    workflow.asoDBURL = 'oracle'
+
+    print("%8s %8s %10s %12s" % ('docs', 'jobs', 'parse[s]', 'transferred'))
+    for nDocs in args.docs:
+        asoStatus, nodes = makeTask(nDocs, args.filesPerJob)
+        with tempfile.TemporaryFile() as fp:
+            json.dump(asoStatus, fp)
+            fp.seek(0)
+            t0 = time.time()
+            workflow.parseASOState(fp, nodes, {'taskWarningMsg': []})
+            elapsed = time.time() - t0
+        transferred = sum(1 for node in nodes.values() if node['State'] == 'transferred')
+        print("%8d %8d %10.3f %12d" % (nDocs, len(nodes), elapsed, transferred))
+
+
+if __name__ == '__main__':
+    main()
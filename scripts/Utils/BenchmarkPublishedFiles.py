@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Compare the selection of the files still to publish done in TaskPublish.publishInDBS3 when
+the output dataset is already partially published: the previous lookups of each file in the
+lists of LFNs returned by DBS and the sets of TaskPublish.selectFilesToPublish.
+
+Synthetic datasets have --existing files already in DBS (one in --invalidEvery invalid),
+and the task has --existing + --new files to publish. The list lookups are quadratic, so
+they are timed on --sample files only and extrapolated to the whole task. Run it in the
+Publisher environment with src/python in PYTHONPATH, e.g.:
+  PYTHONPATH=src/python python scripts/Utils/BenchmarkPublishedFiles.py --existing 10000 100000
+"""
+from __future__ import print_function
+from __future__ import division
+
+import time
+import argparse
+
+from Publisher.TaskPublish import selectFilesToPublish
+
+
+def makeDataset(nExisting, nNew, invalidEvery):
+    """ Build the DBS listFiles output and the task JSON content """
+    existingDBSFiles = []
+    toPublish = []
+    for num in range(nExisting + nNew):
+        lfn = '/store/user/someone/Dataset/CRAB3_task/000000/%04d/output_%d.root' % (num // 1000, num)
+        if num < nExisting:
+            existingDBSFiles.append({'logical_file_name': lfn, 'is_file_valid': num % invalidEvery != 0})
+        toPublish.append({'lfn': lfn, 'SourceLFN': lfn.replace('/store/user/', '/store/temp/user/')})
+    return existingDBSFiles, toPublish
+
+
+def listLookups(existingDBSFiles, toPublish, sample):
+    """
+    Time the selection as it was done before the sets: lists of existing LFNs, then one
+    lookup of each of `sample` files spread over the task in the valid ones, and extrapolate
+    """
+    stride = max(len(toPublish) // sample, 1)
+    t0 = time.time()
+    _ = [f['logical_file_name'] for f in existingDBSFiles]
+    existingFilesValid = [f['logical_file_name'] for f in existingDBSFiles if f['is_file_valid']]
+    t1 = time.time()
+    newFiles = []
+    for file_ in toPublish[::stride]:
+        if file_['lfn'] not in existingFilesValid:
+            newFiles.append(file_)
+    return (t1 - t0) + (time.time() - t1) * stride, newFiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--existing', type=int, nargs='+', default=[10000, 100000],
+                        help='number of files of the dataset already in DBS')
+    parser.add_argument('--new', type=int, default=1000, help='files not in DBS yet')
+    parser.add_argument('--invalidEvery', type=int, default=100)
+    parser.add_argument('--sample', type=int, default=1000, help='files used to time the list lookups')
+    args = parser.parse_args()
+
+    print("%8s %8s %12s %10s" % ('existing', 'publish', 'lists[s]', 'sets[s]'))
+    for nExisting in args.existing:
+        existingDBSFiles, toPublish = makeDataset(nExisting, args.new, args.invalidEvery)
+        listTime, expected = listLookups(existingDBSFiles, toPublish, args.sample)
+
+        t0 = time.time()
+        existingFiles, _, newFiles = selectFilesToPublish(toPublish, existingDBSFiles)
+        _ = any(file_['lfn'] not in existingFiles for file_ in toPublish)
+        setTime = time.time() - t0
+
+        newLfns = set(file_['lfn'] for file_ in newFiles)
+        assert all(file_['lfn'] in newLfns for file_ in expected)
+        print("%8d %8d %11.1f~ %10.3f" % (nExisting, len(toPublish), listTime, setTime))
+
+
+if __name__ == '__main__':
+    main()
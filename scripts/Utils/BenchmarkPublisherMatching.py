@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Compare the matching of the transfer documents of a task with their filemetadata done in
+PublisherMaster.startSlave: the previous nested loop over the metadata list (and the
+lfn_ready list lookup of getPublDescFiles) and the LFN index of
+PublisherMaster.matchPublDescFiles.
+
+Synthetic tasks have --files transfer documents, all with metadata but --missing of them.
+The nested loop is quadratic, so it is timed on --sample transfer documents only and
+extrapolated to the whole task. Run it in the Publisher environment with src/python in
+PYTHONPATH, e.g.:
+  PYTHONPATH=src/python python scripts/Utils/BenchmarkPublisherMatching.py --files 10000 50000
+"""
+from __future__ import print_function
+from __future__ import division
+
+import copy
+import time
+import argparse
+
+from Publisher.PublisherMaster import Master
+
+
+def makeTask(nFiles, nMissing):
+    """ Build the active_ list of startSlave and the filemetadata of a task with nFiles files """
+    active_ = []
+    metadata = []
+    for num in range(nFiles):
+        destLfn = '/store/user/someone/Dataset/CRAB3_task/000000/0000/output_%d.root' % num
+        sourceLfn = destLfn.replace('/store/user/', '/store/temp/user/someone.1234/')
+        active_.append({'key': ['someone', '', '', 'task'],
+                        'value': ['T2_CH_CERN', sourceLfn, destLfn, '/A/B/MINIAOD', 'dbs', 0]})
+        if num >= nMissing:
+            metadata.append({'lfn': destLfn, 'filetype': 'EDM', 'runlumi': {}})
+    return active_, metadata
+
+
+def nestedLoop(active_, metadata, sample):
+    """
+    Time the matching as it was done before the index: filter the metadata with the
+    lfn_ready list, then look for the metadata of `sample` files spread over the task
+    and extrapolate
+    """
+    stride = max(len(active_) // sample, 1)
+    t0 = time.time()
+    lfn_ready = [file_['value'][2] for file_ in active_]
+    _ = [md for md in metadata[::stride] if md['lfn'] in lfn_ready]
+    publDescFiles_list = metadata
+    toPublish = []
+    toFail = []
+    for file_ in active_[::stride]:
+        metadataFound = False
+        for doc in publDescFiles_list:
+            if doc['lfn'] == file_['value'][2]:
+                doc['SourceLFN'] = file_['value'][1]
+                toPublish.append(doc)
+                metadataFound = True
+                break
+        if not metadataFound:
+            toFail.append(file_['value'][1])
+    return (time.time() - t0) * stride, toPublish, toFail
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, nargs='+', default=[10000, 50000],
+                        help='number of files ready for publication in the task')
+    parser.add_argument('--missing', type=int, default=10, help='files without metadata')
+    parser.add_argument('--sample', type=int, default=500, help='files used to time the nested loop')
+    args = parser.parse_args()
+
+    print("%8s %14s %10s" % ('files', 'nested[s]', 'index[s]'))
+    for nFiles in args.files:
+        active_, metadata = makeTask(nFiles, args.missing)
+        sample = min(args.sample, nFiles)
+        nestedTime, expectedPublish, expectedFail = nestedLoop(active_, copy.deepcopy(metadata), sample)
+
+        t0 = time.time()
+        lfn_ready = set(file_['value'][2] for file_ in active_)
+        publDescFiles_list = [md for md in metadata if md['lfn'] in lfn_ready]
+        toPublish, toFail = Master.matchPublDescFiles(active_, publDescFiles_list, 'someone', 'DN')
+        indexTime = time.time() - t0
+
+        assert set(expectedFail) <= set(toFail)
+        assert set(doc['SourceLFN'] for doc in expectedPublish) <= set(doc['SourceLFN'] for doc in toPublish)
+        print("%8d %13.1f~ %10.3f" % (nFiles, nestedTime, indexTime))
+
+
+if __name__ == '__main__':
+    main()
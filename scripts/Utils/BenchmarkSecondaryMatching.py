@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Compare the matching of primary and secondary dataset files (two-file read) done in
+DBSDataDiscovery: the previous pairwise intersection of LumiList objects and the
+(run, lumi) index of DBSDataDiscovery.matchSecondaryFiles.
+
+Synthetic datasets mimic a RECO/AOD primary and its RAW secondary: the same lumis,
+with larger primary files (--primaryLumis lumis each) than secondary ones
+(--secondaryLumis lumis each). The pairwise matching is quadratic, so it is timed
+on --sample primary files only and extrapolated to the whole dataset.
+Run it in the TaskWorker environment with src/python in PYTHONPATH, e.g.:
+  PYTHONPATH=src/python python scripts/Utils/BenchmarkSecondaryMatching.py --lumis 100000 500000
+"""
+from __future__ import print_function
+from __future__ import division
+
+import copy
+import time
+import argparse
+
+from WMCore.DataStructs.LumiList import LumiList
+
+from TaskWorker.Actions.DBSDataDiscovery import DBSDataDiscovery
+
+
+def makeFiles(prefix, nLumis, lumisPerFile, lumisPerRun):
+    """ Files covering nLumis consecutive lumis, in the listDatasetFileDetails format """
+    files = {}
+    for first in range(0, nLumis, lumisPerFile):
+        lumis = {}
+        for lumi in range(first, min(first + lumisPerFile, nLumis)):
+            lumis.setdefault(100000 + lumi // lumisPerRun, []).append(lumi % lumisPerRun + 1)
+        files['/store/%s/%09d.root' % (prefix, first)] = {'Lumis': lumis}
+    return files
+
+
+def pairwise(filedetails, moredetails, sample):
+    """
+    Time the matching as it was done before the index: build the secondary LumiList
+    objects, then intersect them with `sample` primary files and extrapolate
+    """
+    t0 = time.time()
+    for secinfos in moredetails.values():
+        secinfos['lumiobj'] = LumiList(runsAndLumis=secinfos['Lumis'])
+    t1 = time.time()
+    for infos in sample.values():
+        infos['Parents'] = []
+        lumis = LumiList(runsAndLumis=infos['Lumis'])
+        for secfilename, secinfos in moredetails.items():
+            if lumis & secinfos['lumiobj']:
+                infos['Parents'].append(secfilename)
+    t2 = time.time()
+    return (t1 - t0) + (t2 - t1) * len(filedetails) / len(sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lumis', type=int, nargs='+', default=[100000, 500000],
+                        help='number of lumis in the datasets')
+    parser.add_argument('--primaryLumis', type=int, default=200, help='lumis per primary file')
+    parser.add_argument('--secondaryLumis', type=int, default=20, help='lumis per secondary file')
+    parser.add_argument('--lumisPerRun', type=int, default=2000)
+    parser.add_argument('--sample', type=int, default=5, help='primary files used to time the pairwise matching')
+    args = parser.parse_args()
+
+    print("%8s %8s %8s %14s %10s" % ('lumis', 'primary', 'second.', 'pairwise[s]', 'index[s]'))
+    for nLumis in args.lumis:
+        filedetails = makeFiles('reco', nLumis, args.primaryLumis, args.lumisPerRun)
+        moredetails = makeFiles('raw', nLumis, args.secondaryLumis, args.lumisPerRun)
+
+        expected = copy.deepcopy(dict(list(filedetails.items())[:args.sample]))
+        pairwiseTime = pairwise(filedetails, copy.deepcopy(moredetails), expected)
+
+        t0 = time.time()
+        DBSDataDiscovery.matchSecondaryFiles(filedetails, moredetails)
+        indexTime = time.time() - t0
+
+        for lfn, infos in expected.items():
+            assert sorted(infos['Parents']) == sorted(filedetails[lfn]['Parents'])
+        print("%8d %8d %8d %13.1f~ %10.3f" % (nLumis, len(filedetails), len(moredetails), pairwiseTime, indexTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Compare load/store time of the task_process status cache in the legacy
+str()/ast.literal_eval format (status_cache.txt) and in the binary snapshot
+format of ServerUtilities.writeStatusCacheSnapshot/readStatusCacheSnapshot.
+
+Synthetic nodes similar to the ones built by cache_status.py are used.
+Run it with src/python in PYTHONPATH, e.g.:
+  PYTHONPATH=src/python python scripts/Utils/BenchmarkStatusCache.py --nodes 1000 10000 50000
+"""
+from __future__ import print_function
+from __future__ import division
+
+import os
+import ast
+import time
+import random
+import argparse
+import tempfile
+
+from ServerUtilities import readStatusCacheSnapshot, writeStatusCacheSnapshot
+
+
+def makeNodes(nJobs):
+    """ Build nodes and nodeMap structures for a task with nJobs jobs, each with 1 to 3 retries """
+    nodes = {'DagStatus': {'SubDagStatus': {}, 'Timestamp': int(time.time()), 'NodesTotal': nJobs,
+                           'SubDags': {}, 'DagStatus': 1}}
+    nodeMap = {}
+    now = time.time()
+    for jobId in range(1, nJobs + 1):
+        retries = random.randint(1, 3)
+        node = str(jobId)
+        nodes[node] = {'Retries': retries - 1, 'Restarts': 0, 'State': 'finished', 'RecordedSite': True,
+                       'SiteHistory': ['T2_CH_CERN'] * retries,
+                       'ResidentSetSize': [random.randint(100000, 2000000) for _ in range(retries)],
+                       'SubmitTimes': [now - 3600] * retries, 'StartTimes': [now - 3000] * retries,
+                       'EndTimes': [now - 100] * retries,
+                       'TotalUserCpuTimeHistory': [random.randint(0, 3000) for _ in range(retries)],
+                       'TotalSysCpuTimeHistory': [random.randint(0, 300) for _ in range(retries)],
+                       'WallDurations': [2900.0] * retries,
+                       'JobIds': ['%d.0' % (1000 + jobId + i * nJobs) for i in range(retries)]}
+        for i in range(retries):
+            nodeMap[(1000 + jobId + i * nJobs, 0)] = node
+    return nodes, nodeMap
+
+
+def timeLegacy(fileName, nodes, nodeMap):
+    """ store/load the status cache the way cache_status.py did before the snapshot """
+    t0 = time.time()
+    with open(fileName, 'w') as fd:
+        fd.write("0\n0\n")
+        fd.write(str(nodes) + "\n")
+        fd.write(str(nodeMap) + "\n")
+    t1 = time.time()
+    with open(fileName) as fd:
+        int(fd.readline())
+        int(fd.readline())
+        ast.literal_eval(fd.readline())
+        ast.literal_eval(fd.readline())
+    t2 = time.time()
+    return t1 - t0, t2 - t1, os.path.getsize(fileName)
+
+
+def timeSnapshot(fileName, nodes, nodeMap):
+    """ store/load the status cache with the versioned binary snapshot """
+    t0 = time.time()
+    writeStatusCacheSnapshot(fileName, {'jobLogCheckpoint': 0, 'fjrParseResCheckpoint': 0,
+                                        'nodes': nodes, 'nodeMap': nodeMap})
+    t1 = time.time()
+    statusCache = readStatusCacheSnapshot(fileName)
+    t2 = time.time()
+    assert statusCache['nodes'] == nodes and statusCache['nodeMap'] == nodeMap
+    return t1 - t0, t2 - t1, os.path.getsize(fileName)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='number of jobs in the synthetic tasks')
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix='statuscachebench')
+    print("%8s %-9s %10s %10s %10s" % ('jobs', 'format', 'store[s]', 'load[s]', 'size[MB]'))
+    for nJobs in args.nodes:
+        nodes, nodeMap = makeNodes(nJobs)
+        for name, func in [('legacy', timeLegacy), ('snapshot', timeSnapshot)]:
+            fileName = os.path.join(workDir, 'status_cache.%s' % name)
+            store, load, size = func(fileName, nodes, nodeMap)
+            print("%8d %-9s %10.3f %10.3f %10.2f" % (nJobs, name, store, load, size / 1024 / 1024))
+            os.remove(fileName)
+    os.rmdir(workDir)
+
+
+if __name__ == '__main__':
+    main()
@@ -187,6 +187,24 @@ then
     touch USE_NEW_PUBLISHER
 fi
 
+# Decide if the status caching and transfers of this task are handled by the schedd-wide
+# task_process/task_proc_daemon.py instead of a task_proc_wrapper.sh job of its own.
+# Do it here so that decision stays for task lifetime, and never for a task which
+# already has its own task_proc_wrapper.sh running
+if [ -f /etc/use_task_process_daemon ] && [ ! -f task_process/task_process_running ] ;
+then
+    echo "Found file /etc/use_task_process_daemon. Set this task to use the schedd task_process daemon"
+    touch USE_TP_DAEMON
+fi
+
+# Decide if the PostJob and PreJob of this task run in the per-task warm server
+# of TaskWorker/TaskManagerServer.py instead of a new python interpreter each time
+if [ -f /etc/use_bootstrap_server ] ;
+then
+    echo "Found file /etc/use_bootstrap_server. Set this task to use the task manager server for PostJob and PreJob"
+    touch USE_BOOTSTRAP_SERVER
+fi
+
 UseNewPublisher=`grep '^CRAB_USE_NEW_PUBLISHER =' $_CONDOR_JOB_AD | tr -d '"' | awk '{print $NF;}'`
 if [ "$UseNewPublisher" = "True" ];
 then
@@ -230,7 +248,11 @@ else
     # which is done by passing the cluster_id of the dagman to the daemon process via the jdl. With this, we are
     # able to use condor_q in the daemon to check if the task/job status will no longed be updated
     # and if the daemon needs to exit.
-    if [ ! -f task_process/task_process_running ];
+    if [ -f USE_TP_DAEMON ];
+    then
+        echo "task_process handled by the schedd task_process daemon, not submitting the daemon task"
+        touch task_process/task_process_running
+    elif [ ! -f task_process/task_process_running ];
     then
         echo "creating and executing task process daemon jdl"
         TASKNAME=`grep '^CRAB_ReqName =' $_CONDOR_JOB_AD | awk '{print $NF;}'`
@@ -5,6 +5,7 @@ import time
 import logging
 import os
 import ast
+import json
 import sys
 import classad
 import glob
@@ -15,6 +16,7 @@ from shutil import move
 # /attempted-relative-import-in-non-package-even-with-init-py/27876800#comment28841658_19190695
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import HTCondorUtils
+from ServerUtilities import readStatusCacheSnapshot, writeStatusCacheSnapshot
 
 logging.basicConfig(filename='task_process/cache_status.log', level=logging.DEBUG)
 
@@ -33,7 +35,9 @@ NODE_DEFAULTS = {
 }
 
 STATUS_CACHE_FILE = "task_process/status_cache.txt"
+STATUS_CACHE_SNAPSHOT = "task_process/status_cache.snapshot"
 FJR_PARSE_RES_FILE = "task_process/fjr_parse_results.txt"
+ERROR_SUMMARY_FILE = "error_summary.json"
 
 #
 # insertCpu, parseJobLog, parsNodeStateV2 and parseErrorReport
@@ -276,7 +280,13 @@ def parseNodeStateV2(fp, nodes, level):
 def storeNodesInfoInFile():
     # Open cache file and get the location until which the jobs_log was parsed last time
     try:
-        if os.path.exists(STATUS_CACHE_FILE) and os.stat(STATUS_CACHE_FILE).st_size > 0:
+        statusCache = loadStatusCacheSnapshot()
+        if statusCache:
+            jobLogCheckpoint = statusCache['jobLogCheckpoint']
+            fjrParseResCheckpoint = statusCache['fjrParseResCheckpoint']
+            nodes = statusCache['nodes']
+            nodeMap = statusCache['nodeMap']
+        elif os.path.exists(STATUS_CACHE_FILE) and os.stat(STATUS_CACHE_FILE).st_size > 0:
             logging.debug("cache file found, opening and reading")
             nodesStorage = open(STATUS_CACHE_FILE, "r")
 
@@ -310,9 +320,15 @@ def storeNodesInfoInFile():
         errorSummary, newFjrParseResCheckpoint = summarizeFjrParseResults(fjrParseResCheckpoint)
         if errorSummary and newFjrParseResCheckpoint:
             parseErrorReport(errorSummary, nodes)
+            compactErrorSummary(errorSummary)
     except IOError:
         logging.exception("error during error_summary file handling")
 
+    # The snapshot goes first: if we die before status_cache.txt is written, the next run
+    # resumes from the newer snapshot and nothing is parsed twice.
+    saveStatusCacheSnapshot({'jobLogCheckpoint': newJobLogCheckpoint, 'fjrParseResCheckpoint': newFjrParseResCheckpoint,
+                             'nodes': nodes, 'nodeMap': nodeMap})
+
     # First write the new cache file under a temporary name, so that other processes
     # don't get an incomplete result. Then replace the old one with the new one.
     tempFilename = (STATUS_CACHE_FILE + ".%s") % os.getpid()
@@ -326,6 +342,35 @@ def storeNodesInfoInFile():
 
     move(tempFilename, STATUS_CACHE_FILE)
 
+def loadStatusCacheSnapshot():
+    """
+    Load the binary snapshot of the status cache. This is what task_process reloads at every run,
+    the status_cache.txt file is only written for the CRAB client which reads it from the webdir.
+    :return: the statusCache dictionary, or None if there is no usable snapshot
+    """
+    if not os.path.exists(STATUS_CACHE_SNAPSHOT):
+        return None
+    try:
+        return readStatusCacheSnapshot(STATUS_CACHE_SNAPSHOT)
+    except (ValueError, EOFError, TypeError):
+        logging.exception("status cache snapshot is not usable, falling back to %s", STATUS_CACHE_FILE)
+        return None
+
+def saveStatusCacheSnapshot(statusCache):
+    """
+    Write the binary snapshot of the status cache. Failures are not fatal since
+    status_cache.txt can still be used to resume at the next run
+    :param statusCache: dictionary with checkpoints, nodes and nodeMap
+    :return: nothing
+    """
+    try:
+        writeStatusCacheSnapshot(STATUS_CACHE_SNAPSHOT, statusCache)
+    except (ValueError, IOError, OSError):
+        logging.exception("error writing status cache snapshot, removing the old one")
+        # an old snapshot would make the next run resume from stale checkpoints
+        if os.path.exists(STATUS_CACHE_SNAPSHOT):
+            os.remove(STATUS_CACHE_SNAPSHOT)
+
 def summarizeFjrParseResults(checkpoint):
     '''
     Reads the fjr_parse_results file line by line. The file likely contains multiple
@@ -354,6 +399,32 @@ def summarizeFjrParseResults(checkpoint):
     else:
         return None, 0
 
+def compactErrorSummary(errDict):
+    """
+    Merge the entries read from the fjr_parse_results journal since the last run into
+    error_summary.json, the compacted view of the journal served to the status API from
+    the webdir. PostJobs only append to the journal, so this is the only place where the
+    (potentially big) error_summary.json file is read and rewritten.
+    If the compacted file is missing or invalid, it is rebuilt from the whole journal.
+    :param errDict: dictionary {jobId: {retry: errorSummary}} with the new entries
+    :return: nothing
+    """
+    summary = None
+    if os.path.exists(ERROR_SUMMARY_FILE) and os.stat(ERROR_SUMMARY_FILE).st_size > 0:
+        try:
+            with open(ERROR_SUMMARY_FILE, "r") as f:
+                summary = json.load(f)
+        except ValueError:
+            logging.warning("%s is not valid JSON, rebuilding it from the journal", ERROR_SUMMARY_FILE)
+    if summary is None:
+        summary, _ = summarizeFjrParseResults(0)
+    summary.update(errDict)
+
+    tempFilename = (ERROR_SUMMARY_FILE + ".%s") % os.getpid()
+    with open(tempFilename, "w") as f:
+        json.dump(summary, f)
+    move(tempFilename, ERROR_SUMMARY_FILE)
+
 def main():
     try:
         storeNodesInfoInFile()
@@ -9,12 +9,17 @@ import time
 import logging
 import os
 import ast
+import json
 import glob
 import copy
 from shutil import move
 import pickle
+import sys
 import htcondor
 import classad
+# ServerUtilities is in the parent (spool) directory, see cache_status.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ServerUtilities import readStatusCacheSnapshot, writeStatusCacheSnapshot, updateJobAd, JOB_AD_CACHE_DIR
 
 logging.basicConfig(filename='task_process/cache_status.log', level=logging.DEBUG)
 
@@ -33,8 +38,10 @@ NODE_DEFAULTS = {
 }
 
 STATUS_CACHE_FILE = "task_process/status_cache.txt"
+STATUS_CACHE_SNAPSHOT = "task_process/status_cache.snapshot"
 LOG_PARSING_POINTERS_DIR = "task_process/jel_pickles/"
 FJR_PARSE_RES_FILE = "task_process/fjr_parse_results.txt"
+ERROR_SUMMARY_FILE = "error_summary.json"
 
 #
 # insertCpu, parseJobLog, parsNodeStateV2 and parseErrorReport
@@ -69,21 +76,43 @@ def insertCpu(event, info):
 nodeNameRe = re.compile("DAG Node: Job(\d+(?:-\d+)?)")
 nodeName2Re = re.compile("Job(\d+(?:-\d+)?)")
 
+def storeJobAds(jobAds):
+    """
+    write the ads of the jobs which were removed (JobStatus 3) or completed (JobStatus 4)
+    in JOB_AD_CACHE_DIR, one file per job named <cluster>.<proc> in the old ClassAd format,
+    where RetryJob looks for them before falling back to condor_q -userlog on job_log.
+    The stored ads are removed from jobAds
+    :param jobAds: dictionary (cluster, proc) -> ad of the jobs not finished in the previous runs
+    :return: nothing
+    """
+    if not os.path.exists(JOB_AD_CACHE_DIR):
+        os.mkdir(JOB_AD_CACHE_DIR)
+    for proc, ad in list(jobAds.items()):
+        if ad.get('JobStatus') not in (3, 4):
+            continue
+        jobAdFile = os.path.join(JOB_AD_CACHE_DIR, "%d.%d" % proc)
+        with open(jobAdFile + ".tmp", 'w') as fd:
+            fd.write(classad.ClassAd(ad).printOld())
+        os.rename(jobAdFile + ".tmp", jobAdFile)
+        del jobAds[proc]
+
 # this now takes as input an htcondor.JobEventLog object
 # which as of HTCondor 8.9 can be saved/restored with memory of
 # where it had reached in processing the job log file
-def parseJobLog(jel, nodes, nodeMap):
+def parseJobLog(jel, nodes, nodeMap, jobAds):
     """
     parses new events in condor job log file and updates nodeMap
     :param jel: a condor JobEventLog object which provides an iterator over events
     :param nodes: the structure where we collect one job info for cache_status file
     :param nodeMap: the structure where collect summary of all events
+    :param jobAds: the ads of the jobs being rebuilt from the events, see updateJobAd
     :return: nothing
     """
     count = 0
     for event in jel.events(0):
         count += 1
         eventtime = time.mktime(time.strptime(event['EventTime'], "%Y-%m-%dT%H:%M:%S"))
+        updateJobAd(event, eventtime, jobAds)
         if event['MyType'] == 'SubmitEvent':
             m = nodeNameRe.match(event['LogNotes'])
             if m:
@@ -297,7 +326,15 @@ def storeNodesInfoInFile():
     :return: nothing
     """
     jobLogCheckpoint = None
-    if os.path.exists(STATUS_CACHE_FILE) and os.stat(STATUS_CACHE_FILE).st_size > 0:
+    statusCache = loadStatusCacheSnapshot()
+    if statusCache:
+        logging.debug("status cache snapshot found")
+        jobLogCheckpoint = statusCache['jobLogCheckpoint']
+        fjrParseResCheckpoint = statusCache['fjrParseResCheckpoint']
+        nodes = statusCache['nodes']
+        nodeMap = statusCache['nodeMap']
+        jobAds = statusCache.get('jobAds', {})
+    elif os.path.exists(STATUS_CACHE_FILE) and os.stat(STATUS_CACHE_FILE).st_size > 0:
         logging.debug("cache file found, opening")
         try:
             nodesStorage = open(STATUS_CACHE_FILE, "r")
@@ -312,6 +349,8 @@ def storeNodesInfoInFile():
                 nodes = ast.literal_eval(nodesStorage.readline())
                 nodeMap = ast.literal_eval(nodesStorage.readline())
                 nodesStorage.close()
+                # status_cache.txt has no job ads, the jobs already submitted are left to condor_q
+                jobAds = {}
         except Exception:
             logging.exception("error during status_cache handling")
             jobLogCheckpoint = None
@@ -321,6 +360,7 @@ def storeNodesInfoInFile():
         fjrParseResCheckpoint = 0
         nodes = {}
         nodeMap = {}
+        jobAds = {}
 
     if jobLogCheckpoint:
         # resume log parsing where we left
@@ -332,7 +372,11 @@ def storeNodesInfoInFile():
     #jobsLog = open("job_log", "r")
     #jobsLog.seek(jobLogCheckpoint)
 
-    parseJobLog(jel, nodes, nodeMap)
+    parseJobLog(jel, nodes, nodeMap, jobAds)
+    try:
+        storeJobAds(jobAds)
+    except (IOError, OSError):
+        logging.exception("error storing the job ads in %s", JOB_AD_CACHE_DIR)
     # save jel object in a pickle file made unique by a timestamp
     newJelPickleName = 'jel-%d.pkl' % int(time.time())
     if not os.path.exists(LOG_PARSING_POINTERS_DIR):
@@ -350,9 +394,15 @@ def storeNodesInfoInFile():
         errorSummary, newFjrParseResCheckpoint = summarizeFjrParseResults(fjrParseResCheckpoint)
         if errorSummary and newFjrParseResCheckpoint:
             parseErrorReport(errorSummary, nodes)
+            compactErrorSummary(errorSummary)
     except IOError:
         logging.exception("error during error_summary file handling")
 
+    # The snapshot goes first: if we die before status_cache.txt is written, the next run
+    # resumes from the newer snapshot and nothing is parsed twice.
+    saveStatusCacheSnapshot({'jobLogCheckpoint': newJobLogCheckpoint, 'fjrParseResCheckpoint': newFjrParseResCheckpoint,
+                             'nodes': nodes, 'nodeMap': nodeMap, 'jobAds': jobAds})
+
     # First write the new cache file under a temporary name, so that other processes
     # don't get an incomplete result. Then replace the old one with the new one.
     tempFilename = (STATUS_CACHE_FILE + ".%s") % os.getpid()
@@ -366,6 +416,35 @@ def storeNodesInfoInFile():
 
     move(tempFilename, STATUS_CACHE_FILE)
 
+def loadStatusCacheSnapshot():
+    """
+    Load the binary snapshot of the status cache. This is what task_process reloads at every run,
+    the status_cache.txt file is only written for the CRAB client which reads it from the webdir.
+    :return: the statusCache dictionary, or None if there is no usable snapshot
+    """
+    if not os.path.exists(STATUS_CACHE_SNAPSHOT):
+        return None
+    try:
+        return readStatusCacheSnapshot(STATUS_CACHE_SNAPSHOT)
+    except (ValueError, EOFError, TypeError):
+        logging.exception("status cache snapshot is not usable, falling back to %s", STATUS_CACHE_FILE)
+        return None
+
+def saveStatusCacheSnapshot(statusCache):
+    """
+    Write the binary snapshot of the status cache. Failures are not fatal since
+    status_cache.txt can still be used to resume at the next run
+    :param statusCache: dictionary with checkpoints, nodes and nodeMap
+    :return: nothing
+    """
+    try:
+        writeStatusCacheSnapshot(STATUS_CACHE_SNAPSHOT, statusCache)
+    except (ValueError, IOError, OSError):
+        logging.exception("error writing status cache snapshot, removing the old one")
+        # an old snapshot would make the next run resume from stale checkpoints
+        if os.path.exists(STATUS_CACHE_SNAPSHOT):
+            os.remove(STATUS_CACHE_SNAPSHOT)
+
 def summarizeFjrParseResults(checkpoint):
     '''
     Reads the fjr_parse_results file line by line. The file likely contains multiple
@@ -394,6 +473,32 @@ def summarizeFjrParseResults(checkpoint):
     else:
         return None, 0
 
+def compactErrorSummary(errDict):
+    """
+    Merge the entries read from the fjr_parse_results journal since the last run into
+    error_summary.json, the compacted view of the journal served to the status API from
+    the webdir. PostJobs only append to the journal, so this is the only place where the
+    (potentially big) error_summary.json file is read and rewritten.
+    If the compacted file is missing or invalid, it is rebuilt from the whole journal.
+    :param errDict: dictionary {jobId: {retry: errorSummary}} with the new entries
+    :return: nothing
+    """
+    summary = None
+    if os.path.exists(ERROR_SUMMARY_FILE) and os.stat(ERROR_SUMMARY_FILE).st_size > 0:
+        try:
+            with open(ERROR_SUMMARY_FILE, "r") as f:
+                summary = json.load(f)
+        except ValueError:
+            logging.warning("%s is not valid JSON, rebuilding it from the journal", ERROR_SUMMARY_FILE)
+    if summary is None:
+        summary, _ = summarizeFjrParseResults(0)
+    summary.update(errDict)
+
+    tempFilename = (ERROR_SUMMARY_FILE + ".%s") % os.getpid()
+    with open(tempFilename, "w") as f:
+        json.dump(summary, f)
+    move(tempFilename, ERROR_SUMMARY_FILE)
+
 def main():
     """
     parse condor job_log from last checkpoint until now and write summary in status_cache file
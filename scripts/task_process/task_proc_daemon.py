@@ -0,0 +1,299 @@
+#!/usr/bin/python
+"""
+Schedd-wide replacement for task_proc_wrapper.sh.
+
+Instead of one bash loop per DAG which every 300s launches a new python
+interpreter for cache_status.py (or cache_status_jel.py) and for
+FTS_Transfers.py/RUCIO_Transfers.py, a single process per schedd:
+    - discovers the CRAB tasks in the schedd queue with one query and
+      picks up the ones whose spool dir contains the USE_TP_DAEMON flag
+      (created by dag_bootstrap_startup.sh when /etc/use_task_process_daemon exists)
+      and task_process/task_process_running (created when the DAG starts)
+    - keeps htcondor, classad, fts3 and rucio imported, and runs each step of
+      each task in a process forked from this warm interpreter, inside the task
+      spool dir and with the task own CRAB3.zip/WMCore.zip in the path
+    - runs at most --maxWorkers steps at the same time, one step per task at a
+      time, and serves the tasks in FIFO order so that no task can starve the others
+    - applies the same exit policy as task_proc_wrapper.sh: once all the DAGs of a
+      task have been in a final state for 24h the status is cached one last time,
+      task_process/task_process_running is removed and the task is forgotten
+
+It is meant to be run as a service on the schedd, e.g.:
+    python task_proc_daemon.py --logFile /var/log/crab/task_proc_daemon.log
+When run as root, the steps of each task are executed as the owner of its spool dir.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import time
+import runpy
+import signal
+import logging
+import argparse
+import importlib
+import multiprocessing
+from collections import deque
+from logging.handlers import TimedRotatingFileHandler
+
+import htcondor
+import classad  # pylint: disable=unused-import
+
+DAEMON_FLAG = 'USE_TP_DAEMON'
+RUNNING_FLAG = 'task_process/task_process_running'
+OUTPUT_FILE = 'task_process/task_proc_daemon.out'
+TASK_PYTHONPATH = ['task_process', 'CRAB3.zip', 'WMCore.zip']
+RUCIO_PATH = '/cvmfs/cms.cern.ch/rucio/current/lib/python2.7/site-packages'
+# imported once here, so that the forked steps find them in sys.modules
+WARM_MODULES = ['fts3.rest.client.easy', 'rucio.client.client', 'requests']
+DAG_CONSTRAINT = 'CRAB_ReqName =!= undefined && stringListMember(TaskType, "ROOT PROCESSING TAIL", " ")'
+DAG_ATTRS = ['CRAB_ReqName', 'TaskType', 'Iwd', 'ClusterId', 'JobStatus', 'EnteredCurrentStatus']
+ONE_DAY = 24 * 3600
+
+
+def runStep(spoolDir, script):
+    """
+    Body of the forked process running one step of a task: behave like the
+    `python task_process/<script>` done by task_proc_wrapper.sh in the spool dir
+    """
+    if os.geteuid() == 0:
+        spoolStat = os.stat(spoolDir)
+        try:
+            # the steps run user code: do not keep the supplementary groups of root either
+            os.setgroups([])
+            os.setgid(spoolStat.st_gid)
+            os.setuid(spoolStat.st_uid)
+        except OSError as ex:
+            print("Could not drop privileges to uid %d gid %d: %s" % (spoolStat.st_uid, spoolStat.st_gid, ex),
+                  file=sys.stderr)
+            sys.exit(1)
+    os.chdir(spoolDir)
+    outFd = os.open(OUTPUT_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(outFd, 1)
+    os.dup2(outFd, 2)
+    os.close(outFd)
+    print("[%s] Running %s" % (time.strftime("%F %R"), script))
+    # the scripts configure the root logger on import
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+    taskPath = [os.path.join(spoolDir, path) for path in TASK_PYTHONPATH]
+    sys.path[0:0] = taskPath
+    os.environ['PYTHONPATH'] = ':'.join(taskPath + [os.environ.get('PYTHONPATH', ''), RUCIO_PATH])
+    sys.argv = [script]
+    runpy.run_path(script, run_name='__main__')
+
+
+class Task(object):
+    """ Scheduling state of one task managed by the daemon """
+
+    def __init__(self, reqName, spoolDir):
+        self.reqName = reqName
+        self.spoolDir = spoolDir
+        self.dags = []
+        self.nextRun = 0
+        self.steps = []
+        self.retiring = False
+        self.lastCycle = False
+
+    def canExit(self, now):
+        """
+        Same logic of exit_now in task_proc_wrapper.sh: no DAG is idle(1) or running(2)
+        and all of them have been in their current status for at least 24h
+        """
+        if not self.dags:
+            return False
+        for _, status, entered in self.dags:
+            if status in (1, 2) or now - entered < ONE_DAY:
+                return False
+        return True
+
+    def exists(self):
+        """ HTCondor removes the spool dir shortly after the DAG leaves the queue """
+        return os.path.isfile(os.path.join(self.spoolDir, 'task_process/cache_status.py'))
+
+
+class TaskProcessDaemon(object):
+    """ Discover the tasks on this schedd and run their task_process steps with a bounded pool """
+
+    def __init__(self, args, logger):
+        self.args = args
+        self.logger = logger
+        self.schedd = htcondor.Schedd()
+        self.tasks = {}
+        self.ready = deque()
+        self.running = {}
+        self.nextQuery = 0
+        self.stopping = False
+
+    def warmUp(self):
+        """ Import the heavy libraries once for all the steps which will be forked from here """
+        if RUCIO_PATH not in sys.path:
+            sys.path.append(RUCIO_PATH)
+        for module in WARM_MODULES:
+            try:
+                importlib.import_module(module)
+            except Exception as ex:  # pylint: disable=broad-except
+                self.logger.warning("Cannot preload %s: %s", module, ex)
+
+    def queryDags(self, now):
+        """ One schedd query for the DAGs of all the tasks, replacing the per-task condor_q """
+        try:
+            ads = self.schedd.query(DAG_CONSTRAINT, DAG_ATTRS)
+        except Exception:  # pylint: disable=broad-except
+            # like an empty condor_q in task_proc_wrapper.sh, keep what we know
+            self.logger.exception("Schedd query failed, keeping the previous DAG information")
+            return
+        dags = {}
+        for ad in ads:
+            reqName = ad['CRAB_ReqName']
+            info = dags.setdefault(reqName, {'dags': [], 'iwd': None})
+            info['dags'].append((int(ad['ClusterId']), int(ad['JobStatus']), int(ad['EnteredCurrentStatus'])))
+            if 'ROOT' in str(ad.get('TaskType', '')).split() or not info['iwd']:
+                info['iwd'] = ad.get('Iwd')
+        for reqName, info in dags.items():
+            task = self.tasks.get(reqName)
+            if not task:
+                if not info['iwd'] or not os.path.exists(os.path.join(info['iwd'], DAEMON_FLAG)):
+                    continue
+                # created by dag_bootstrap_startup.sh when the DAG starts and removed when the task
+                # is retired: a finished DAG which is still in the queue is not picked up again
+                if not os.path.exists(os.path.join(info['iwd'], RUNNING_FLAG)):
+                    continue
+                task = Task(reqName, info['iwd'])
+                self.tasks[reqName] = task
+                self.logger.info("Managing task %s in %s", reqName, task.spoolDir)
+            task.dags = info['dags']
+            if not task.retiring and task.canExit(now):
+                self.logger.info("Dag(s) of %s in one of the final states for over 24 hours, caching the status one last time", reqName)
+                task.retiring = True
+                task.nextRun = now
+
+    def scriptFor(self, task, step):
+        """ Pick the script for a step, mirroring cache_status/manage_transfers in task_proc_wrapper.sh """
+        if step == 'status':
+            if os.path.exists(os.path.join(task.spoolDir, 'USE_JEL')):
+                return 'task_process/cache_status_jel.py'
+            return 'task_process/cache_status.py'
+        transfersFile = os.path.join(task.spoolDir, 'task_process/transfers.txt')
+        if not os.path.isfile(transfersFile):
+            return None
+        try:
+            with open(transfersFile) as fd:
+                destLFN = json.loads(fd.readline())['destination_lfn']
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("%s: cannot read destination_lfn from transfers.txt", task.reqName)
+            return None
+        if destLFN.startswith('/store/user/rucio/'):
+            return 'task_process/RUCIO_Transfers.py'
+        return 'task_process/FTS_Transfers.py'
+
+    def scheduleDue(self, now):
+        """ Queue a new cycle for the idle tasks whose wait is over """
+        for reqName, task in list(self.tasks.items()):
+            if task.steps or task.nextRun > now or reqName in self.running:
+                continue
+            if not task.exists():
+                self.logger.info("%s: task_process/cache_status.py not found, forgetting the task", reqName)
+                del self.tasks[reqName]
+                continue
+            task.lastCycle = task.retiring
+            task.steps = ['status'] if task.retiring else ['status', 'transfers']
+            self.ready.append(task)
+
+    def startSteps(self, now):
+        """ Fork the next steps in FIFO order until the pool is full """
+        while self.ready and len(self.running) < self.args.maxWorkers:
+            task = self.ready.popleft()
+            step = task.steps.pop(0)
+            script = self.scriptFor(task, step)
+            if not script:
+                self.stepDone(task, now)
+                continue
+            timeout = self.args.transfersTimeout if step == 'transfers' else self.args.statusTimeout
+            proc = multiprocessing.Process(target=runStep, args=(task.spoolDir, script),
+                                           name="%s:%s" % (task.reqName, step))
+            proc.start()
+            self.running[task.reqName] = (task, script, proc, now + timeout)
+
+    def reapSteps(self, now):
+        """ Collect the finished steps and kill the ones beyond their timeout """
+        for reqName, (task, script, proc, deadline) in list(self.running.items()):
+            if proc.is_alive():
+                if now < deadline:
+                    continue
+                self.logger.error("%s: %s exited with process timeout", reqName, script)
+                proc.terminate()
+            proc.join()
+            if proc.exitcode:
+                self.logger.error("%s: %s exited with %s", reqName, script, proc.exitcode)
+            del self.running[reqName]
+            self.stepDone(task, now)
+
+    def stepDone(self, task, now):
+        """ Requeue the task at the end of the FIFO for its next step, or end its cycle """
+        if task.steps:
+            self.ready.append(task)
+            return
+        if task.lastCycle:
+            self.logger.info("%s: removing %s and forgetting the task", task.reqName, RUNNING_FLAG)
+            try:
+                os.remove(os.path.join(task.spoolDir, RUNNING_FLAG))
+            except OSError:
+                pass
+            del self.tasks[task.reqName]
+            return
+        task.nextRun = now if task.retiring else now + self.args.cycle
+
+    def stop(self, signum, _frame):
+        """ Signal handler """
+        self.logger.info("Got signal %s, stopping", signum)
+        self.stopping = True
+
+    def run(self):
+        """ Main loop """
+        self.warmUp()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.logger.info("Starting with maxWorkers=%d cycle=%ds", self.args.maxWorkers, self.args.cycle)
+        while not self.stopping:
+            now = time.time()
+            self.reapSteps(now)
+            if now >= self.nextQuery:
+                self.queryDags(now)
+                self.nextQuery = now + self.args.queryInterval
+            self.scheduleDue(now)
+            self.startSteps(now)
+            time.sleep(self.args.tick)
+        for _, script, proc, _ in self.running.values():
+            self.logger.info("Terminating %s %s", proc.name, script)
+            proc.terminate()
+            proc.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logFile', default='task_proc_daemon.log')
+    parser.add_argument('--maxWorkers', type=int, default=8,
+                        help='maximum number of task steps running at the same time')
+    parser.add_argument('--cycle', type=int, default=300,
+                        help='seconds between the end of a cycle of a task and the start of the next one')
+    parser.add_argument('--queryInterval', type=int, default=600,
+                        help='seconds between two schedd queries for new tasks and DAG status')
+    parser.add_argument('--statusTimeout', type=int, default=3600)
+    parser.add_argument('--transfersTimeout', type=int, default=900)
+    parser.add_argument('--tick', type=float, default=1)
+    args = parser.parse_args()
+
+    logger = logging.getLogger('TaskProcessDaemon')
+    handler = TimedRotatingFileHandler(args.logFile, when='midnight', backupCount=7)
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    TaskProcessDaemon(args, logger).run()
+
+
+if __name__ == '__main__':
+    main()
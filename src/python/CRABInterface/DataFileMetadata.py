@@ -59,15 +59,10 @@ class DataFileMetadata(object):
                      'tmplfn': row.tmplfn
             })
 
-    def inject(self, **kwargs):
-        """ Insert or update a record in the database
+    def fileBinds(self, **kwargs):
+        """ Build the binds of the New_sql/Merge_sql queries for one file from the REST parameters
         """
-        self.logger.debug("Calling jobmetadata inject with parameters %s" % kwargs)
-
-        bindnames = set(kwargs.keys()) - set(['outfileruns', 'outfilelumis'])
-        binds = {}
-        for name in bindnames:
-            binds[name] = [kwargs[name]]
+        binds = dict((name, kwargs[name]) for name in set(kwargs.keys()) - set(['outfileruns', 'outfilelumis']))
 
         # Modify all incoming metadata to have the structure 'lumi1:events1,lumi2:events2..'
         # instead of 'lumi1,lumi2,lumi3...' if necessary.
@@ -89,10 +84,18 @@ class DataFileMetadata(object):
             lumiEventList.append(lumiDict)
         runList = kwargs['outfileruns']
         # fmd_runlumi column in FILEMETADATA table is CLOB, so need to cast into a string here
-        binds['runlumi'] = [str(dict(zip(runList, lumiEventList)))]
+        binds['runlumi'] = str(dict(zip(runList, lumiEventList)))
+        binds['outtmplfn'] = binds['outlfn']
+        return binds
+
+    def inject(self, **kwargs):
+        """ Insert or update a record in the database
+        """
+        self.logger.debug("Calling jobmetadata inject with parameters %s" % kwargs)
+
+        binds = dict((name, [value]) for name, value in self.fileBinds(**kwargs).items())
 
         #Changed to Select if exist, update, else insert
-        binds['outtmplfn'] = binds['outlfn']
         row = self.api.query(None, None, self.FileMetaData.GetCurrent_sql,
                               outlfn=binds['outlfn'][0], taskname=binds['taskname'][0])
         try:
@@ -113,6 +116,15 @@ class DataFileMetadata(object):
         self.api.modify(self.FileMetaData.Update_sql, **update_bind)
         return []
 
+    def injectBulk(self, taskname, files):
+        """ Insert or update the records of several files of a task with one MERGE executed
+            for all of them, instead of a SELECT plus an INSERT or UPDATE per file as in inject
+        """
+        self.logger.debug("Calling jobmetadata injectBulk for %d files of task %s" % (len(files), taskname))
+        binds = [self.fileBinds(taskname=taskname, **fileInfo) for fileInfo in files]
+        self.api.modify(self.FileMetaData.Merge_sql, binds)
+        return []
+
     def changeState(self, **kwargs): #kwargs are (taskname, outlfn, filestate)
         """ UNUSED method that change the fmd_filestate column of a filemetadata record
         """
@@ -24,7 +24,7 @@ from WMCore.REST.Error import ExecutionError, InvalidParameter
 from Utils.Throttled import UserThrottle
 throttle = UserThrottle(limit=3)
 
-from CRABInterface.Utilities import conn_handler
+from CRABInterface.Utilities import conn_handler, LRUCache
 from ServerUtilities import FEEDBACKMAIL, PUBLICATIONDB_STATES, isCouchDBURL, getEpochFromDBTime
 from Databases.FileMetaDataDB.Oracle.FileMetaData.FileMetaData import GetFromTaskAndType
 
@@ -34,6 +34,7 @@ from functools import reduce
 
 
 JOB_KILLED_HOLD_REASON = "Python-initiated action."
+WEBDIR_STATUS_FILES = ["node_state.txt", "error_summary.json", "aso_status.json"]
 
 class MissingNodeStatus(ExecutionError):
     pass
@@ -42,6 +43,14 @@ class HTCondorDataWorkflow(DataWorkflow):
     """ HTCondor implementation of the status command.
     """
 
+    def __init__(self, config):
+        DataWorkflow.__init__(self, config)
+        # per process cache of the task status built from the schedd webdir, see taskWebStatus
+        self.webStatusCache = LRUCache(getattr(config, 'statusCacheSize', 200),
+                                       maxBytes=getattr(config, 'statusCacheTotalBytes', 200 * 1024 * 1024))
+        self.webStatusCacheTTL = getattr(config, 'statusCacheTTL', 10)
+        self.webStatusCacheMaxBytes = getattr(config, 'statusCacheMaxBytes', 20 * 1024 * 1024)
+
     def taskads(self, workflow):
         row = next(self.api.query(None, None, self.Task.ID_sql, taskname = workflow))
         row = self.Task.ID_tuple(*row)
@@ -289,7 +298,7 @@ class HTCondorDataWorkflow(DataWorkflow):
         else:
             self.logger.info("Getting status for workflow %s using node state file.", workflow)
             try:
-                taskStatus = self.taskWebStatus({'CRAB_UserWebDir' : row.user_webdir}, result)
+                taskStatus = self.taskWebStatus({'CRAB_UserWebDir' : row.user_webdir}, result, cacheKey=workflow)
                 #Check timestamp, if older then 2 minutes warn about stale info
                 nodeStateUpd = int(taskStatus.get('DagStatus', {}).get("Timestamp", 0))
                 DAGStatus = int(taskStatus.get('DagStatus', {}).get('DagStatus', -1))
@@ -393,88 +402,175 @@ class HTCondorDataWorkflow(DataWorkflow):
         #curl.setopt(pycurl.ENCODING, 'gzip, deflate')
         return curl
 
-    @classmethod
-    def cleanTempFileAndBuff(cls, fp, hbuf):
+    def fetchWebdirFiles(self, url, fileNames, requiredFile, validators=None):
         """
-        Go to the beginning of temp file
-        Truncate buffer and file and return
+        Download concurrently the given files from the task webdir on the schedd,
+        using one curl handle per file driven by a single CurlMulti.
+        A failure in the download of requiredFile stops the others right away, the
+        other files are optional and failing to get them is only logged.
+        validators is an optional dictionary {fileName: (etag, lastModified)} used to
+        make conditional requests, to which the schedd answers 304 if the file did not change.
+        Returns a dictionary {fileName: (httpStatus, header, fp)} for the files which
+        could be requested, where fp is a temporary file positioned at the beginning
+        for the files retrieved with HTTP status 200 and None otherwise.
         """
-        fp.seek(0)
-        fp.truncate(0)
-        hbuf.truncate(0)
-        return fp, hbuf
+        validators = validators or {}
+        multi = pycurl.CurlMulti()
+        transfers = {}
+        for fileName in fileNames:
+            curl = self.prepareCurl()
+            fp = tempfile.TemporaryFile()
+            hbuf = StringIO.StringIO()
+            curl.setopt(pycurl.URL, url + "/" + fileName)
+            curl.setopt(pycurl.WRITEFUNCTION, fp.write)
+            curl.setopt(pycurl.HEADERFUNCTION, hbuf.write)
+            etag, lastModified = validators.get(fileName, (None, None))
+            conditions = []
+            if etag:
+                conditions.append("If-None-Match: %s" % etag)
+            if lastModified:
+                conditions.append("If-Modified-Since: %s" % lastModified)
+            if conditions:
+                curl.setopt(pycurl.HTTPHEADER, conditions)
+            multi.add_handle(curl)
+            transfers[curl] = (fileName, fp, hbuf)
+        files = {}
+        try:
+            requiredError = None
+            numHandles = len(transfers)
+            while numHandles and not requiredError:
+                while True:
+                    ret, numHandles = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                while True:
+                    numQueued, okList, errList = multi.info_read()
+                    for curl in okList:
+                        fileName, fp, hbuf = transfers[curl]
+                        header = ResponseHeader(hbuf.getvalue())
+                        self.logger.debug("Download of %s finished with status %s in %.3f s", fileName,
+                                          header.status, curl.getinfo(pycurl.TOTAL_TIME))
+                        if header.status == 200:
+                            fp.seek(0)
+                            files[fileName] = (header.status, header, fp)
+                        else:
+                            files[fileName] = (header.status, header, None)
+                    for curl, _, errMsg in errList:
+                        fileName = transfers[curl][0]
+                        self.logger.debug("Download of %s failed in %.3f s: %s", fileName,
+                                          curl.getinfo(pycurl.TOTAL_TIME), errMsg)
+                        if fileName == requiredFile:
+                            requiredError = errMsg
+                    if not numQueued:
+                        break
+                if numHandles and not requiredError:
+                    multi.select(1.0)
+            if requiredError:
+                raise ExecutionError(("Failed to contact Grid scheduler when getting URL %s. "
+                                      "This might be a temporary error, please retry later and "
+                                      "contact %s if the error persist. Error from curl: %s"
+                                      % (url + "/" + requiredFile, FEEDBACKMAIL, requiredError)))
+            return files
+        finally:
+            for curl, (fileName, fp, hbuf) in transfers.items():
+                multi.remove_handle(curl)
+                curl.close()
+                hbuf.close()
+                if fileName not in files or files[fileName][2] is None:
+                    fp.close()
+            multi.close()
 
     @classmethod
-    def myPerform(cls, curl, url):
-        try:
-            curl.perform()
-        except pycurl.error as e:
-            raise ExecutionError(("Failed to contact Grid scheduler when getting URL %s. "
-                                  "This might be a temporary error, please retry later and "
-                                  "contact %s if the error persist. Error from curl: %s"
-                                  % (url, FEEDBACKMAIL, str(e))))
-
-    def taskWebStatus(self, task_ad,  statusResult):
-        nodes = {}
+    def getValidators(cls, header):
+        """ Return the (ETag, Last-Modified) pair of a response header """
+        fields = dict((key.lower(), value) for key, value in header.header.items())
+        return fields.get('etag'), fields.get('last-modified')
+
+    def taskWebStatus(self, task_ad, statusResult, cacheKey=None):
+        """
+        Build the status of the jobs from node_state.txt, error_summary.json and aso_status.json
+        in the task webdir. When a cacheKey is given, the files and the result of their parsing are
+        kept in memory: within statusCacheTTL seconds they are reused as they are, after that they
+        are revalidated with conditional requests and parsed again only if one of them changed.
+        """
         url = task_ad['CRAB_UserWebDir']
-        curl = self.prepareCurl()
-        fp = tempfile.TemporaryFile()
-        curl.setopt(pycurl.WRITEFUNCTION, fp.write)
-        hbuf = StringIO.StringIO()
-        curl.setopt(pycurl.HEADERFUNCTION, hbuf.write)
+        cached = self.webStatusCache.get(cacheKey) if cacheKey else None
+        if cached and cached['url'] != url:
+            cached = None
+        if cached and time.time() - cached['validated'] < self.webStatusCacheTTL:
+            self.logger.debug("Using the cached task status from schedd")
+            return self.cachedWebStatus(cached, statusResult)
+
+        self.logger.debug("Retrieving task status from schedd via http")
+        files = self.fetchWebdirFiles(url, WEBDIR_STATUS_FILES, requiredFile="node_state.txt",
+                                      validators=cached['validators'] if cached else None)
         try:
-            self.logger.debug("Retrieving task status from schedd via http")
-            nodes_url = url + "/node_state.txt"
-            curl.setopt(pycurl.URL, nodes_url)
-            # Before executing any new curl, truncate and clean temp file
-            fp, hbuf = self.cleanTempFileAndBuff(fp, hbuf)
-            self.logger.debug("Starting download of node state")
-            self.myPerform(curl, nodes_url)
-            self.logger.debug("Finished download of node state")
-            header = ResponseHeader(hbuf.getvalue())
-            if header.status == 200:
-                fp.seek(0)
-                self.logger.debug("Starting parse of node state")
-                self.parseNodeState(fp, nodes)
-                self.logger.debug("Finished parse of node state")
-            else:
+            bodies, validators = {}, {}
+            for fileName in WEBDIR_STATUS_FILES:
+                status, header, fp = files.get(fileName, (None, None, None))
+                if status == 200:
+                    bodies[fileName] = fp.read()
+                    fp.seek(0)
+                    validators[fileName] = self.getValidators(header)
+                elif cached and fileName in cached['bodies'] and status in (304, None):
+                    # not modified, or an optional file which could not be retrieved this time
+                    bodies[fileName] = cached['bodies'][fileName]
+                    validators[fileName] = cached['validators'][fileName]
+            if "node_state.txt" not in bodies:
                 raise MissingNodeStatus("Cannot get node state log. Retry in a minute if you just submitted the task")
 
-            site_url = url + "/error_summary.json"
-            # Before executing any new curl, truncate and clean temp file
-            fp, hbuf = self.cleanTempFileAndBuff(fp, hbuf)
-            curl.setopt(pycurl.URL, site_url)
-            self.logger.debug("Starting download of error summary file")
-            self.myPerform(curl, site_url)
-            self.logger.debug("Finished download of error summary file")
-            header = ResponseHeader(hbuf.getvalue())
-            if header.status == 200:
-                fp.seek(0)
+            if cached and bodies == cached['bodies']:
+                self.logger.debug("Task status files unchanged on the schedd, using the cached task status")
+                cached['validated'] = time.time()
+                return self.cachedWebStatus(cached, statusResult)
+
+            for fileName, body in bodies.items():
+                if fileName not in files or files[fileName][2] is None:
+                    fp = tempfile.TemporaryFile()
+                    fp.write(body)
+                    fp.seek(0)
+                    files[fileName] = (200, None, fp)
+
+            nodes = {}
+            warnings = statusResult['taskWarningMsg']
+            self.logger.debug("Starting parse of node state")
+            self.parseNodeState(files["node_state.txt"][2], nodes)
+            self.logger.debug("Finished parse of node state")
+
+            if "error_summary.json" in bodies:
                 self.logger.debug("Starting parse of summary file")
-                self.parseErrorReport(fp, nodes)
+                self.parseErrorReport(files["error_summary.json"][2], nodes)
                 self.logger.debug("Finished parse of summary file")
             else:
                 self.logger.debug("No error summary available")
 
-            # Before executing any new curl, truncate and clean temp file
-            fp, hbuf = self.cleanTempFileAndBuff(fp, hbuf)
-            aso_url = url + "/aso_status.json"
-            curl.setopt(pycurl.URL, aso_url)
-            self.logger.debug("Starting download of aso state")
-            curl.perform()
-            self.logger.debug("Finished download of aso state")
-            header = ResponseHeader(hbuf.getvalue())
-            if header.status == 200:
-                fp.seek(0)
+            if "aso_status.json" in bodies:
                 self.logger.debug("Starting parsing of aso state")
-                self.parseASOState(fp, nodes, statusResult)
+                self.parseASOState(files["aso_status.json"][2], nodes, statusResult)
                 self.logger.debug("Finished parsing of aso state")
             else:
                 self.logger.debug("No aso state file available")
+
+            bodiesSize = sum(len(body) for body in bodies.values())
+            if cacheKey and bodiesSize <= self.webStatusCacheMaxBytes:
+                newWarnings = statusResult['taskWarningMsg'][:len(statusResult['taskWarningMsg']) - len(warnings)]
+                self.webStatusCache.put(cacheKey, {'url': url, 'bodies': bodies, 'validators': validators,
+                                                   'nodes': dict(nodes), 'warnings': newWarnings,
+                                                   'validated': time.time()}, size=bodiesSize)
+            elif cacheKey:
+                self.webStatusCache.remove(cacheKey)
             return nodes
         finally:
-            fp.close()
-            hbuf.close()
+            for _, _, fp in files.values():
+                if fp:
+                    fp.close()
+
+    @classmethod
+    def cachedWebStatus(cls, cached, statusResult):
+        """ Return the cached jobs status, adding to statusResult the warnings found when it was parsed """
+        statusResult['taskWarningMsg'] = cached['warnings'] + statusResult['taskWarningMsg']
+        # status() only adds and removes nodes, so a shallow copy protects the cached ones
+        return dict(cached['nodes'])
 
     @conn_handler(services=['servercert'])
     def publicationStatus(self, workflow, asourl, asodb, user):
@@ -582,35 +678,39 @@ class HTCondorDataWorkflow(DataWorkflow):
             statusResult: the dictionary it is going to be returned by the status to the client.
                           we need this to add a warning in case there are jobs missing in the node_state file
         """
-        transfers = {}
         data = json.load(fp)
-        for docid, result in data['results'].iteritems():
-            #Oracle has an improved structure in aso_status
-            if isCouchDBURL(self.asoDBURL):
-                result = result['value']
-            else:
-                result = result[0]
+        # Oracle has an improved structure in aso_status
+        isCouch = isCouchDBURL(self.asoDBURL)
+        transferStates = {}
+        missingJobs = False
+        for result in data['results'].itervalues():
+            result = result['value'] if isCouch else result[0]
             jobid = str(result['jobid'])
-            if jobid not in nodes:
-                msg = ("It seems one or more jobs are missing from the node_state file."
-                       " It might be corrupted as a result of a disk failure on the schedd (maybe it is full?)"
-                       " This might be interesting for analysis operation (%s) %" + FEEDBACKMAIL)
-                statusResult['taskWarningMsg'] = [msg] + statusResult['taskWarningMsg']
-            if jobid in nodes and nodes[jobid]['State'] == 'transferring':
-                transfers.setdefault(jobid, {})[docid] = result['state']
-            return
-        for jobid in transfers:
+            node = nodes.get(jobid)
+            if node is None:
+                missingJobs = True
+            elif node['State'] == 'transferring':
+                transferStates.setdefault(jobid, set()).add(result['state'])
+        if missingJobs:
+            msg = ("It seems one or more jobs are missing from the node_state file."
+                   " It might be corrupted as a result of a disk failure on the schedd (maybe it is full?)"
+                   " This might be interesting for analysis operation (%s)" % FEEDBACKMAIL)
+            statusResult['taskWarningMsg'] = [msg] + statusResult['taskWarningMsg']
+        for jobid, states in transferStates.iteritems():
             ## The aso_status file is created/updated by the post-jobs when monitoring the
             ## transfers, i.e. after all transfer documents for the given job have been
             ## successfully inserted into the ASO database. Thus, if aso_status contains N
             ## documents for a given job_id it means there are exactly N files to transfer
             ## for that job.
-            if set(transfers[jobid].values()) == set(['done']):
+            if states == set(['done']):
                 nodes[jobid]['State'] = 'transferred'
 
 
     @classmethod
     def parseErrorReport(cls, fp, nodes):
+        """ Parse error_summary.json, which on the schedd is the view of the fjr_parse_results
+            journal written by the post-jobs, compacted periodically by the task_process.
+        """
         def last(joberrors):
             return joberrors[max(joberrors, key=int)]
         fp.seek(0)
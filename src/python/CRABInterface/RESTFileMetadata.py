@@ -1,6 +1,8 @@
+import json
+
 # WMCore dependecies here
 from WMCore.REST.Error import InvalidParameter
-from WMCore.REST.Server import RESTEntity, restcall
+from WMCore.REST.Server import RESTArgs, RESTEntity, restcall
 from WMCore.REST.Validation import validate_str, validate_strlist, validate_num
 
 # CRABServer dependecies here
@@ -8,7 +10,7 @@ from CRABInterface.RESTExtensions import authz_login_valid, authz_operator
 #from CRABInterface.Regexps import *
 from CRABInterface.Regexps import RX_CHECKSUM, RX_CMSSITE, RX_CMSSW, RX_FILESTATE, \
     RX_GLOBALTAG, RX_HOURS, RX_JOBID, RX_LFN, RX_LUMILIST, RX_OUTDSLFN, RX_OUTTYPES, \
-    RX_PARENTLFN, RX_PUBLISH, RX_RUNS, RX_TASKNAME
+    RX_PARENTLFN, RX_PUBLISH, RX_RUNS, RX_TASKNAME, RX_SUBPUTFILEMETADATA, RX_ANYTHING
 from CRABInterface.DataFileMetadata import DataFileMetadata
 
 class RESTFileMetadata(RESTEntity):
@@ -23,35 +25,14 @@ class RESTFileMetadata(RESTEntity):
         authz_login_valid()
 
         if method in ['PUT']:
+            validate_str("subresource", param, safe, RX_SUBPUTFILEMETADATA, optional=True)
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
-            validate_strlist("outfilelumis", param, safe, RX_LUMILIST)
-            validate_strlist("outfileruns", param, safe, RX_RUNS)
-            if len(safe.kwargs["outfileruns"]) != len(safe.kwargs["outfilelumis"]):
-                raise InvalidParameter("The number of runs and the number of lumis lists are different")
-            validate_strlist("inparentlfns", param, safe, RX_PARENTLFN)
-            # inparentlfns will be inserted in Oracle as CLOB, so it must be a string
-            safe.kwargs['inparentlfns'] = str(safe.kwargs['inparentlfns'])
-            validate_str("globalTag", param, safe, RX_GLOBALTAG, optional=True)
-            validate_str("jobid", param, safe, RX_JOBID, optional=True)
-            safe.kwargs["pandajobid"] = 0
-            validate_num("outsize", param, safe, optional=False)
-            validate_str("publishdataname", param, safe, RX_PUBLISH, optional=False)
-            validate_str("appver", param, safe, RX_CMSSW, optional=False)
-            validate_str("outtype", param, safe, RX_OUTTYPES, optional=False)
-            validate_str("checksummd5", param, safe, RX_CHECKSUM, optional=False)
-            validate_num("checksumcksum", param, safe, optional=False)
-            validate_str("checksumadler32", param, safe, RX_CHECKSUM, optional=False)
-            validate_str("outlocation", param, safe, RX_CMSSITE, optional=False)
-            validate_str("outtmplocation", param, safe, RX_CMSSITE, optional=False)
-            validate_str("acquisitionera", param, safe, RX_TASKNAME, optional=False)
-            validate_str("outdatasetname", param, safe, RX_OUTDSLFN, optional=False)
-            # need to use RX_PARENTLFN becasue same API is also used for input metadata
-            validate_str("outlfn", param, safe, RX_PARENTLFN, optional=False)
-            validate_str("outtmplfn", param, safe, RX_LFN, optional=True)
-            validate_num("events", param, safe, optional=False)
-            validate_str("filestate", param, safe, RX_FILESTATE, optional=True)
-            validate_num("directstageout", param, safe, optional=True)
-            safe.kwargs["directstageout"] = 'T' if safe.kwargs["directstageout"] else 'F' #'F' if not provided
+            if safe.kwargs['subresource'] == 'bulkinject':
+                # a JSON list of files, each with the same parameters of a single file PUT but the taskname
+                validate_str("filemetadata", param, safe, RX_ANYTHING, optional=False)
+                safe.kwargs['filemetadata'] = self.validateFileList(safe.kwargs['filemetadata'])
+            else:
+                self.validateFile(param, safe)
         elif method in ['POST']:
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
             validate_str("outlfn", param, safe, RX_LFN, optional=False)
@@ -69,6 +50,59 @@ class RESTFileMetadata(RESTEntity):
                 raise InvalidParameter("You have to specify a taskname or a number of hours. Files of this task or created before the number of hours"+\
                                         " will be deleted. Only one of the two parameters can be specified.")
 
+    @staticmethod
+    def validateFile(param, safe):
+        """Validate the metadata of one file, for the PUT of a single file or for each file of a bulkinject"""
+        validate_strlist("outfilelumis", param, safe, RX_LUMILIST)
+        validate_strlist("outfileruns", param, safe, RX_RUNS)
+        if len(safe.kwargs["outfileruns"]) != len(safe.kwargs["outfilelumis"]):
+            raise InvalidParameter("The number of runs and the number of lumis lists are different")
+        validate_strlist("inparentlfns", param, safe, RX_PARENTLFN)
+        # inparentlfns will be inserted in Oracle as CLOB, so it must be a string
+        safe.kwargs['inparentlfns'] = str(safe.kwargs['inparentlfns'])
+        validate_str("globalTag", param, safe, RX_GLOBALTAG, optional=True)
+        validate_str("jobid", param, safe, RX_JOBID, optional=True)
+        safe.kwargs["pandajobid"] = 0
+        validate_num("outsize", param, safe, optional=False)
+        validate_str("publishdataname", param, safe, RX_PUBLISH, optional=False)
+        validate_str("appver", param, safe, RX_CMSSW, optional=False)
+        validate_str("outtype", param, safe, RX_OUTTYPES, optional=False)
+        validate_str("checksummd5", param, safe, RX_CHECKSUM, optional=False)
+        validate_num("checksumcksum", param, safe, optional=False)
+        validate_str("checksumadler32", param, safe, RX_CHECKSUM, optional=False)
+        validate_str("outlocation", param, safe, RX_CMSSITE, optional=False)
+        validate_str("outtmplocation", param, safe, RX_CMSSITE, optional=False)
+        validate_str("acquisitionera", param, safe, RX_TASKNAME, optional=False)
+        validate_str("outdatasetname", param, safe, RX_OUTDSLFN, optional=False)
+        # need to use RX_PARENTLFN becasue same API is also used for input metadata
+        validate_str("outlfn", param, safe, RX_PARENTLFN, optional=False)
+        validate_str("outtmplfn", param, safe, RX_LFN, optional=True)
+        validate_num("events", param, safe, optional=False)
+        validate_str("filestate", param, safe, RX_FILESTATE, optional=True)
+        validate_num("directstageout", param, safe, optional=True)
+        safe.kwargs["directstageout"] = 'T' if safe.kwargs["directstageout"] else 'F' #'F' if not provided
+
+    @staticmethod
+    def validateFileList(fileList):
+        """Validate the JSON list of files of the bulkinject subresource, return the list of validated files"""
+        try:
+            files = json.loads(fileList)
+        except ValueError:
+            raise InvalidParameter("The filemetadata parameter is not a valid JSON document")
+        if not isinstance(files, list) or not files:
+            raise InvalidParameter("The filemetadata parameter must be a non empty list of files")
+        validated = []
+        for fileInfo in files:
+            if not isinstance(fileInfo, dict):
+                raise InvalidParameter("Each element of the filemetadata list must be a dictionary")
+            fileParam = RESTArgs([], dict(fileInfo))
+            fileSafe = RESTArgs([], {})
+            RESTFileMetadata.validateFile(fileParam, fileSafe)
+            if fileParam.kwargs:
+                raise InvalidParameter("Invalid file parameters: %s" % ", ".join(sorted(fileParam.kwargs)))
+            validated.append(fileSafe.kwargs)
+        return validated
+
     ## A few notes about how the following methods (put, post, get, delete) work when decorated with restcall.
     ## * The order of the arguments is irrelevant. For example, these two definitions are equivalent:
     ##   def get(self, a, b) or def get(self, b, a)
@@ -79,14 +113,11 @@ class RESTFileMetadata(RESTEntity):
     ## * The name of the arguments has to be the same as used in the http request, and the same as used in validate().
 
     @restcall
-    def put(self, taskname, outfilelumis, inparentlfns, globalTag, outfileruns, jobid, pandajobid, outsize, publishdataname, appver, outtype, checksummd5,\
-            checksumcksum, checksumadler32, outlocation, outtmplocation, outdatasetname, acquisitionera, outlfn, events, filestate, directstageout, outtmplfn):
-        """Insert a new job metadata information"""
-        return self.jobmetadata.inject(taskname=taskname, outfilelumis=outfilelumis, inparentlfns=inparentlfns, globalTag=globalTag, outfileruns=outfileruns,\
-                           jobid=jobid, pandajobid=pandajobid, outsize=outsize, publishdataname=publishdataname, appver=appver, outtype=outtype, checksummd5=checksummd5,\
-                           checksumcksum=checksumcksum, checksumadler32=checksumadler32, outlocation=outlocation, outtmplocation=outtmplocation,\
-                           outdatasetname=outdatasetname, acquisitionera=acquisitionera, outlfn=outlfn, outtmplfn=outtmplfn, events=events, filestate=filestate, \
-                           directstageout=directstageout)
+    def put(self, **kwargs):
+        """Insert a new job metadata information, or the ones of a list of files with subresource=bulkinject"""
+        if kwargs.pop('subresource') == 'bulkinject':
+            return self.jobmetadata.injectBulk(kwargs['taskname'], kwargs['filemetadata'])
+        return self.jobmetadata.inject(**kwargs)
 
     @restcall
     def post(self, taskname, outlfn, filestate):
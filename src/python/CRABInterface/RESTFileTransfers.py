@@ -207,13 +207,18 @@ class RESTFileTransfers(RESTEntity):
             if kwargs['list_of_retry_value'] is not None:
                 reasons = makeList(kwargs['list_of_failure_reason'])
                 retry = makeList(kwargs['list_of_retry_value'])
+            # update all documents with one executemany, the update is rolled back if any of them is not found
+            bindsList = []
             for num in range(len(ids)):
-                binds['publication_state'] = [PUBLICATIONDB_STATUSES[states[num]]]
-                binds['id'] = [ids[num]]
-                binds['fail_reason'] = [reasons[num]]
-                binds['retry_value'] = [int(retry[num])]
-                binds['publish'] = [kwargs["publish_flag"] or -1]
-                self.api.modify(self.transferDB.UpdatePublication_sql, **binds)
+                bindsList.append({'last_update': timeNow,
+                                  'asoworker': kwargs['asoworker'],
+                                  'publication_state': PUBLICATIONDB_STATUSES[states[num]],
+                                  'id': ids[num],
+                                  'fail_reason': reasons[num],
+                                  'retry_value': int(retry[num]),
+                                  'publish': kwargs["publish_flag"] or -1})
+            if bindsList:
+                self.api.modify(self.transferDB.UpdatePublication_sql, bindsList)
 
         elif subresource == 'retryPublication':
             ###############################################
@@ -14,6 +14,9 @@ import logging
 from ast import literal_eval
 from base64 import b64decode
 
+# Oracle does not accept more than 1000 expressions in an IN list
+PUBLICATIONSTATUS_MAX_TASKS = 1000
+
 
 class RESTTask(RESTEntity):
     """REST entity to handle interactions between CAFTaskWorker and TaskManager database"""
@@ -46,6 +49,7 @@ class RESTTask(RESTEntity):
             validate_str('taskstatus', param, safe, RX_STATUS, optional=True)
             validate_str('username', param, safe, RX_USERNAME, optional=True)
             validate_str('minutes', param, safe, RX_RUNS, optional=True)
+            validate_strlist('workflows', param, safe, RX_TASKNAME)
 
     @restcall
     def get(self, subresource, **kwargs):
@@ -306,6 +310,24 @@ class RESTTask(RESTEntity):
         return []
 
 
+    def publicationstatus(self, **kwargs):
+        """ Retrieves status, publication flag and last publication time of a list of tasks.
+            Used by the Publisher to get the information of all the tasks it works on with a few calls.
+            curl -X GET 'https://mmascher-dev6.cern.ch/crabserver/dev/task?subresource=publicationstatus&workflows=150224_230633:mmascher_crab_testecmmascher-dev6_3&workflows=...' \
+                        -k --key /tmp/x509up_u8440 --cert /tmp/x509up_u8440 -v
+        """
+        if 'workflows' not in kwargs or not kwargs['workflows']:
+            raise InvalidParameter("Task names not found in the input parameters")
+        if len(kwargs['workflows']) > PUBLICATIONSTATUS_MAX_TASKS:
+            raise InvalidParameter("Too many task names, at most %d can be asked in one call" % PUBLICATIONSTATUS_MAX_TASKS)
+
+        binds = dict(('workflow%d' % num, workflow) for num, workflow in enumerate(kwargs['workflows']))
+        sql = self.Task.PublicationStatus_sql % ', '.join(':%s' % bind for bind in binds)
+        rows = self.api.query(None, None, sql, **binds)
+
+        return rows
+
+
     def addwebdir(self, **kwargs):
         """ Add web directory to web_dir column in the database. Can be tested with:
             curl -X POST https://balcas-crab.cern.ch/crabserver/dev/task -k --key $X509_USER_PROXY --cert $X509_USER_PROXY \
@@ -41,6 +41,10 @@ class RESTWorkerWorkflow(RESTEntity):
             validate_str("subresource", param, safe, RX_SUBPOSTWORKER, optional=True)
             validate_num("limit", param, safe, optional=True)
             validate_num("clusterid", param, safe, optional=True) #clusterid of the dag
+            # lists used by the bulkstate subresource: one element per task
+            validate_strlist("workflows", param, safe, RX_TASKNAME)
+            validate_strlist("commands", param, safe, RX_STATUS)
+            validate_strlist("statuses", param, safe, RX_STATUS)
             # possible combinations to check
             # 1) taskname + status
             # 2) taskname + status + failure
@@ -48,6 +52,7 @@ class RESTWorkerWorkflow(RESTEntity):
             # 4) taskname + status == (1)
             # 5)            status + limit + getstatus + workername
             # 6) taskname + runs + lumis
+            # 7) workflows + commands + statuses (bulkstate)
         elif method in ['GET']:
             validate_str("workername", param, safe, RX_WORKER_NAME, optional=True)
             validate_str("getstatus", param, safe, RX_STATUS, optional=True)
@@ -59,8 +64,11 @@ class RESTWorkerWorkflow(RESTEntity):
 
 
     @restcall
-    def post(self, workflow, status, command, subresource, failure, resubmittedjobs, getstatus, workername, limit, clusterid):
+    def post(self, workflow, status, command, subresource, failure, resubmittedjobs, getstatus, workername, limit, clusterid,
+             workflows, commands, statuses):
         """ Updates task information """
+        if subresource == 'bulkstate':
+            return self.bulkState(workflows, commands, statuses)
         if failure is not None:
             try:
                 failure = b64decode(failure)
@@ -87,6 +95,29 @@ class RESTWorkerWorkflow(RESTEntity):
         methodmap[subresource]['method'](*methodmap[subresource]['args'], **methodmap[subresource]['kwargs'])
         return []
 
+    def bulkState(self, workflows, commands, statuses):
+        """ Set status and command of many tasks with a single executemany of SetStatusTask_sql.
+            The three lists are aligned, i.e. the i-th task gets the i-th command and status.
+            Return one dictionary per task telling if the task has been updated. When the number
+            of modified rows does not match the number of tasks the status of each task is read
+            back from the DB to find out which ones were not updated (e.g. unknown tasknames).
+        """
+        if not workflows:
+            raise InvalidParameter("The bulkstate subresource needs a non empty list of workflows")
+        if not len(workflows) == len(commands) == len(statuses):
+            raise InvalidParameter("The workflows, commands and statuses lists must have the same length")
+        binds = [{"taskname": taskname, "command": cmd, "status": st} for taskname, cmd, st in zip(workflows, commands, statuses)]
+        modified = self.api.modifynocheck(self.Task.SetStatusTask_sql, binds)
+        if next(iter(modified))["modified"] == len(binds):
+            return [{"workflow": taskname, "updated": True} for taskname in workflows]
+        result = []
+        for bind in binds:
+            rows = self.api.query(None, None, self.Task.IDAll_sql, taskname=bind["taskname"])
+            row = next(iter(rows), None)
+            updated = row is not None and row[1] == bind["status"].upper() and row[2] == bind["command"].upper()
+            result.append({"workflow": bind["taskname"], "updated": updated})
+        return result
+
     @restcall
     def get(self, workername, getstatus, limit, subresource):
         """ Retrieve all columns for a specified task or
@@ -80,7 +80,7 @@ RX_SUBRESTAT = re.compile(r"^(errors|report2|logs|data|logs2|data2|resubmit|resu
 
 #subresources of the ServerInfo (/info) and Task (/task) resources
 RX_SUBRES_SI = re.compile(r"^(delegatedn|backendurls|version|bannedoutdest|scheddaddress|ignlocalityblacklist)$")
-RX_SUBRES_TASK = re.compile(r"^(allinfo|allusers|summary|search|taskbystatus|getpublishurl|addwarning|deletewarnings|addwebdir|addoutputdatasets|addddmreqid|webdir|webdirprx|counttasksbystatus|lastfailures|updateschedd|updatepublicationtime)$")
+RX_SUBRES_TASK = re.compile(r"^(allinfo|allusers|summary|search|taskbystatus|getpublishurl|addwarning|deletewarnings|addwebdir|addoutputdatasets|addddmreqid|webdir|webdirprx|counttasksbystatus|lastfailures|updateschedd|updatepublicationtime|publicationstatus)$")
 
 #subresources of Cache resource
 RX_SUBRES_CACHE = re.compile(r"^(upload|download|retrieve|list|used)$")
@@ -102,8 +102,10 @@ RX_TEXT_FAIL = re.compile(r"^[A-Za-z0-9\-\._\s\=\+/]{0,10000}$")
 ## user dn
 RX_DN = re.compile(r"^/(?:C|O|DC)=.*/CN=.")
 ## worker subresources
-RX_SUBPOSTWORKER = re.compile(r"^(state|start|failure|success|process|lumimask)$")
+RX_SUBPOSTWORKER = re.compile(r"^(state|bulkstate|start|failure|success|process|lumimask)$")
 RX_SUBGETWORKER = re.compile(r"jobgroup")
+## filemetadata subresources
+RX_SUBPUTFILEMETADATA = re.compile(r"^(bulkinject)$")
 
 # Schedulers
 RX_SCHEDULER = re.compile(r"^(panda|condor)$")
@@ -2,7 +2,8 @@ from __future__ import division
 from __future__ import print_function
 import logging
 import os
-from collections import namedtuple
+import threading
+from collections import namedtuple, OrderedDict
 from time import mktime, gmtime
 import re
 from hashlib import sha1
@@ -32,6 +33,51 @@ serverKey = None
 serverDN = None
 credServerPath = None
 
+
+class LRUCache(object):
+    """
+    Thread safe dictionary holding at most maxSize entries whose sizes add up to at most
+    maxBytes (if given), the least recently used ones are evicted when it is full
+    """
+    def __init__(self, maxSize, maxBytes=None):
+        self.maxSize = maxSize
+        self.maxBytes = maxBytes
+        self.totalBytes = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key: (value, size)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            self.entries[key] = entry
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        """ :param size: the size in bytes accounted for this entry """
+        with self.lock:
+            self._pop(key)
+            if self.maxBytes is not None and size > self.maxBytes:
+                return
+            self.entries[key] = (value, size)
+            self.totalBytes += size
+            while len(self.entries) > self.maxSize or \
+                    (self.maxBytes is not None and self.totalBytes > self.maxBytes):
+                _, (_, evictedSize) = self.entries.popitem(last=False)
+                self.totalBytes -= evictedSize
+
+    def remove(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        """ remove an entry, the lock must be held """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.totalBytes -= entry[1]
+
+
 def getDBinstance(config, namespace, name):
     if config.backend.lower() == 'mysql':
         backend = 'MySQL'
@@ -79,6 +79,19 @@ class FileMetaData(object):
     Update_sql = """UPDATE filemetadata SET fmd_tmp_location = :outtmplocation, fmd_size = :outsize, fmd_tmplfn = :outtmplfn \
                     WHERE tm_taskname = :taskname AND fmd_lfn = :outlfn"""
 
+    # INSERT the file as New_sql or, if it already exists, UPDATE it as Update_sql
+    Merge_sql = "MERGE INTO filemetadata fmd \
+                 USING (SELECT :taskname AS tm_taskname, :outlfn AS fmd_lfn FROM dual) newfile \
+                 ON (fmd.tm_taskname = newfile.tm_taskname AND fmd.fmd_lfn = newfile.fmd_lfn) \
+                 WHEN MATCHED THEN UPDATE SET fmd.fmd_tmp_location = :outtmplocation, fmd.fmd_size = :outsize, fmd.fmd_tmplfn = :outtmplfn \
+                 WHEN NOT MATCHED THEN INSERT ( \
+                   tm_taskname, panda_job_id, job_id, fmd_outdataset, fmd_acq_era, fmd_sw_ver, fmd_in_events, fmd_global_tag,\
+                   fmd_publish_name, fmd_location, fmd_tmp_location, fmd_runlumi, fmd_adler32, fmd_cksum, fmd_md5, fmd_lfn, fmd_size,\
+                   fmd_type, fmd_parent, fmd_creation_time, fmd_filestate, fmd_direct_stageout, fmd_tmplfn) \
+                 VALUES (:taskname, :pandajobid, :jobid, :outdatasetname, :acquisitionera, :appver, :events, :globalTag,\
+                   :publishdataname, :outlocation, :outtmplocation, :runlumi, :checksumadler32, :checksumcksum, :checksummd5, :outlfn, :outsize,\
+                   :outtype, :inparentlfns, SYS_EXTRACT_UTC(SYSTIMESTAMP), :filestate, :directstageout, :outtmplfn)"
+
     #the field selected here is not used, the query is only executed to check if a filemetadata for the file was already uploaded or not
     GetCurrent_sql = "SELECT fmd_lfn from filemetadata WHERE tm_taskname = :taskname AND fmd_lfn = :outlfn"
 
@@ -166,6 +166,11 @@ class Task(object):
     UpdatePublicationTime_sql = """UPDATE tasks SET tm_last_publication = SYS_EXTRACT_UTC(SYSTIMESTAMP) \
                               WHERE tm_taskname = :workflow"""
 
+    #PublicationStatus_sql, the IN list is filled with one bind variable for each task
+    PublicationStatus_sql = """SELECT tm_taskname, tm_task_status, tm_publication, \
+                              TO_CHAR(tm_last_publication, 'YYYY-MM-DD HH24:MI:SS.FF6') AS tm_last_publication \
+                              FROM tasks WHERE tm_taskname IN (%s)"""
+
     #TaskDDMReqId
     UpdateDDMReqId_sql = """UPDATE tasks SET tm_task_status = upper(:taskstatus), tm_DDM_reqid = :ddmreqid \
                               WHERE tm_taskname = :workflow"""
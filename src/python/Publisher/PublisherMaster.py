@@ -5,8 +5,8 @@ Here's the algorithm
 
 1. get active users
 2. choose N users where N is from the config
-3. create a multiprocessing Pool of size N
-4. spawn a process per task that publish their files
+3. create a pool of N long lived worker processes (once, at the first cycle)
+4. hand each task to a free worker, which publishes its files
 """
 
 from __future__ import division
@@ -21,16 +21,20 @@ import sys
 import json
 from datetime import datetime
 import time
-from multiprocessing import Process
 from MultiProcessingLog import MultiProcessingLog
 
 from WMCore.Configuration import loadConfigurationFile
 
 from RESTInteractions import CRABRest
-from ServerUtilities import getColumn, encodeRequest, oracleOutputMapping, executeCommand
+from ServerUtilities import getColumn, encodeRequest, oracleOutputMapping, updatePublicationState
 from ServerUtilities import SERVICE_INSTANCES
 from TaskWorker import __version__
 from TaskWorker.WorkerExceptions import ConfigException
+from Publisher.TaskPublish import publishInDBS3
+from Publisher.WorkerPool import WorkerPool
+
+# max number of tasks in a call to the publicationstatus API, the tasknames go in the URL
+TASK_STATUS_CHUNK_SIZE = 40
 
 
 def chunks(l, n):
@@ -57,9 +61,10 @@ def setMasterLogger(name='master'):
 
 def setSlaveLogger(name):
     """ Set the logger for a single slave process. The file used for it is logs/processes/proc.name.txt and it
-        can be retrieved with logging.getLogger(name) in other parts of the code
+        can be retrieved with logging.getLogger('slave.' + name) in other parts of the code
+        (the logger named after the task is the one used by TaskPublish)
     """
-    logger = logging.getLogger(name)
+    logger = logging.getLogger('slave.%s' % name)
     fileName = os.path.join('logs', 'processes', "proc.c3id_%s.txt" % name)
     #handler = TimedRotatingFileHandler(fileName, 'midnight', backupCount=30)
     # slaves are short lived, use one log file for each
@@ -69,6 +74,39 @@ def setSlaveLogger(name):
     logger.addHandler(handler)
     return logger
 
+def forgetLogger(name):
+    """ Close and remove all handlers of a logger and drop it from the registry of the logging module,
+        so that a long lived worker does not keep one log file open and one logger for each task it
+        worked on. The next logging.getLogger(name) creates a new logger
+    """
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+    logging._acquireLock()  # pylint: disable=protected-access
+    try:
+        manager = logging.Logger.manager
+        manager.loggerDict.pop(name, None)
+        # getLogger also registered a placeholder for each dotted prefix of the name
+        while '.' in name:
+            name = name.rsplit('.', 1)[0]
+            holder = manager.loggerDict.get(name)
+            if isinstance(holder, logging.PlaceHolder):
+                holder.loggerMap.pop(logger, None)
+                if not holder.loggerMap:
+                    del manager.loggerDict[name]
+    finally:
+        logging._releaseLock()  # pylint: disable=protected-access
+
+def parseLastPublicationTime(date):
+    """ Convert the last publication time of a task as returned by the REST (datetime in Oracle
+        format) into seconds since Epoch (float). Return None if there is no last publication time
+    """
+    if not date:
+        return None
+    timetuple = datetime.strptime(date, "%Y-%m-%d %H:%M:%S.%f").timetuple()  # convert to time tuple
+    return time.mktime(timetuple)      # convert to seconds since Epoch (float)
+
 
 class Master(object):
     """I am the main daemon kicking off all Publisher work via slave Publishers"""
@@ -152,8 +190,9 @@ class Master(object):
                 logger.info('%s: %s', k, v)
             return
 
-        self.configurationFile = confFile         # remember this, will have to pass it to TaskPublish
+        self.configurationFile = confFile
         config = loadConfigurationFile(confFile)
+        self.fullConfig = config                  # TaskPublish needs the full configuration
         self.config = config.General
         self.TPconfig = config.TaskPublisher
 
@@ -165,6 +204,7 @@ class Master(object):
         self.force_publication = False
         self.force_failure = False
         self.TestMode = testMode
+        self.workerPool = None
         self.taskFilesDir = self.config.taskFilesDir
         createLogdir(self.taskFilesDir)
         createLogdir(os.path.join(self.taskFilesDir, 'FailedBlocks'))
@@ -268,9 +308,10 @@ class Master(object):
                                                     x['taskname']]
                                                   ) for x in filesToPublish if x['transfer_state'] == 3)]
 
-        info = []
-        for task in unique_tasks:
-            info.append([x for x in filesToPublish if x['taskname'] == task[3]])
+        filesByTask = {}
+        for x in filesToPublish:
+            filesByTask.setdefault(x['taskname'], []).append(x)
+        info = [filesByTask[task[3]] for task in unique_tasks]
         return zip(unique_tasks, info)
 
     def getPublDescFiles(self, workflow, lfn_ready, logger):
@@ -295,14 +336,44 @@ class Master(object):
             return out
 
         metadataList = [json.loads(md) for md in res['result']]  # CRAB REST returns a list of JSON objects
-        for md in metadataList:
-            # pick only the metadata we need
-            if md['lfn'] in lfn_ready:
-                out.append(md)
+        # pick only the metadata we need
+        lfn_ready = set(lfn_ready)
+        out = [md for md in metadataList if md['lfn'] in lfn_ready]
 
         logger.info('Got filemetadata for %d LFNs', len(out))
         return out
 
+    @staticmethod
+    def matchPublDescFiles(active_, publDescFiles_list, username, userDN):
+        """
+        Attach the publication description (filemetadata) to each file ready for publication
+        :param active_: list of transfer documents as built in startSlave
+        :param publDescFiles_list: list of filemetadata as returned by getPublDescFiles
+        :return: a tuple (toPublish, toFail) with the list of filemetadata to publish and
+                 the list of source LFNs of the files for which no metadata was found
+        """
+        toPublish = []
+        toFail = []
+        # in case of duplicates use the first metadata for each LFN
+        docsByLfn = {}
+        for doc in publDescFiles_list:
+            docsByLfn.setdefault(doc["lfn"], doc)
+        for file_ in active_:
+            doc = docsByLfn.get(file_["value"][2])
+            # if we failed to find metadata mark publication as failed to avoid to keep looking
+            # at same files over and over
+            if doc is None:
+                toFail.append(file_["value"][1])
+                continue
+            doc["User"] = username
+            doc["Group"] = file_["key"][1]
+            doc["Role"] = file_["key"][2]
+            doc["UserDN"] = userDN
+            doc["Destination"] = file_["value"][0]
+            doc["SourceLFN"] = file_["value"][1]
+            toPublish.append(doc)
+        return toPublish, toFail
+
     def algorithm(self):
         """
         1. Get a list of files to publish from the REST and organize by taskname
@@ -332,42 +403,39 @@ class Master(object):
             flag = '(***)' if acquiredFiles > 1000 else '     '  # mark suspicious tasks
             self.logger.debug('%s %5d : %s', flag, acquiredFiles, taskName)
 
-        processes = []
-
-        try:
-            for task in tasks:
-                taskname = str(task[0][3])
-                # this IF is for testing on preprod or dev DB's, which are full of old unpublished tasks
-                if int(taskname[0:4]) < 2008:
-                    self.logger.info("Skipped %s. Ignore tasks created before August 2020.", taskname)
-                    continue
-                if self.TestMode:
-                    self.startSlave(task)   # sequentially do one task after another
-                    continue
-                else:                       # deal with each task in a separate process
-                    p = Process(target=self.startSlave, args=(task,))
-                    p.start()
-                    self.logger.info('Starting process %s  pid=%s', p, p.pid)
-                    self.logger.info('PID %s will work on task %s', p.pid, taskname)
-                    processes.append(p)
-                if len(processes) == maxSlaves:
-                    while len(processes) == maxSlaves:
-                        # wait until one process has completed
-                        time.sleep(10)
-                        for proc in processes:
-                            if not proc.is_alive():
-                                self.logger.info('Terminated: %s pid=%s', proc, proc.pid)
-                                processes.remove(proc)
-
-        except Exception:
-            self.logger.exception("Error during process mapping")
-        self.logger.info('No more tasks to care for. Wait for remaining %d processes to terminate', len(processes))
-        while (processes):
-            time.sleep(10)
-            for proc in processes:
-                if not proc.is_alive():
-                    self.logger.info('Terminated: %s pid=%s', proc, proc.pid)
-                    processes.remove(proc)
+        tasksToDo = []
+        for task in tasks:
+            taskname = str(task[0][3])
+            # this IF is for testing on preprod or dev DB's, which are full of old unpublished tasks
+            if int(taskname[0:4]) < 2008:
+                self.logger.info("Skipped %s. Ignore tasks created before August 2020.", taskname)
+                continue
+            tasksToDo.append(task)
+
+        # retrieve in one go status and last publication time of the tasks which need them
+        # in startSlave, if this fails they are retrieved there task by task
+        tasknames = [str(task[0][3]) for task in tasksToDo if len(task[1]) <= self.max_files_per_block]
+        statusByTask = self.getTasksPublicationStatus(tasknames) if tasknames else {}
+        tasksToDo = [(task[0], task[1], statusByTask.get(str(task[0][3])) if statusByTask is not None else None)
+                     for task in tasksToDo]
+
+        if self.TestMode:
+            for task in tasksToDo:
+                self.startSlave(task)   # sequentially do one task after another
+        else:
+            # deal with each task in a worker process. Workers are started at the first cycle
+            # and live as long as the master
+            if self.workerPool is None:
+                self.workerPool = WorkerPool(self.publishTask, maxSlaves,
+                                             getattr(self.config, 'task_timeout', 7200), self.logger)
+            try:
+                results = self.workerPool.run(tasksToDo, taskName=lambda task: str(task[0][3]))
+                errors = [error for _, _, error in results if error]
+                publishedFiles = sum(summary['publishedFiles'] for _, summary, _ in results if summary)
+                self.logger.info('Worked on %d tasks: published %d files, %d tasks failed or timed out',
+                                 len(results), publishedFiles, len(errors))
+            except Exception:
+                self.logger.exception("Error during process mapping")
 
         self.logger.info("Algorithm iteration completed")
         self.logger.info("Wait %d sec for next cycle", self.pollInterval())
@@ -376,19 +444,147 @@ class Master(object):
         # a change in Publisher/stop.sh otherwise that script will break
         self.logger.info("Next cycle will start at %s", newStartTime)
 
+    def publishTask(self, task):
+        """
+        executed by the worker processes for each task, see startSlave
+        """
+        try:
+            return self.startSlave(task)
+        finally:
+            forgetLogger('slave.%s' % task[0][3])
+            forgetLogger(str(task[0][3]))
+
+    def getWorkflowStatus(self, workflow, logger):
+        """
+        Retrieve the status of a task from the workflow API, which asks the schedd
+        :return: the task status, '' if it could not be parsed or None if the REST call failed
+        """
+        workflow_status = ''
+        msg = "Retrieving status"
+        logger.info(msg)
+        data = encodeRequest({'workflow': workflow})
+        try:
+            res = self.crabServer.get(api='workflow', data=data)
+        except Exception as ex:
+            logger.warn('Error retrieving status from crabserver for %s:\n%s', workflow, str(ex))
+            return None
+
+        try:
+            workflow_status = res[0]['result'][0]['status']
+            msg = "Task status is %s." % workflow_status
+            logger.info(msg)
+        except ValueError:
+            msg = "Workflow removed from WM."
+            logger.error(msg)
+            workflow_status = 'REMOVED'
+        except Exception as ex:
+            msg = "Error loading task status!"
+            msg += str(ex)
+            msg += str(traceback.format_exc())
+            logger.error(msg)
+        return workflow_status
+
+    def getLastPublicationTime(self, workflow, logger):
+        """
+        Get when was the last time a publication was done for this workflow (this
+        should be more or less independent of the output dataset in case there are
+        more than one).
+        :return: seconds since Epoch or None
+        """
+        msg = "Getting last publication time."
+        logger.info(msg)
+        last_publication_time = None
+        data = encodeRequest({'workflow':workflow, 'subresource':'search'})
+        try:
+            result = self.crabServer.get(api='task', data=data)
+            logger.debug("task: %s ", str(result[0]))
+            last_publication_time = getColumn(result[0], 'tm_last_publication')
+        except Exception as ex:
+            logger.error("Error during task doc retrieving:\n%s", ex)
+        return parseLastPublicationTime(last_publication_time)
+
+    def publicationTimedOut(self, last_publication_time, logger):
+        """
+        :param last_publication_time: seconds since Epoch or None
+        :return: True if there was no previous publication or it was done longer than
+                 the block publication timeout ago, i.e. publication needs to be forced
+        """
+        msg = "Last publication time: %s." % str(last_publication_time)
+        logger.debug(msg)
+        # If this is the first time a publication would be done for this workflow, go
+        # ahead and publish.
+        if not last_publication_time:
+            msg = "There was no previous publication. Will force publication."
+            logger.info(msg)
+            return True
+        # Otherwise...
+        last = last_publication_time
+        msg = "Last published block time: %s" % last
+        logger.debug(msg)
+        # If the last publication was long time ago (> our block publication timeout),
+        # go ahead and publish.
+        now = int(time.time()) - time.timezone
+        time_since_last_publication = now - last
+        hours = int(time_since_last_publication/60/60)
+        minutes = int((time_since_last_publication - hours*60*60)/60)
+        timeout_hours = int(self.block_publication_timeout/60/60)
+        timeout_minutes = int((self.block_publication_timeout - timeout_hours*60*60)/60)
+        msg = "Last publication was %sh:%sm ago" % (hours, minutes)
+        timedOut = time_since_last_publication > self.block_publication_timeout
+        if timedOut:
+            msg += " (more than the timeout of %sh:%sm)." % (timeout_hours, timeout_minutes)
+            msg += " Will force publication."
+        else:
+            msg += " (less than the timeout of %sh:%sm)." % (timeout_hours, timeout_minutes)
+            msg += " Not enough to force publication."
+        logger.info(msg)
+        return timedOut
+
+    def getTasksPublicationStatus(self, tasknames):
+        """
+        Retrieve status, publication flag and last publication time of all tasks of this cycle
+        with one call to the task API every TASK_STATUS_CHUNK_SIZE tasks, instead of two calls
+        for each task in startSlave
+        :return: a dictionary {taskname: {'task_status': ..., 'publication': ..., 'last_publication': ...}}
+                 with last_publication in seconds since Epoch or None, or None if the REST call failed
+        """
+        statusByTask = {}
+        nCalls = 0
+        for chunk in chunks(tasknames, TASK_STATUS_CHUNK_SIZE):
+            data = encodeRequest({'subresource': 'publicationstatus', 'workflows': chunk}, listParams=['workflows'])
+            try:
+                result = self.crabServer.get(api='task', data=data)
+                nCalls += 1
+                for row in oracleOutputMapping(result):
+                    row['last_publication'] = parseLastPublicationTime(row['last_publication'])
+                    statusByTask[row['taskname']] = row
+            except Exception as ex:
+                self.logger.error("Failed to retrieve the status of the tasks from crabserver: %s", ex)
+                self.logger.error("Status and last publication time will be retrieved for each task")
+                return None
+        self.logger.info("Retrieved status and last publication time of %d tasks with %d REST calls",
+                         len(statusByTask), nCalls)
+        return statusByTask
+
     def startSlave(self, task):
         """
-        start a slave process to deal with publication for a single task
-        :param task: one tupla describing  a task as returned by  active_tasks()
-        :return: 0  It will always terminate normally, if publication fails it will mark it in the DB
+        deal with publication for a single task
+        :param task: one tupla describing  a task as returned by  active_tasks(), with a third element
+                     containing the task status retrieved by getTasksPublicationStatus(), or None
+        :return: the summary dictionary written by TaskPublish, or None if there was nothing to publish
+                 or it failed. It will always terminate normally, if publication fails it will mark it in the DB
         """
         # TODO: lock task!
         # - process logger
         logger = setSlaveLogger(str(task[0][3]))
         logger.info("Process %s is starting. PID %s", task[0][3], os.getpid())
 
+        # workers are reused for many tasks, reset what was set for the previous one
         self.force_publication = False
+        self.force_failure = False
+        self.lfn_map = {}
         workflow = str(task[0][3])
+        summary = None
 
         if len(task[1]) > self.max_files_per_block:
             self.force_publication = True
@@ -398,31 +594,20 @@ class Master(object):
         else:
             msg = "At least one dataset has less than %s ready files." % (self.max_files_per_block)
             logger.info(msg)
-            # Retrieve the workflow status. If the status can not be retrieved, continue
-            # with the next workflow.
-            workflow_status = ''
-            msg = "Retrieving status"
-            logger.info(msg)
-            data = encodeRequest({'workflow': workflow})
-            try:
-                res = self.crabServer.get(api='workflow', data=data)
-            except Exception as ex:
-                logger.warn('Error retrieving status from crabserver for %s:\n%s', workflow, str(ex))
-                return 0
-
-            try:
-                workflow_status = res[0]['result'][0]['status']
-                msg = "Task status is %s." % workflow_status
-                logger.info(msg)
-            except ValueError:
-                msg = "Workflow removed from WM."
-                logger.error(msg)
-                workflow_status = 'REMOVED'
-            except Exception as ex:
-                msg = "Error loading task status!"
-                msg += str(ex)
-                msg += str(traceback.format_exc())
-                logger.error(msg)
+            taskStatus = task[2] if len(task) > 2 else None
+            if taskStatus is None:
+                # Retrieve the workflow status. If the status can not be retrieved, continue
+                # with the next workflow.
+                workflow_status = self.getWorkflowStatus(workflow, logger)
+                if workflow_status is None:
+                    return None
+            elif taskStatus['task_status'] in ['FAILED', 'KILLED']:
+                # the workflow API would return the status in the DB, no need to ask the schedd
+                workflow_status = taskStatus['task_status']
+                logger.info("Task status is %s.", workflow_status)
+            else:
+                # a task can be COMPLETED only according to the schedd, ask for it only if needed
+                workflow_status = ''
             # If the workflow status is terminal, go ahead and publish all the ready files
             # in the workflow.
             if workflow_status in ['COMPLETED', 'FAILED', 'KILLED', 'REMOVED']:
@@ -432,57 +617,26 @@ class Master(object):
                 msg = "Considering task status as terminal. Will force publication."
                 logger.info(msg)
             # Otherwise...
-            else:    ## TODO put this else in a function like def checkForPublication()
-                msg = "Task status is not considered terminal."
-                logger.info(msg)
-                msg = "Getting last publication time."
-                logger.info(msg)
-                # Get when was the last time a publication was done for this workflow (this
-                # should be more or less independent of the output dataset in case there are
-                # more than one).
-                last_publication_time = None
-                data = encodeRequest({'workflow':workflow, 'subresource':'search'})
-                try:
-                    result = self.crabServer.get(api='task', data=data)
-                    logger.debug("task: %s ", str(result[0]))
-                    last_publication_time = getColumn(result[0], 'tm_last_publication')
-                except Exception as ex:
-                    logger.error("Error during task doc retrieving:\n%s", ex)
-                if last_publication_time:
-                    date = last_publication_time # datetime in Oracle format
-                    timetuple = datetime.strptime(date, "%Y-%m-%d %H:%M:%S.%f").timetuple()  # convert to time tuple
-                    last_publication_time = time.mktime(timetuple)      # convert to seconds since Epoch (float)
-
-                msg = "Last publication time: %s." % str(last_publication_time)
-                logger.debug(msg)
-                # If this is the first time a publication would be done for this workflow, go
-                # ahead and publish.
-                if not last_publication_time:
-                    self.force_publication = True
-                    msg = "There was no previous publication. Will force publication."
+            else:
+                if taskStatus is None:
+                    msg = "Task status is not considered terminal."
                     logger.info(msg)
-                # Otherwise...
+                    last_publication_time = self.getLastPublicationTime(workflow, logger)
                 else:
-                    last = last_publication_time
-                    msg = "Last published block time: %s" % last
-                    logger.debug(msg)
-                    # If the last publication was long time ago (> our block publication timeout),
-                    # go ahead and publish.
-                    now = int(time.time()) - time.timezone
-                    time_since_last_publication = now - last
-                    hours = int(time_since_last_publication/60/60)
-                    minutes = int((time_since_last_publication - hours*60*60)/60)
-                    timeout_hours = int(self.block_publication_timeout/60/60)
-                    timeout_minutes = int((self.block_publication_timeout - timeout_hours*60*60)/60)
-                    msg = "Last publication was %sh:%sm ago" % (hours, minutes)
-                    if time_since_last_publication > self.block_publication_timeout:
+                    last_publication_time = taskStatus['last_publication']
+                self.force_publication = self.publicationTimedOut(last_publication_time, logger)
+                if not self.force_publication and taskStatus is not None:
+                    workflow_status = self.getWorkflowStatus(workflow, logger)
+                    if workflow_status is None:
+                        return None
+                    if workflow_status in ['COMPLETED', 'FAILED', 'KILLED', 'REMOVED']:
                         self.force_publication = True
-                        msg += " (more than the timeout of %sh:%sm)." % (timeout_hours, timeout_minutes)
-                        msg += " Will force publication."
+                        self.force_failure = workflow_status in ['KILLED', 'REMOVED']
+                        msg = "Considering task status as terminal. Will force publication."
+                        logger.info(msg)
                     else:
-                        msg += " (less than the timeout of %sh:%sm)." % (timeout_hours, timeout_minutes)
-                        msg += " Not enough to force publication."
-                    logger.info(msg)
+                        msg = "Task status is not considered terminal."
+                        logger.info(msg)
 
         # logger.info(task[1])
         try:
@@ -523,26 +677,7 @@ class Master(object):
                 toPublish = []
                 toFail = []
                 publDescFiles_list = self.getPublDescFiles(workflow, lfn_ready, logger)
-                for file_ in active_:
-                    metadataFound = False
-                    for doc in publDescFiles_list:
-                        # logger.info(type(doc))
-                        # logger.info(doc)
-                        if doc["lfn"] == file_["value"][2]:
-                            doc["User"] = username
-                            doc["Group"] = file_["key"][1]
-                            doc["Role"] = file_["key"][2]
-                            doc["UserDN"] = self.myDN
-                            doc["Destination"] = file_["value"][0]
-                            doc["SourceLFN"] = file_["value"][1]
-                            toPublish.append(doc)
-                            metadataFound = True
-                            break
-
-                    # if we failed to find metadata mark publication as failed to avoid to keep looking
-                    # at same files over and over
-                    if not metadataFound:
-                        toFail.append(file_["value"][1])
+                toPublish, toFail = self.matchPublDescFiles(active_, publDescFiles_list, username, self.myDN)
                 with open(self.taskFilesDir + workflow + '.json', 'w') as outfile:
                     json.dump(toPublish, outfile)
                 logger.debug('Unitarity check: active_:%d toPublish:%d toFail:%d', len(active_), len(toPublish), len(toFail))
@@ -550,46 +685,17 @@ class Master(object):
                     logger.error("SOMETHING WRONG IN toPublish vs toFail !!")
                 if toFail:
                     logger.info('Did not find useful metadata for %d files. Mark as failed', len(toFail))
-                    from ServerUtilities import getHashLfn
-                    nMarked = 0
-                    for lfn in toFail:
-                        source_lfn = lfn
-                        docId = getHashLfn(source_lfn)
-                        data = dict()
-                        data['asoworker'] = self.config.asoworker
-                        data['subresource'] = 'updatePublication'
-                        data['list_of_ids'] = docId
-                        data['list_of_publication_state'] = 'FAILED'
-                        data['list_of_retry_value'] = 1
-                        data['list_of_failure_reason'] = 'File type not EDM or metadata not found'
-                        try:
-                            result = self.crabServer.post(api='filetransfers', data=encodeRequest(data))
-                            #logger.debug("updated DocumentId: %s lfn: %s Result %s", docId, source_lfn, result)
-                        except Exception as ex:
-                            logger.error("Error updating status for DocumentId: %s lfn: %s", docId, source_lfn)
-                            logger.error("Error reason: %s", ex)
-
-                        nMarked += 1
-                        #if nMarked % 10 == 0:
-                    logger.info('marked %d files as Failed', nMarked)
-
-                # find the location in the current environment of the script we want to run
-                import Publisher.TaskPublish as tp
-                taskPublishScript = tp.__file__
-                cmd = "python %s " % taskPublishScript
-                cmd += " --configFile=%s" % self.configurationFile
-                cmd += " --taskname=%s" % workflow
-                if self.TPconfig.dryRun:
-                    cmd += " --dry"
-                logger.info("Now execute: %s", cmd)
-                stdout, stderr, exitcode = executeCommand(cmd)
-                if exitcode != 0:
-                    errorMsg = 'Failed to execute command: %s.\n StdErr: %s.' % (cmd, stderr)
-                    raise Exception(errorMsg)
-                else:
-                    logger.info('TaskPublishScript done : %s', stdout)
+                    nMarked, _, nRequests = updatePublicationState(crabserver=self.crabServer, asoworker=self.config.asoworker,
+                                                                   lfns=toFail, state='FAILED',
+                                                                   failureReason='File type not EDM or metadata not found',
+                                                                   logger=logger)
+                    logger.info('marked %d files as Failed with %d requests', nMarked, nRequests)
+
+                # publish in this process, the DBS client and WMCore are already imported
+                logger.info("Now execute TaskPublish for %s", workflow)
+                jsonSummary = publishInDBS3(self.fullConfig, workflow, verbose=False)
+                logger.info('TaskPublish done : %s', jsonSummary)
 
-                jsonSummary = stdout.split()[-1]
                 with open(jsonSummary, 'r') as fd:
                     summary = json.load(fd)
                 result = summary['result']
@@ -604,6 +710,8 @@ class Master(object):
                               (taskname, summary['publishedFiles'], summary['publishedBlocks'])
                         if summary['nextIterFiles']:
                             msg += ' %d files left for next iteration.' % summary['nextIterFiles']
+                        if 'restCalls' in summary:
+                            msg += ' Publication state updated with %d REST calls.' % summary['restCalls']['publicationUpdates']
                         logger.info(msg)
                 if result == 'FAIL':
                     logger.error('Taskname %s : TaskPublish failed with: %s', taskname, reason)
@@ -615,7 +723,7 @@ class Master(object):
         except Exception as ex:
             logger.exception("Exception when calling TaskPublish!\n%s", str(ex))
 
-        return 0
+        return summary
 
     def pollInterval(self):
         """
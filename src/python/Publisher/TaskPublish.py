@@ -15,14 +15,19 @@ import json
 import traceback
 import argparse
 import pprint
+import threading
+from multiprocessing.pool import ThreadPool
 
 import dbs.apis.dbsClient as dbsClient
-from ServerUtilities import getHashLfn, encodeRequest
+from ServerUtilities import encodeRequest, updatePublicationState
 from ServerUtilities import SERVICE_INSTANCES
 from TaskWorker.WorkerExceptions import ConfigException
 from RESTInteractions import CRABRest
 from WMCore.Configuration import loadConfigurationFile
 
+# seconds between two checks of the status of the migrations in progress
+MIGRATION_POLL_INTERVAL = 10
+
 def format_file_3(file_):
     """
     format file for DBS
@@ -76,182 +81,19 @@ def createBulkBlock(output_config, processing_era_config, primds_config, \
     return blockDump
 
 
-def migrateByBlockDBS3(taskname, migrateApi, destReadApi, sourceApi, dataset, blocks, migLogDir, verbose=False):
+def selectFilesToPublish(toPublish, existingDBSFiles):
     """
-    Submit one migration request for each block that needs to be migrated.
-    If blocks argument is not specified, migrate the whole dataset.
+    Compare the files to publish with the files already in the output dataset
+    :param toPublish: list of the files to publish, as in the task JSON file
+    :param existingDBSFiles: list of the files in the dataset, as returned by DBS listFiles
+    :return: a tuple (existingFiles, existingFilesValid, newFiles) with the sets of the LFNs of
+             all and of the valid files in DBS, and the list of files of toPublish which are
+             not valid in DBS yet
     """
-    #wfnamemsg = "%s: " % taskname
-    logger = logging.getLogger(taskname)
-    logging.basicConfig(filename=taskname+'.log', level=logging.INFO)
-
-    if blocks:
-        blocksToMigrate = set(blocks)
-    else:
-        # This is for the case to migrate the whole dataset, which we don't do
-        # at this point Feb/2015 (we always pass blocks).
-        # Make a set with the blocks that need to be migrated.
-        blocksInDestDBS = set([block['block_name'] for block in destReadApi.listBlocks(dataset=dataset)])
-        blocksInSourceDBS = set([block['block_name'] for block in sourceApi.listBlocks(dataset=dataset)])
-        blocksToMigrate = blocksInSourceDBS - blocksInDestDBS
-        msg = "Dataset %s in destination DBS with %d blocks; %d blocks in source DBS."
-        msg = msg % (dataset, len(blocksInDestDBS), len(blocksInSourceDBS))
-        logger.info(msg)
-    numBlocksToMigrate = len(blocksToMigrate)
-    if numBlocksToMigrate == 0:
-        msg = "No migration needed."
-        logger.info(msg)
-    else:
-        msg = "Have to migrate %d blocks from %s to %s." % (numBlocksToMigrate, sourceApi.url, destReadApi.url)
-        logger.info(msg)
-        if verbose:
-            msg = "List of blocks to migrate:\n%s." % (", ".join(blocksToMigrate))
-            logger.debug(msg)
-        msg = "Submitting %d block migration requests to DBS3 ..." % (numBlocksToMigrate)
-        logger.info(msg)
-        numBlocksAtDestination = 0
-        numQueuedUnkwonIds = 0
-        numFailedSubmissions = 0
-        migrationIdsInProgress = []
-        for block in list(blocksToMigrate):
-            # Submit migration request for this block.
-            (reqid, atDestination, alreadyQueued) = requestBlockMigration(taskname, migrateApi, sourceApi, block, migLogDir)
-            # If the block is already in the destination DBS instance, we don't need
-            # to monitor its migration status. If the migration request failed to be
-            # submitted, we retry it next time. Otherwise, save the migration request
-            # id in the list of migrations in progress.
-            if reqid is None:
-                blocksToMigrate.remove(block)
-                if atDestination:
-                    numBlocksAtDestination += 1
-                elif alreadyQueued:
-                    numQueuedUnkwonIds += 1
-                else:
-                    numFailedSubmissions += 1
-            else:
-                migrationIdsInProgress.append(reqid)
-        if numBlocksAtDestination > 0:
-            msg = "%d blocks already in destination DBS." % numBlocksAtDestination
-            logger.info(msg)
-        if numFailedSubmissions > 0:
-            msg = "%d block migration requests failed to be submitted." % numFailedSubmissions
-            msg += " Will retry them later."
-            logger.info(msg)
-        if numQueuedUnkwonIds > 0:
-            msg = "%d block migration requests were already queued," % numQueuedUnkwonIds
-            msg += " but could not retrieve their request id."
-            logger.info(msg)
-        numMigrationsInProgress = len(migrationIdsInProgress)
-        if numMigrationsInProgress == 0:
-            msg = "No migrations in progress."
-            logger.info(msg)
-        else:
-            msg = "%d block migration requests successfully submitted." % numMigrationsInProgress
-            logger.info(msg)
-            msg = "List of migration requests ids: %s" % migrationIdsInProgress
-            logger.info(msg)
-            # Wait for up to 300 seconds, then return to the main loop. Note that we
-            # don't fail or cancel any migration request, but just retry it next time.
-            # Migration states:
-            #   0 = PENDING
-            #   1 = IN PROGRESS
-            #   2 = SUCCESS
-            #   3 = FAILED (failed migrations are retried up to 3 times automatically)
-            #   9 = Terminally FAILED
-            # In the case of failure, we expect the publisher daemon to try again in
-            # the future.
-            numFailedMigrations = 0
-            numSuccessfulMigrations = 0
-            waitTime = 30
-            numTimes = 10
-            msg = "Will monitor their status for up to %d seconds." % (waitTime * numTimes)
-            logger.info(msg)
-            for _ in range(numTimes):
-                msg = "%d block migrations in progress." % numMigrationsInProgress
-                msg += " Will check migrations status in %d seconds." % waitTime
-                logger.info(msg)
-                time.sleep(waitTime)
-                # Check the migration status of each block migration request.
-                # If a block migration has succeeded or terminally failes, remove the
-                # migration request id from the list of migration requests in progress.
-                for reqid in list(migrationIdsInProgress):
-                    try:
-                        status = migrateApi.statusMigration(migration_rqst_id=reqid)
-                        state = status[0].get('migration_status')
-                        retry = status[0].get('retry_count')
-                    except Exception as ex:
-                        msg = "Could not get status for migration id %d:\n%s" % reqid, ex
-                        logger.error(msg)
-                    else:
-                        if state == 2:
-                            msg = "Migration id %d succeeded." % reqid
-                            logger.info(msg)
-                            migrationIdsInProgress.remove(reqid)
-                            numSuccessfulMigrations += 1
-                        if state == 9:
-                            msg = "Migration id %d terminally failed." % reqid
-                            logger.info(msg)
-                            msg = "Full status for migration id %d:\n%s" % (reqid, str(status))
-                            logger.info(msg)
-                            migrationIdsInProgress.remove(reqid)
-                            numFailedMigrations += 1
-                        if state == 3:
-                            if retry < 3:
-                                msg = "Migration id %d failed (retry %d), but should be retried." % (reqid, retry)
-                                logger.info(msg)
-                            else:
-                                msg = "Migration id %d failed (retry %d)." % (reqid, retry)
-                                logger.info(msg)
-                                msg = "Full status for migration id %d:\n%s" % (reqid, str(status))
-                                logger.info(msg)
-                                migrationIdsInProgress.remove(reqid)
-                                numFailedMigrations += 1
-                numMigrationsInProgress = len(migrationIdsInProgress)
-                # Stop waiting if there are no more migrations in progress.
-                if numMigrationsInProgress == 0:
-                    break
-            # If after the 300 seconds there are still some migrations in progress, return
-            # with status 1.
-            if numMigrationsInProgress > 0:
-                msg = "Migration of %s is taking too long - will delay the publication." % dataset
-                logger.info(msg)
-                return 1, "Migration of %s is taking too long." % (dataset)
-        msg = "Migration of %s has finished." % dataset
-        logger.info(msg)
-        msg = "Migration status summary (from %d input blocks to migrate):" % numBlocksToMigrate
-        msg += " at destination = %d," % numBlocksAtDestination
-        msg += " succeeded = %d," % numSuccessfulMigrations
-        msg += " failed = %d," % numFailedMigrations
-        msg += " submission failed = %d," % numFailedSubmissions
-        msg += " queued with unknown id = %d." % numQueuedUnkwonIds
-        logger.info(msg)
-        # If there were failed migrations, return with status 2.
-        if numFailedMigrations > 0 or numFailedSubmissions > 0:
-            msg = "Some blocks failed to be migrated."
-            logger.info(msg)
-            return 2, "Migration of %s failed." % (dataset)
-        # If there were no failed migrations, but we could not retrieve the request id
-        # from some already queued requests, return with status 3.
-        if numQueuedUnkwonIds > 0:
-            msg = "Some block migrations were already queued, but failed to retrieve their request id."
-            logger.info(msg)
-            return 3, "Migration of %s in unknown status." % dataset
-        if (numBlocksAtDestination + numSuccessfulMigrations) != numBlocksToMigrate:
-            msg = "Something unexpected has happened."
-            msg += " The numbers in the migration summary are not consistent."
-            msg += " Make sure there is no bug in the code."
-            logger.info(msg)
-            return 4, "Migration of %s in some inconsistent status." % dataset
-        msg = "Migration completed."
-        logger.info(msg)
-    try:
-        migratedDataset = destReadApi.listDatasets(dataset=dataset, detail=True, dataset_access_type='*')
-        if not migratedDataset or migratedDataset[0].get('dataset', None) != dataset:
-            return 4, "Migration of %s in some inconsistent status." % dataset
-    except Exception as ex:
-        logger.exception("Migration check failed.")
-        return 4, "Migration check failed. %s" % ex
-    return 0, ""
+    existingFiles = set(f['logical_file_name'] for f in existingDBSFiles)
+    existingFilesValid = set(f['logical_file_name'] for f in existingDBSFiles if f['is_file_valid'])
+    newFiles = [f for f in toPublish if f['lfn'] not in existingFilesValid]
+    return existingFiles, existingFilesValid, newFiles
 
 
 def requestBlockMigration(taskname, migrateApi, sourceApi, block, migLogDir):
@@ -280,6 +122,7 @@ def requestBlockMigration(taskname, migrateApi, sourceApi, block, migLogDir):
             msg += "\nRequest detail: %s" % data
             msg += "\nDBS3 exception: %s" % ex
             logger.error(msg)
+            return reqid, atDestination, alreadyQueued
     if not atDestination:
         msg = "Result of migration request: %s" % str(result)
         logger.info(msg)
@@ -324,6 +167,259 @@ def requestBlockMigration(taskname, migrateApi, sourceApi, block, migLogDir):
                 logger.error(msg)
     return reqid, atDestination, alreadyQueued
 
+class MigrationTracker(object):
+    """
+    Keep track of the DBS migration requests for the parent blocks of a task across publication
+    iterations, instead of waiting for them to complete. The ids of the migrations in progress
+    are saved in a JSON file, so that the next time the task is processed only their status
+    needs to be checked, and the files whose parents are not yet migrated can be published then.
+    Migration states:
+      0 = PENDING
+      1 = IN PROGRESS
+      2 = SUCCESS
+      3 = FAILED (failed migrations are retried up to 3 times automatically)
+      9 = Terminally FAILED
+    """
+
+    def __init__(self, taskname, migrateApi, stateDir, migLogDir, logger, stats=None):
+        """
+        :param stateDir: directory where the migration request ids of each task are saved
+        :param stats: dictionary where the number of submitted, completed and failed migrations are kept
+        """
+        self.taskname = taskname
+        self.migrateApi = migrateApi
+        self.migLogDir = migLogDir
+        self.logger = logger
+        self.stateFile = os.path.join(stateDir, taskname + '.json')
+        self.stats = stats if stats is not None else {}
+        for key in ['submitted', 'completed', 'failed', 'inProgress']:
+            self.stats.setdefault(key, 0)
+        # {block name: migration request id} for the migrations submitted and not yet completed
+        self.inProgress = {}
+        if os.path.exists(self.stateFile):
+            try:
+                with open(self.stateFile) as fd:
+                    self.inProgress = json.load(fd)
+                self.logger.info("Migrations in progress from previous iterations: %s", self.inProgress)
+            except Exception as ex:
+                self.logger.warning("Could not read migration requests from %s: %s", self.stateFile, ex)
+
+    def save(self):
+        """ Save the ids of the migrations in progress, remove the file if there are none """
+        self.stats['inProgress'] = len(self.inProgress)
+        if self.inProgress:
+            with open(self.stateFile, 'w') as fd:
+                json.dump(self.inProgress, fd)
+        elif os.path.exists(self.stateFile):
+            os.remove(self.stateFile)
+
+    def submit(self, sourceApi, blocks):
+        """
+        Submit a migration request for each block which does not have one in progress already
+        :return: the set of blocks which are not in the destination DBS instance
+        """
+        pending = set()
+        for block in blocks:
+            if block in self.inProgress:
+                pending.add(block)
+                continue
+            reqid, atDestination, alreadyQueued = requestBlockMigration(self.taskname, self.migrateApi, sourceApi,
+                                                                        block, self.migLogDir)
+            if atDestination:
+                continue
+            pending.add(block)
+            if reqid is not None:
+                self.inProgress[block] = reqid
+                self.stats['submitted'] += 1
+            elif alreadyQueued:
+                self.logger.info("Migration of block %s was already queued, but could not retrieve its request id."
+                                 " Will check it again next time.", block)
+            else:
+                self.logger.info("Migration request for block %s failed to be submitted. Will retry it next time.", block)
+        return pending
+
+    def check(self):
+        """
+        Check once the status of all the migrations in progress
+        :return: two sets with the blocks whose migration succeeded and terminally failed
+        """
+        completed = set()
+        failed = set()
+        for block, reqid in list(self.inProgress.items()):
+            try:
+                status = self.migrateApi.statusMigration(migration_rqst_id=reqid)
+                state = status[0].get('migration_status')
+                retry = status[0].get('retry_count')
+            except Exception as ex:
+                self.logger.error("Could not get status for migration id %d:\n%s", reqid, ex)
+                continue
+            if state == 2:
+                self.logger.info("Migration id %d succeeded.", reqid)
+                completed.add(block)
+            elif state == 9 or (state == 3 and retry >= 3):
+                self.logger.info("Migration id %d terminally failed (retry %s).", reqid, retry)
+                self.logger.info("Full status for migration id %d:\n%s", reqid, str(status))
+                failed.add(block)
+            elif state == 3:
+                self.logger.info("Migration id %d failed (retry %d), but should be retried.", reqid, retry)
+                continue
+            else:
+                continue
+            # failed migrations are submitted again next time
+            del self.inProgress[block]
+        self.stats['completed'] += len(completed)
+        self.stats['failed'] += len(failed)
+        return completed, failed
+
+    def migrate(self, blocksBySource, waitTime):
+        """
+        Submit all the migrations needed and wait up to waitTime seconds for them to complete.
+        Migrations which take longer are not cancelled, they are checked again next time.
+        :param blocksBySource: list of (DbsApi of the source DBS instance, blocks to migrate from it)
+        :return: the set of blocks which are not (yet) in the destination DBS instance
+        """
+        pending = set()
+        for sourceApi, blocks in blocksBySource:
+            pending.update(self.submit(sourceApi, blocks))
+        deadline = time.time() + waitTime
+        while True:
+            completed, _ = self.check()
+            pending -= completed
+            if not pending.intersection(self.inProgress) or time.time() >= deadline:
+                break
+            msg = "%d block migrations in progress." % len(pending.intersection(self.inProgress))
+            msg += " Will check migrations status in %d seconds." % MIGRATION_POLL_INTERVAL
+            self.logger.info(msg)
+            time.sleep(MIGRATION_POLL_INTERVAL)
+        self.save()
+        if pending:
+            self.logger.info("%d parent blocks are not yet in destination DBS: %s", len(pending), pending)
+        return pending
+
+class ParentBlockResolver(object):
+    """
+    Find the DBS block of the parent files, looking into a list of DBS instances in order.
+    Results are cached for the whole run and, once a parent file is found, all files of its
+    block are cached as well, since the parents of the files of a task are usually in a few
+    blocks. The parent files are grouped by directory and each group is looked up in order
+    by one of up to maxThreads threads, each with its own DbsApi objects, so that the files
+    of a block are found in the cache after the first one. A block listed by another thread
+    is waited for instead of being listed again.
+    """
+
+    def __init__(self, instances, logger, maxThreads=8, stats=None):
+        """
+        :param instances: list of (name, url) of the DBS instances to look into, in order
+        :param stats: dictionary where the number of lookups, cache hits, DBS calls and
+                      listFiles calls (one per block at most) are kept
+        """
+        self.instances = instances
+        self.logger = logger
+        self.maxThreads = maxThreads
+        self.stats = stats if stats is not None else {}
+        for key in ['lookups', 'hits', 'dbsCalls', 'blockListings']:
+            self.stats.setdefault(key, 0)
+        self.cache = {}
+        # {block name: threading.Event set when the files of the block are in the cache}
+        self.listedBlocks = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def getApi(self, url):
+        """ DbsApi objects can not be shared among threads, make one per thread and url """
+        apis = self.local.__dict__.setdefault('apis', {})
+        if url not in apis:
+            apis[url] = dbsClient.DbsApi(url=url)
+        return apis[url]
+
+    def lookup(self, lfn, prefetch=True):
+        """
+        Find the block of one parent file, unless it was cached in the meanwhile. This takes
+        one listBlocks call for each DBS instance until the file is found, as without the
+        cache, plus one listFiles call if prefetch is True and no thread listed the block yet
+        :param prefetch: whether to list and cache all the files of the block
+        :return: True if DBS was queried for this file
+        """
+        with self.lock:
+            if lfn in self.cache:
+                return False
+        found = (None, None)
+        nCalls = 0
+        for name, url in self.instances:
+            api = self.getApi(url)
+            blocks = api.listBlocks(logical_file_name=lfn)
+            nCalls += 1
+            if blocks:
+                found = (name, blocks[0]['block_name'])
+                break
+        listing = None
+        with self.lock:
+            self.stats['dbsCalls'] += nCalls
+            self.cache[lfn] = found
+            if found[1] and prefetch:
+                if found[1] in self.listedBlocks:
+                    listing = self.listedBlocks[found[1]]
+                else:
+                    self.listedBlocks[found[1]] = threading.Event()
+        if listing is not None:
+            # another thread is listing this block, the following lookups will find it cached
+            listing.wait()
+        elif found[1] and prefetch:
+            siblings = []
+            try:
+                siblings = [f['logical_file_name'] for f in api.listFiles(block_name=found[1])]
+            except Exception as ex:
+                self.logger.warning("Could not list the files of block %s: %s", found[1], ex)
+            with self.lock:
+                self.stats['dbsCalls'] += 1
+                self.stats['blockListings'] += 1
+                for sibling in siblings:
+                    self.cache.setdefault(sibling, found)
+                self.listedBlocks[found[1]].set()
+        return True
+
+    def lookupGroup(self, lfns):
+        """
+        Look up in order a list of parent files, those of a block are cached by the first one.
+        The block is listed only if there are other files to look up after this one, so that
+        a parent file alone costs no more than the listBlocks calls.
+        :return: number of files for which DBS was queried
+        """
+        nQueried = 0
+        for num, lfn in enumerate(lfns):
+            if self.lookup(lfn, prefetch=num < len(lfns) - 1):
+                nQueried += 1
+        return nQueried
+
+    def resolve(self, lfns):
+        """
+        :param lfns: list of parent LFNs, one for each file which has it as parent
+        :return: a dictionary {lfn: (instance name, block name)}, with (None, None)
+                 for the files unknown to DBS
+        """
+        uniqueLfns = set(lfns)
+        # the files of a block are usually in the same directory: one thread for each directory
+        groups = {}
+        for lfn in sorted(lfn for lfn in uniqueLfns if lfn not in self.cache):
+            groups.setdefault(os.path.dirname(lfn), []).append(lfn)
+        nQueried = 0
+        if groups:
+            pool = ThreadPool(min(self.maxThreads, len(groups)))
+            try:
+                nQueried = sum(pool.map(self.lookupGroup, groups.values(), chunksize=1))
+            finally:
+                pool.close()
+                pool.join()
+        self.stats['lookups'] += len(lfns)
+        self.stats['hits'] += len(lfns) - nQueried
+        if self.stats['lookups']:
+            self.stats['hitRatio'] = round(self.stats['hits'] / self.stats['lookups'], 3)
+        self.logger.info("Resolved the blocks of %d parent files with %d DBS calls, %d of them to list blocks"
+                         " (cache hit ratio %s)", len(uniqueLfns), self.stats['dbsCalls'],
+                         self.stats['blockListings'], self.stats.get('hitRatio'))
+        return dict((lfn, self.cache[lfn]) for lfn in uniqueLfns)
+
+
 def publishInDBS3(config, taskname, verbose):
     """
     Publish output from one task in DBS
@@ -340,28 +436,12 @@ def publishInDBS3(config, taskname, verbose):
             logger.info("DryRun: skip marking good file")
             return
 
-        nMarked = 0
-        for lfn in files:
-            data = {}
-            source_lfn = lfn
-            docId = getHashLfn(source_lfn)
-            data['asoworker'] = config.General.asoworker
-            data['subresource'] = 'updatePublication'
-            data['list_of_ids'] = [docId]
-            data['list_of_publication_state'] = ['DONE']
-            data['list_of_retry_value'] = [1]
-            data['list_of_failure_reason'] = ['']
-
-            try:
-                result = crabServer.post(api='filetransfers', data=encodeRequest(data))
-                logger.debug("updated DocumentId: %s lfn: %s Result %s", docId, source_lfn, result)
-            except Exception as ex:
-                logger.error("Error updating status for DocumentId: %s lfn: %s", docId, source_lfn)
-                logger.error("Error reason: %s", ex)
-
-            nMarked += 1
-            if nMarked % 10 == 0:
-                logger.info('marked %d files', nMarked)
+        nMarked, notMarked, nRequests = updatePublicationState(crabserver=crabServer, asoworker=config.General.asoworker,
+                                                               lfns=files, state='DONE', logger=logger)
+        restCalls['publicationUpdates'] += nRequests
+        logger.info('marked %d files as published with %d requests', nMarked, nRequests)
+        if notMarked:
+            logger.error('failed to mark %d files as published', len(notMarked))
 
     def mark_failed(files, crabServer, logger, failure_reason=""):
         """
@@ -373,29 +453,13 @@ def publishInDBS3(config, taskname, verbose):
             logger.debug("DryRun: skip marking failes files")
             return
 
-        nMarked = 0
-        for lfn in files:
-            source_lfn = lfn
-            docId = getHashLfn(source_lfn)
-            data = dict()
-            data['asoworker'] = config.General.asoworker
-            data['subresource'] = 'updatePublication'
-            data['list_of_ids'] = [docId]
-            data['list_of_publication_state'] = ['FAILED']
-            data['list_of_retry_value'] = [1]
-            data['list_of_failure_reason'] = [failure_reason]
-
-            logger.debug("data: %s ", data)
-            try:
-                result = crabServer.post(api='filetransfers', data=encodeRequest(data))
-                logger.debug("updated DocumentId: %s lfn: %s Result %s", docId, source_lfn, result)
-            except Exception as ex:
-                logger.error("Error updating status for DocumentId: %s lfn: %s", docId, source_lfn)
-                logger.error("Error reason: %s", ex)
-
-            nMarked += 1
-            if nMarked % 10 == 0:
-                logger.info('marked %d files', nMarked)
+        nMarked, notMarked, nRequests = updatePublicationState(crabserver=crabServer, asoworker=config.General.asoworker,
+                                                               lfns=files, state='FAILED', failureReason=failure_reason,
+                                                               logger=logger)
+        restCalls['publicationUpdates'] += nRequests
+        logger.info('marked %d files as failed with %d requests', nMarked, nRequests)
+        if notMarked:
+            logger.error('failed to mark %d files as failed', len(notMarked))
 
     def createLogdir(dirname):
         """
@@ -436,8 +500,19 @@ def publishInDBS3(config, taskname, verbose):
     createLogdir(logdir)
     migrationLogDir = os.path.join(config.General.logsDir, 'migrations')
     createLogdir(migrationLogDir)
+    migrationStateDir = os.path.join(taskFilesDir, 'Migrations')
+    createLogdir(migrationStateDir)
     logger = logging.getLogger(taskname)
-    logging.basicConfig(filename=logfile, level=logging.INFO, format=config.TaskPublisher.logMsgFormat)
+    if logging.getLogger().handlers:
+        # running inside a PublisherMaster worker, where the root logger writes to the
+        # master log: send the messages of this task to the task log file only
+        taskHandler = logging.FileHandler(logfile)
+        taskHandler.setFormatter(logging.Formatter(config.TaskPublisher.logMsgFormat))
+        logger.addHandler(taskHandler)
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+    else:
+        logging.basicConfig(filename=logfile, level=logging.INFO, format=config.TaskPublisher.logMsgFormat)
     if verbose:
         logger.setLevel(logging.DEBUG)
 
@@ -454,6 +529,15 @@ def publishInDBS3(config, taskname, verbose):
     nothingToDo['publishedFiles'] = 0
     nothingToDo['failedFiles'] = 0
     nothingToDo['nextIterFiles'] = 0
+    # number of REST calls done to update the publication state of the files
+    restCalls = {'publicationUpdates': 0}
+    nothingToDo['restCalls'] = restCalls
+    # lookups of the blocks of parent files and how many were answered by the cache
+    parentBlockCache = {'lookups': 0, 'hits': 0, 'dbsCalls': 0, 'blockListings': 0}
+    nothingToDo['parentBlockCache'] = parentBlockCache
+    # migrations of parent blocks and number of files waiting for them
+    migrations = {'submitted': 0, 'completed': 0, 'failed': 0, 'inProgress': 0, 'waitingFiles': 0}
+    nothingToDo['migrations'] = migrations
 
     toPublish = []
     # TODO move from new to done when processed
@@ -635,13 +719,11 @@ def publishInDBS3(config, taskname, verbose):
     final = {}
     failed = []
     publish_in_next_iteration = []
-    published = []
 
     # Find all files already published in this dataset.
     try:
         existingDBSFiles = destReadApi.listFiles(dataset=dataset, detail=True)
-        existingFiles = [f['logical_file_name'] for f in existingDBSFiles]
-        existingFilesValid = [f['logical_file_name'] for f in existingDBSFiles if f['is_file_valid']]
+        existingFiles, existingFilesValid, newFiles = selectFilesToPublish(toPublish, existingDBSFiles)
         msg = "Dataset %s already contains %d files" % (dataset, len(existingFiles))
         msg += " (%d valid, %d invalid)." % (len(existingFilesValid), len(existingFiles) - len(existingFilesValid))
         logger.info(msg)
@@ -656,13 +738,7 @@ def publishInDBS3(config, taskname, verbose):
         return summaryFileName
 
     # check if actions are needed
-    workToDo = False
-
-    for fileTo in toPublish:
-        #print(existingFilesValid)
-        if fileTo['lfn'] not in existingFiles:
-            workToDo = True
-            break
+    workToDo = any(fileTo['lfn'] not in existingFiles for fileTo in toPublish)
 
     if not workToDo:
         msg = "Nothing uploaded, output dataset has these files already."
@@ -696,8 +772,6 @@ def publishInDBS3(config, taskname, verbose):
     # List of all files that must (and can) be published.
     dbsFiles = []
     dbsFiles_f = []
-    # Set of all the parent files from all the files requested to be published.
-    parentFiles = set()
     # Set of parent files for which the migration to the destination DBS instance
     # should be skipped (because they were not found in DBS).
     parentsToSkip = set()
@@ -708,103 +782,86 @@ def publishInDBS3(config, taskname, verbose):
     # to the destination DBS instance.
     globalParentBlocks = set()
 
-    # Loop over all files to publish.
-    for file_ in toPublish:
+    # Find the block of each parent file of the files to publish. If a parent file is already
+    # in the destination DBS instance we don't have to migrate its block, otherwise look for it
+    # in the same DBS instance as the input dataset and then in global DBS.
+    dbsInstances = [('destination', publish_read_url), ('source', sourceURL)]
+    if globalURL != sourceURL:
+        dbsInstances.append(('global', globalURL))
+    parentResolver = ParentBlockResolver(dbsInstances, logger, stats=parentBlockCache,
+                                         maxThreads=getattr(config.TaskPublisher, 'parentLookupThreads', 8))
+    parentLfns = [parentFile for file_ in newFiles for parentFile in file_['parents']]
+    parentBlocks = parentResolver.resolve(parentLfns)
+    for parentFile, (dbsInstance, blockName) in parentBlocks.items():
+        if dbsInstance == 'source':
+            localParentBlocks.add(blockName)
+        elif dbsInstance == 'global':
+            globalParentBlocks.add(blockName)
+        elif dbsInstance is None:
+            # If this parent file is not in the destination DBS instance, is not
+            # the source DBS instance, and is not in global DBS instance, then it
+            # means it is not known to DBS and therefore we can not migrate it.
+            parentsToSkip.add(parentFile)
+
+    # Migrate parent blocks before publishing: the parent blocks that are in the same DBS
+    # instance as the input dataset and those in the global DBS instance. All migrations are
+    # submitted at once and we wait for them only for a short time, the files whose parent
+    # blocks are still being migrated are published in a next iteration.
+    notMigratedBlocks = set()
+    if localParentBlocks or globalParentBlocks:
+        for api, blocks in [(sourceApi, localParentBlocks), (globalApi, globalParentBlocks)]:
+            if blocks:
+                msg = "List of parent blocks that need to be migrated from %s:\n%s" % (api.url, blocks)
+                logger.info(msg)
+        if dryRun:
+            logger.info("DryRun: skipping migration request")
+        else:
+            migrationTracker = MigrationTracker(taskname, migrateApi, migrationStateDir, migrationLogDir,
+                                                logger, stats=migrations)
+            notMigratedBlocks = migrationTracker.migrate([(sourceApi, localParentBlocks), (globalApi, globalParentBlocks)],
+                                                         getattr(config.TaskPublisher, 'migrationWaitTime', 60))
+
+    # Loop over all files to publish, i.e. not already published or not valid.
+    waitingForMigration = set()
+    for file_ in newFiles:
         if verbose:
             logger.info(file_)
-        # Check if this file was already published and if it is valid.
-        if file_['lfn'] not in existingFilesValid:
-            # We have a file to publish.
-            # Get the parent files and for each parent file do the following:
-            # 1) Add it to the list of parent files.
-            # 2) Find the block to which it belongs and insert that block name in
-            #    (one of) the set of blocks to be migrated to the destination DBS.
-            for parentFile in list(file_['parents']):
-                if parentFile not in parentFiles:
-                    parentFiles.add(parentFile)
-                    # Is this parent file already in the destination DBS instance?
-                    # (If yes, then we don't have to migrate this block.)
-                    blocksDict = destReadApi.listBlocks(logical_file_name=parentFile)
-                    if not blocksDict:
-                        # No, this parent file is not in the destination DBS instance.
-                        # Maybe it is in the same DBS instance as the input dataset?
-                        blocksDict = sourceApi.listBlocks(logical_file_name=parentFile)
-                        if blocksDict:
-                            # Yes, this parent file is in the same DBS instance as the input dataset.
-                            # Add the corresponding block to the set of blocks from the source DBS
-                            # instance that have to be migrated to the destination DBS.
-                            localParentBlocks.add(blocksDict[0]['block_name'])
-                        else:
-                            # No, this parent file is not in the same DBS instance as input dataset.
-                            # Maybe it is in global DBS instance?
-                            blocksDict = globalApi.listBlocks(logical_file_name=parentFile)
-                            if blocksDict:
-                                # Yes, this parent file is in global DBS instance.
-                                # Add the corresponding block to the set of blocks from global DBS
-                                # instance that have to be migrated to the destination DBS.
-                                globalParentBlocks.add(blocksDict[0]['block_name'])
-                    # If this parent file is not in the destination DBS instance, is not
-                    # the source DBS instance, and is not in global DBS instance, then it
-                    # means it is not known to DBS and therefore we can not migrate it.
-                    # Put it in the set of parent files for which migration should be skipped.
-                    if not blocksDict:
-                        parentsToSkip.add(parentFile)
-                # If this parent file should not be migrated because it is not known to DBS,
-                # we remove it from the list of parents in the file-to-publish info dictionary
-                # (so that when publishing, this "parent" file will not appear as a parent).
-                if parentFile in parentsToSkip:
-                    msg = "Skipping parent file %s, as it doesn't seem to be known to DBS." % (parentFile)
-                    logger.info(msg)
-                    if parentFile in file_['parents']:
-                        file_['parents'].remove(parentFile)
-            # Add this file to the list of files to be published.
-            dbsFiles.append(format_file_3(file_))
-            dbsFiles_f.append(file_)
-        #print file
-        published.append(file_['SourceLFN'])
-        #published.append(file_['lfn'].replace("/store","/store/temp"))
+        for parentFile in list(file_['parents']):
+            # If this parent file should not be migrated because it is not known to DBS,
+            # we remove it from the list of parents in the file-to-publish info dictionary
+            # (so that when publishing, this "parent" file will not appear as a parent).
+            if parentFile in parentsToSkip:
+                msg = "Skipping parent file %s, as it doesn't seem to be known to DBS." % (parentFile)
+                logger.info(msg)
+                file_['parents'].remove(parentFile)
+        # If the block of a parent file is not in the destination DBS instance yet,
+        # this file has to wait.
+        if notMigratedBlocks and any(parentBlocks[parentFile][1] in notMigratedBlocks for parentFile in file_['parents']):
+            waitingForMigration.add(file_['SourceLFN'])
+            continue
+        # Add this file to the list of files to be published.
+        dbsFiles.append(format_file_3(file_))
+        dbsFiles_f.append(file_)
+    published = [file_['SourceLFN'] for file_ in toPublish]
+    migrations['waitingFiles'] = len(waitingForMigration)
 
     # Print a message with the number of files to publish.
     msg = "Found %d files not already present in DBS which will be published." % (len(dbsFiles))
     logger.info(msg)
+    if waitingForMigration:
+        msg = "%d files will be published in a next iteration, when the migration of their parent blocks is completed."
+        logger.info(msg, len(waitingForMigration))
 
     # If there are no files to publish, continue with the next dataset.
     if not dbsFiles_f:
         msg = "No file to publish to do for this dataset."
         logger.info(msg)
+        if waitingForMigration:
+            nothingToDo['reason'] = 'WAITING FOR PARENT BLOCKS MIGRATION'
+            nothingToDo['nextIterFiles'] = len(waitingForMigration)
         summaryFileName = saveSummaryJson(logdir, nothingToDo)
         return summaryFileName
 
-    # Migrate parent blocks before publishing.
-    # First migrate the parent blocks that are in the same DBS instance
-    # as the input dataset.
-    if localParentBlocks:
-        msg = "List of parent blocks that need to be migrated from %s:\n%s" % (sourceApi.url, localParentBlocks)
-        logger.info(msg)
-        if dryRun:
-            logger.info("DryRun: skipping migration request")
-        else:
-            statusCode, failureMsg = migrateByBlockDBS3(taskname, migrateApi, destReadApi, sourceApi,
-                                                        inputDataset, localParentBlocks, migrationLogDir, verbose)
-            if statusCode:
-                failureMsg += " Not publishing any files."
-                logger.info(failureMsg)
-                summaryFileName = saveSummaryJson(logdir, nothingToDo)
-                return summaryFileName
-    # Then migrate the parent blocks that are in the global DBS instance.
-    if globalParentBlocks:
-        msg = "List of parent blocks that need to be migrated from %s:\n%s" % (globalApi.url, globalParentBlocks)
-        logger.info(msg)
-        if dryRun:
-            logger.info("DryRun: skipping migration request")
-        else:
-            statusCode, failureMsg = migrateByBlockDBS3(taskname, migrateApi, destReadApi, globalApi,
-                                                        inputDataset, globalParentBlocks, migrationLogDir, verbose)
-            if statusCode:
-                failureMsg += " Not publishing any files."
-                logger.info(failureMsg)
-                summaryFileName = saveSummaryJson(logdir, nothingToDo)
-                return summaryFileName
     # Publish the files in blocks. The blocks must have exactly max_files_per_block
     # files, unless there are less than max_files_per_block files to publish to
     # begin with. If there are more than max_files_per_block files to publish,
@@ -839,7 +896,9 @@ def publishInDBS3(config, taskname, verbose):
         except Exception as ex:
             #logger.error("Error for files: %s" % [f['SourceLFN'] for f in toPublish])
             logger.error("Error for files: %s", [f['lfn'] for f in toPublish])
-            failed.extend([f['SourceLFN'] for f in toPublish])
+            if not failed:
+                # files waiting for the migration of their parents were not in any block
+                failed.extend([f['SourceLFN'] for f in toPublish if f['SourceLFN'] not in waitingForMigration])
             #failed.extend([f['lfn'].replace("/store","/store/temp") for f in toPublish])
             msg = "Error when publishing (%s) " % ", ".join(failed)
             msg += str(ex)
@@ -859,9 +918,11 @@ def publishInDBS3(config, taskname, verbose):
             publish_in_next_iteration.extend([f["SourceLFN"] for f in files_to_publish_next])
             #publish_in_next_iteration.extend([f["lfn"].replace("/store","/store/temp") for f in files_to_publish_next])
             break
-    published = [x for x in published if x not in failed + publish_in_next_iteration]
+    notPublished = set(failed).union(publish_in_next_iteration).union(waitingForMigration)
+    published = [x for x in published if x not in notPublished]
     # Fill number of files/blocks published for this dataset.
     final['files'] = len(dbsFiles) - len(failed) - len(publish_in_next_iteration)
+    publish_in_next_iteration.extend(waitingForMigration)
     final['blocks'] = block_count
     # Print a publication status summary for this dataset.
     msg = "End of publication status:"
@@ -899,6 +960,9 @@ def publishInDBS3(config, taskname, verbose):
     summary['publishedFiles'] = len(published)
     summary['failedFiles'] = len(failed)
     summary['nextIterFiles'] = len(publish_in_next_iteration)
+    summary['restCalls'] = restCalls
+    summary['parentBlockCache'] = parentBlockCache
+    summary['migrations'] = migrations
 
     summaryFileName = saveSummaryJson(logdir, summary)
 
@@ -0,0 +1,169 @@
+"""
+Pool of long lived worker processes used by PublisherMaster to publish tasks.
+
+Workers are forked once and then receive one task at a time over a pipe, so the
+DBS client, WMCore and the master state are imported and initialized only once
+instead of once per task. Each task has a timeout: a worker which takes longer is
+killed and replaced by a new one, without affecting the tasks of the other workers.
+"""
+
+from __future__ import division
+from __future__ import print_function
+import os
+import time
+import select
+import logging
+import traceback
+from multiprocessing import Process, Pipe
+
+
+def workerLoop(work, conn, workerId, masterPid):
+    """
+    Body of a worker process: receive (taskId, task) from conn, run work(task) and send back
+    (taskId, result, error, elapsed time), until None is received or the master goes away.
+    """
+    logger = logging.getLogger('publisherworker%d' % workerId)
+    logger.info("Worker %d is starting. PID %s", workerId, os.getpid())
+    while True:
+        try:
+            # the other workers hold copies of the master end of the pipe, so EOF is not
+            # seen if the master is killed: check from time to time that it is still there
+            while not conn.poll(60):
+                if os.getppid() != masterPid:
+                    raise EOFError
+            item = conn.recv()
+        except (EOFError, IOError):
+            logger.error("Lost connection to the master, worker %d exiting", workerId)
+            break
+        if item is None:
+            break
+        taskId, task = item
+        t0 = time.time()
+        result, error = None, None
+        try:
+            result = work(task)
+        except Exception:  # pylint: disable=broad-except
+            error = traceback.format_exc()
+        try:
+            conn.send((taskId, result, error, time.time() - t0))
+        except (EOFError, IOError):
+            break
+    logger.info("Worker %d exiting", workerId)
+
+
+class WorkerPool(object):
+    """
+    Run work(task) for a list of tasks using up to nWorkers long lived processes,
+    killing any task which takes more than timeout seconds.
+    """
+
+    def __init__(self, work, nWorkers, timeout, logger):
+        """
+        :param work: the function executed by the workers for each task
+        :param nWorkers: number of worker processes
+        :param timeout: maximum time in seconds a worker can spend on one task
+        """
+        self.work = work
+        self.nWorkers = nWorkers
+        self.timeout = timeout
+        self.logger = logger
+        self.workers = []
+        self.taskCounter = 0
+
+    def _spawn(self, workerId):
+        """ Start a new worker process, return its bookkeeping dictionary """
+        masterConn, workerConn = Pipe()
+        process = Process(target=workerLoop, args=(self.work, workerConn, workerId, os.getpid()))
+        process.daemon = True
+        process.start()
+        workerConn.close()
+        self.logger.info('Started publisher worker %d pid=%s', workerId, process.pid)
+        return {'id': workerId, 'process': process, 'conn': masterConn,
+                'taskId': None, 'name': None, 'started': None}
+
+    def _replace(self, worker):
+        """ Kill a worker which is stuck or died and start a new one in its place """
+        worker['conn'].close()
+        if worker['process'].is_alive():
+            worker['process'].terminate()
+        worker['process'].join()
+        self.workers[self.workers.index(worker)] = self._spawn(worker['id'])
+
+    def start(self):
+        """ Start the worker processes """
+        if not self.workers:
+            self.workers = [self._spawn(workerId) for workerId in range(1, self.nWorkers + 1)]
+
+    def stop(self):
+        """ Ask all workers to exit and wait for them """
+        for worker in self.workers:
+            try:
+                worker['conn'].send(None)
+            except (EOFError, IOError):
+                pass
+        for worker in self.workers:
+            worker['process'].join(10)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+                worker['process'].join()
+            worker['conn'].close()
+        self.workers = []
+
+    def run(self, tasks, taskName=str):
+        """
+        Execute all tasks and return when they are all completed or killed
+        :param tasks: list of tasks, each one is passed as is to work()
+        :param taskName: function returning the name of a task to use in log messages
+        :return: a list of (name, result, error) for each task, error is None on success,
+                 a traceback if work() raised and 'timeout' or 'crash' if the worker was killed or died
+        """
+        self.start()
+        pending = list(tasks)
+        done = []
+        while pending or any(worker['taskId'] is not None for worker in self.workers):
+            # hand a task to each idle worker
+            for worker in self.workers:
+                if worker['taskId'] is None and pending:
+                    task = pending.pop(0)
+                    self.taskCounter += 1
+                    worker['taskId'] = self.taskCounter
+                    worker['name'] = taskName(task)
+                    worker['started'] = time.time()
+                    self.logger.info('Worker %d pid=%s will work on task %s', worker['id'],
+                                     worker['process'].pid, worker['name'])
+                    try:
+                        worker['conn'].send((worker['taskId'], task))
+                    except (EOFError, IOError):
+                        self.logger.error('Worker %d is gone, will start a new one', worker['id'])
+                        pending.insert(0, task)
+                        self._replace(worker)
+            busy = [worker for worker in self.workers if worker['taskId'] is not None]
+            if not busy:
+                continue
+            # wake up as soon as a worker completes, or when the first timeout expires
+            now = time.time()
+            wait = min(worker['started'] + self.timeout - now for worker in busy)
+            ready, _, _ = select.select([worker['conn'] for worker in busy], [], [], max(wait, 0))
+            for worker in busy:
+                if worker['conn'] in ready:
+                    try:
+                        taskId, result, error, elapsed = worker['conn'].recv()
+                    except (EOFError, IOError):
+                        self.logger.error('Worker %d died while working on task %s', worker['id'], worker['name'])
+                        done.append((worker['name'], None, 'crash'))
+                        self._replace(worker)
+                        continue
+                    if taskId != worker['taskId']:
+                        continue
+                    if error:
+                        self.logger.error('Task %s failed in worker %d:\n%s', worker['name'], worker['id'], error)
+                    else:
+                        self.logger.info('Task %s completed by worker %d in %d seconds', worker['name'], worker['id'], elapsed)
+                    done.append((worker['name'], result, error))
+                    worker['taskId'] = None
+                elif time.time() - worker['started'] > self.timeout:
+                    self.logger.error('Task %s did not complete in %d seconds, killing worker %d pid=%s',
+                                      worker['name'], self.timeout, worker['id'], worker['process'].pid)
+                    done.append((worker['name'], None, 'timeout'))
+                    self._replace(worker)
+        return done
@@ -48,6 +48,28 @@ def retriableError(ex):
     return False
 
 
+class KeepAliveRequestHandler(RequestHandler):
+    """
+    A WMCore RequestHandler whose curl handles share DNS cache, TLS sessions and (when supported
+    by libcurl) the pool of open connections. The handler creates a new curl object for every request,
+    attaching all of them to the same CurlShare allows a long lived HTTPRequests object to reuse the
+    connection to the server and avoid a full TLS handshake at each call.
+    """
+
+    def __init__(self, config=None, logger=None):
+        RequestHandler.__init__(self, config, logger)
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        if hasattr(pycurl, 'LOCK_DATA_CONNECT'):
+            self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+
+    def set_opts(self, curl, *args, **kwargs):
+        bbuf, hbuf = RequestHandler.set_opts(self, curl, *args, **kwargs)
+        curl.setopt(pycurl.SHARE, self.share)
+        return bbuf, hbuf
+
+
 class HTTPRequests(dict):
     """
     This code is a simplified version of WMCore.Services.Requests - we don't
@@ -62,11 +84,13 @@ class HTTPRequests(dict):
     """
 
     def __init__(self, hostname='localhost', localcert=None, localkey=None, version=__version__,
-                 retry=0, logger=None, verbose=False, userAgent='CRAB?'):
+                 retry=0, logger=None, verbose=False, userAgent='CRAB?', keepAlive=False):
         """
-        Initialise an HTTP handler
+        Initialise an HTTP handler. If keepAlive is True connections and TLS sessions
+        are reused across requests, see KeepAliveRequestHandler
         """
         dict.__init__(self)
+        self.keepAlive = keepAlive
         #set up defaults
         self.setdefault("accept_type", 'text/html')
         self.setdefault("content_type", 'application/x-www-form-urlencoded')
@@ -98,6 +122,8 @@ class HTTPRequests(dict):
         that a sub class can override it to have different type of connection
         i.e. - if it needs authentication, or some fancy handler
         """
+        if self.keepAlive:
+            return KeepAliveRequestHandler(config={'timeout': 300, 'connecttimeout' : 300})
         return RequestHandler(config={'timeout': 300, 'connecttimeout' : 300})
 
     def get(self, uri=None, data=None):
@@ -209,9 +235,9 @@ class CRABRest:
     Add two methods to set and get the DB instance
     """
     def __init__(self, hostname='localhost', localcert=None, localkey=None, version=__version__,
-                 retry=0, logger=None, verbose=False, userAgent='CRAB?'):
+                 retry=0, logger=None, verbose=False, userAgent='CRAB?', keepAlive=False):
         self.server = HTTPRequests(hostname, localcert, localkey, version,
-                                   retry, logger, verbose, userAgent)
+                                   retry, logger, verbose, userAgent, keepAlive)
         instance = 'prod'
         self.uriNoApi = '/crabserver/' + instance + '/'
 
@@ -1,6 +1,11 @@
 from __future__ import print_function
 from __future__ import division
 
+import time
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
 from TaskWorker.WorkerExceptions import TaskWorkerException
 
 def getNativeRucioClient(config=None, logger=None):
@@ -12,9 +17,23 @@ def getNativeRucioClient(config=None, logger=None):
     :return: a Rucio Client object
     """
     logger.info("Initializing native Rucio client")
+    nativeClient = makeRucioClient(config)
+    ret = nativeClient.ping()
+    logger.info("Rucio server v.%s contacted", ret['version'])
+    ret = nativeClient.whoami()
+    logger.info("Rucio client initialized for %s in status %s", ret['account'], ret['status'])
+
+    return nativeClient
+
+def makeRucioClient(config=None):
+    """
+    create a Rucio python Client, without contacting the server
+    :param config: a TaskWorker configuration object, see getNativeRucioClient
+    :return: a Rucio Client object
+    """
     from rucio.client import Client
 
-    nativeClient = Client(
+    return Client(
         rucio_host=config.Services.Rucio_host,
         auth_host=config.Services.Rucio_authUrl,
         ca_cert=config.Services.Rucio_caPath,
@@ -22,12 +41,85 @@ def getNativeRucioClient(config=None, logger=None):
         creds={"client_cert": config.TaskWorker.cmscert, "client_key": config.TaskWorker.cmskey},
         auth_type='x509'
     )
-    ret = nativeClient.ping()
-    logger.info("Rucio server v.%s contacted", ret['version'])
-    ret = nativeClient.whoami()
-    logger.info("Rucio client initialized for %s in status %s", ret['account'], ret['status'])
 
-    return nativeClient
+# Rucio clients created by getBlocksLocations for its lookup threads: they are kept for the next
+# calls in the same process (e.g. TaskWorker slave), so that each of them authenticates only once
+threadClients = []
+threadClientsLock = threading.Lock()
+
+def getBlocksLocations(rucioClient=None, config=None, scope='cms', blocks=None, threads=8, bulkSize=500, logger=None):
+    """
+    find the RSEs where each block has a complete (AVAILABLE) replica, asking Rucio for
+    many blocks at the same time: with the multi-DID list_dataset_replicas_bulk API if
+    the Rucio client has it, otherwise with up to `threads` concurrent list_dataset_replicas.
+    A Rucio client can not be shared among threads: each thread takes an idle client, first
+    rucioClient, then the ones created from config by the previous calls (see threadClients),
+    and creates a new one only when there is none
+    :param rucioClient: Rucio python client, e.g. the object returned by getNativeRucioClient above
+    :param config: a TaskWorker configuration object used to create the Rucio clients of the threads
+    :param scope: the Rucio scope of the blocks
+    :param blocks: list of CMS block names
+    :param threads: number of concurrent calls to Rucio
+    :param bulkSize: number of blocks in each list_dataset_replicas_bulk call
+    :param logger: a valid logger instance
+    :return: a dictionary {block: set of RSEs}, only for the blocks which have at least one location
+    """
+    logger = logger or logging.getLogger()
+    blocks = list(blocks or [])
+    locationsMap = {}
+    start = time.time()
+    idleClients = [rucioClient]
+    def withClient(lookup):
+        """ run lookup with an idle client, which no other thread uses meanwhile """
+        def run(chunk):
+            with threadClientsLock:
+                client = idleClients.pop() if idleClients else (threadClients.pop() if threadClients else None)
+            if client is None:
+                client = makeRucioClient(config)
+            try:
+                return lookup(client, chunk)
+            finally:
+                with threadClientsLock:
+                    idleClients.append(client)
+        return run
+    if hasattr(rucioClient, 'list_dataset_replicas_bulk'):
+        chunks = [blocks[i:i + bulkSize] for i in range(0, len(blocks), bulkSize)]
+        @withClient
+        def lookup(client, chunk):
+            dids = [{'scope': scope, 'name': block} for block in chunk]
+            return list(client.list_dataset_replicas_bulk(dids))
+        mode = 'bulk'
+    else:
+        chunks = blocks
+        @withClient
+        def lookup(client, block):
+            replicas = []
+            for item in client.list_dataset_replicas(scope, block):
+                item['name'] = block
+                replicas.append(item)
+            return replicas
+        mode = 'per block'
+    nThreads = max(1, min(threads, len(chunks))) if config is not None else 1
+    if nThreads == 1:
+        results = [lookup(chunk) for chunk in chunks]
+    else:
+        pool = ThreadPool(nThreads)
+        try:
+            # map re-raises in this thread the first exception of a lookup
+            results = pool.map(lookup, chunks)
+        finally:
+            pool.close()
+            pool.join()
+            with threadClientsLock:
+                threadClients.extend(client for client in idleClients if client is not rucioClient)
+    for replicas in results:
+        for item in replicas:
+            # same as complete='y' used for PhEDEx
+            if item['state'].upper() == 'AVAILABLE':
+                locationsMap.setdefault(item['name'], set()).add(item['rse'])
+    logger.info("Rucio %s lookup of %d blocks in %d calls with %d threads took %.1f sec",
+                mode, len(blocks), len(chunks), nThreads, time.time() - start)
+    return locationsMap
 
 def getWritePFN(rucioClient=None, siteName='', lfn='', logger=None):
     """
@@ -8,12 +8,14 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
 
+import gc
 import os
 import sys
 import re
 import time
 import fcntl
 import hashlib
+import marshal
 import calendar
 import datetime
 import traceback
@@ -55,6 +57,47 @@ SERVICE_INSTANCES = {'prod': {'restHost':'cmsweb.cern.ch', 'dbInstance':'prod'},
                      'other': {'restHost':None, 'dbInstance':None},
                      }
 
+# Header of the status cache snapshot written by the task_process, see writeStatusCacheSnapshot
+STATUS_CACHE_SNAPSHOT_MAGIC = 'CRAB_STATUS_CACHE'
+STATUS_CACHE_SNAPSHOT_VERSION = 2
+
+# Zip archives with the job_lumis_N.json and job_input_file_list_N.txt of all the jobs of a task,
+# written by DagmanCreator and read by the jobs (TweakPSet.py), the PreDAG and the PostJobs
+RUN_AND_LUMIS_ARCHIVE = 'run_and_lumis.zip'
+INPUT_FILES_ARCHIVE = 'input_files.zip'
+# Same content as the zip archives, kept for the crab client (webdir and preparelocal)
+RUN_AND_LUMIS_TARBALL = 'run_and_lumis.tar.gz'
+INPUT_FILES_TARBALL = 'input_files.tar.gz'
+
+# Directory (in the spool dir) where task_process/cache_status_jel.py and RetryJob store the ad
+# of each finished job, as rebuilt from job_log by updateJobAd, in a file named <cluster>.<proc>
+JOB_AD_CACHE_DIR = 'task_process/job_ads'
+# JobStatus of a job after each event which goes in its ad, None if the status does not change.
+# The other events (e.g. PostScriptTerminatedEvent) are not about the job itself.
+JOB_AD_EVENT_STATUS = {
+    'SubmitEvent': 1,
+    'ExecuteEvent': 2,
+    'JobImageSizeEvent': None,
+    'JobAdInformationEvent': None,
+    'JobEvictedEvent': 1,
+    'ShadowExceptionEvent': 1,
+    'JobReconnectFailedEvent': 1,
+    'JobHeldEvent': 5,
+    'JobReleaseEvent': 1,
+    'JobAbortedEvent': 3,
+    'JobTerminatedEvent': 4,
+}
+# event attributes with a different name in the job ad
+JOB_AD_EVENT_RENAMES = {
+    'JobAbortedEvent': {'Reason': 'RemoveReason'},
+    'JobReleaseEvent': {'Reason': 'ReleaseReason'},
+    'JobTerminatedEvent': {'ReturnValue': 'ExitCode'},
+}
+JOB_AD_EVENT_SKIP = set(['MyType', 'EventTypeNumber', 'EventTime', 'Cluster', 'Proc', 'Subproc', 'LogNotes', 'Reason'])
+
+# Maximum number of files whose publication state is updated with one filetransfers POST
+PUBLICATION_UPDATE_CHUNK_SIZE = 1000
+
 # Fatal error limits for job resource usage
 # Defaults are used if unable to load from .job.ad
 # Otherwise it uses these values.
@@ -419,6 +462,97 @@ def getLock(name):
         yield fd
 
 
+def statusCacheSnapshotEncoding():
+    """ The marshal format depends on the python version (e.g. str is read back as bytes in
+        python 3), the snapshot can only be loaded by the interpreter which wrote it
+    """
+    return "marshal-py%d.%d-%d" % (sys.version_info[0], sys.version_info[1], marshal.version)
+
+
+def writeStatusCacheSnapshot(fileName, statusCache):
+    """ Store the status information collected by the task_process in a versioned binary snapshot:
+        one text header line with a magic string, the format version and the encoding, followed by
+        the marshal serialization of the statusCache dictionary, which contains the log checkpoints
+        plus the nodes and nodeMap structures. Unlike str()/ast.literal_eval this preserves the types
+        (e.g. the tuple keys of nodeMap) and is very fast to load also for tasks with many jobs.
+        The snapshot is private to the task_process: other components read status_cache.txt.
+        The file is written under a temporary name and renamed, so readers never see partial content.
+    """
+    tempFilename = "%s.%s" % (fileName, os.getpid())
+    with open(tempFilename, 'wb') as fd:
+        fd.write(("%s %d %s\n" % (STATUS_CACHE_SNAPSHOT_MAGIC, STATUS_CACHE_SNAPSHOT_VERSION,
+                                   statusCacheSnapshotEncoding())).encode('ascii'))
+        marshal.dump(statusCache, fd)
+    os.rename(tempFilename, fileName)
+
+
+def readStatusCacheSnapshot(fileName):
+    """ Load a snapshot written by writeStatusCacheSnapshot and return the statusCache dictionary.
+        Raise ValueError if the file is not a snapshot, has an unsupported version or was written
+        by a different python version.
+    """
+    with open(fileName, 'rb') as fd:
+        header = fd.readline().decode('ascii', 'replace').split()
+        if len(header) < 2 or header[0] != STATUS_CACHE_SNAPSHOT_MAGIC:
+            raise ValueError("%s is not a status cache snapshot" % fileName)
+        if header[1] != str(STATUS_CACHE_SNAPSHOT_VERSION) or len(header) != 3:
+            raise ValueError("Unsupported status cache snapshot version %s in %s" % (header[1], fileName))
+        if header[2] != statusCacheSnapshotEncoding():
+            raise ValueError("Status cache snapshot %s written with %s, cannot be read with %s" %
+                             (fileName, header[2], statusCacheSnapshotEncoding()))
+        # the cyclic garbage collector would be triggered many times while creating
+        # the millions of containers of a big task, but there can be no cycles here
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            return marshal.loads(fd.read())
+        finally:
+            if gcWasEnabled:
+                gc.enable()
+
+
+def updateJobAd(event, eventtime, jobAds):
+    """ Merge an event into the ad of its job, rebuilding from job_log what condor_q -userlog
+        provides to RetryJob. Used by task_process/cache_status_jel.py to fill JOB_AD_CACHE_DIR, and
+        by RetryJob when the job is not there yet. Ads are only tracked from the SubmitEvent on, so
+        that incomplete ads are never stored.
+    :param event: an event from HTCondor log
+    :param eventtime: the event time in seconds since the epoch
+    :param jobAds: dictionary (cluster, proc) -> ad (dictionary) of the jobs not finished yet
+    :return: nothing
+    """
+    eventType = event['MyType']
+    if eventType not in JOB_AD_EVENT_STATUS:
+        return
+    proc = event['Cluster'], event['Proc']
+    if eventType == 'SubmitEvent':
+        jobAds[proc] = {'ClusterId': proc[0], 'ProcId': proc[1], 'QDate': int(eventtime), 'RemoteWallClockTime': 0.0}
+    ad = jobAds.get(proc)
+    if ad is None:
+        return
+    renames = JOB_AD_EVENT_RENAMES.get(eventType, {})
+    for key, value in event.items():
+        key = renames.get(key, key)
+        if key in JOB_AD_EVENT_SKIP:
+            continue
+        if not isinstance(value, (bool, int, float, str)):
+            value = str(value)
+        ad[key] = value
+    newStatus = JOB_AD_EVENT_STATUS[eventType]
+    if newStatus is None:
+        return
+    if ad.get('JobStatus') == 2 and 'JobCurrentStartDate' in ad:
+        ad['RemoteWallClockTime'] += eventtime - ad['JobCurrentStartDate']
+    if eventType == 'ExecuteEvent':
+        ad['JobCurrentStartDate'] = int(eventtime)
+    elif eventType == 'JobReleaseEvent' and 'HoldReason' in ad:
+        ad['LastHoldReason'] = ad.pop('HoldReason')
+    elif eventType == 'JobTerminatedEvent':
+        ad['CompletionDate'] = int(eventtime)
+    ad['JobStatus'] = newStatus
+    ad['EnteredCurrentStatus'] = int(eventtime)
+
+
 def getHashLfn(lfn):
     """ Provide a hashed lfn from an lfn.
     """
@@ -482,6 +616,62 @@ def encodeRequest(configreq, listParams=None):
     return str(encoded)
 
 
+def updatePublicationState(crabserver=None, asoworker=None, lfns=None, state=None, failureReason='',
+                           logger=None, chunkSize=PUBLICATION_UPDATE_CHUNK_SIZE):
+    """
+    Set the publication state of a list of files via the updatePublication subresource of the
+    filetransfers API, sending up to chunkSize files in each request. If a request fails the
+    files of that chunk are updated one by one, so that one bad document does not prevent the
+    update of the others.
+    :param crabserver: a RESTInteraction/CRABRest object : points to CRAB Server to use
+    :param asoworker: string : the asoworker which owns the files
+    :param lfns: list : the source LFNs of the files, used to compute the document ids
+    :param state: string : the new publication state: DONE|FAILED|RETRY
+    :param failureReason: string : the failure reason stored for all files
+    :return: a tuple (number of updated files, list of LFNs which could not be updated, number of requests)
+    """
+    def post(lfnList):
+        """ Update the publication state of lfnList with one request """
+        data = {'asoworker': asoworker,
+                'subresource': 'updatePublication',
+                'list_of_ids': [getHashLfn(lfn) for lfn in lfnList],
+                'list_of_publication_state': [state] * len(lfnList),
+                'list_of_retry_value': [1] * len(lfnList),
+                # the REST splits the list parameters on commas
+                'list_of_failure_reason': [failureReason.replace(',', ';')] * len(lfnList)}
+        crabserver.post(api='filetransfers', data=encodeRequest(data))
+
+    nUpdated = 0
+    failedLfns = []
+    nRequests = 0
+    for first in range(0, len(lfns), chunkSize):
+        chunk = lfns[first:first+chunkSize]
+        nRequests += 1
+        try:
+            post(chunk)
+            nUpdated += len(chunk)
+            logger.debug("Set publication state %s for %d files", state, nUpdated)
+            continue
+        except Exception as ex:  # pylint: disable=broad-except
+            if len(chunk) == 1:
+                logger.error("Error updating publication state for DocumentId: %s lfn: %s", getHashLfn(chunk[0]), chunk[0])
+                logger.error("Error reason: %s", ex)
+                failedLfns.extend(chunk)
+                continue
+            logger.warning("Failed to update the publication state of %d files, will update them one by one: %s",
+                           len(chunk), ex)
+        for lfn in chunk:
+            nRequests += 1
+            try:
+                post([lfn])
+                nUpdated += 1
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.error("Error updating publication state for DocumentId: %s lfn: %s", getHashLfn(lfn), lfn)
+                logger.error("Error reason: %s", ex)
+                failedLfns.append(lfn)
+    return nUpdated, failedLfns, nRequests
+
+
 def oracleOutputMapping(result, key=None):
     """ If key is defined, it will use id as a key and will return dictionary which contains all items with this specific key
         Otherwise it will return a list of dictionaries.
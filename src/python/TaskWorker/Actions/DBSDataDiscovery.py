@@ -6,13 +6,12 @@ import copy
 from httplib import HTTPException
 import urllib
 
-from WMCore.DataStructs.LumiList import LumiList
 from WMCore.Services.DBS.DBSReader import DBSReader
 from WMCore.Services.DBS.DBSErrors import DBSReaderError
 
 from TaskWorker.WorkerExceptions import TaskWorkerException, TapeDatasetException
 from TaskWorker.Actions.DataDiscovery import DataDiscovery
-from RucioUtils import getNativeRucioClient
+from RucioUtils import getNativeRucioClient, getBlocksLocations
 
 from rucio.common.exception import (DuplicateRule, DataIdentifierAlreadyExists, DuplicateContent,
     InsufficientTargetRSEs, InsufficientAccountLimit, FullStorage)
@@ -74,6 +73,30 @@ class DBSDataDiscovery(DataDiscovery):
         locationsMap.clear() # remove all blocks
         locationsMap.update(diskLocationsMap) # add only blocks with disk locations
 
+    @staticmethod
+    def matchSecondaryFiles(filedetails, secondaryfiledetails):
+        """ Set as 'Parents' of each file in filedetails the files in secondaryfiledetails
+            with which it shares at least one lumi. Both arguments are in the format
+            returned by DBSReader.listDatasetFileDetails, i.e. {lfn: {'Lumis': {run: [lumis]}, ...}}.
+            An index (run, lumi) -> secondary files is built once, so that the matching is
+            linear in the number of lumis instead of comparing every pair of files.
+        """
+        lumiIndex = {}
+        secondaryOrder = {}
+        for secfilename, secinfos in secondaryfiledetails.iteritems():
+            secondaryOrder[secfilename] = len(secondaryOrder)
+            for run, lumis in secinfos['Lumis'].iteritems():
+                run = int(run)
+                for lumi in lumis:
+                    lumiIndex.setdefault((run, int(lumi)), []).append(secfilename)
+        for infos in filedetails.itervalues():
+            parents = set()
+            for run, lumis in infos['Lumis'].iteritems():
+                run = int(run)
+                for lumi in lumis:
+                    parents.update(lumiIndex.get((run, int(lumi)), ()))
+            infos['Parents'] = sorted(parents, key=secondaryOrder.get)
+
     def checkBlocksSize(self, blocks):
         """ Make sure no single blocks has more than 100k lumis. See
             https://hypernews.cern.ch/HyperNews/CMS/get/dmDevelopment/2022/1/1/1/1/1/1/2.html
@@ -294,6 +317,8 @@ class DBSDataDiscovery(DataDiscovery):
         # uncomment followint line to look in Rucio first for any dataset, and fall back to DBS origin for USER ones
         # useRucioForLocations = True
         locationsFoundWithRucio = False
+        # number of concurrent Rucio calls used to find the blocks locations
+        rucioThreads = getattr(self.config.TaskWorker, 'rucioLookupThreads', 8)
 
         if not useRucioForLocations:
             self.logger.info("Will not use Rucio for this dataset")
@@ -305,17 +330,9 @@ class DBSDataDiscovery(DataDiscovery):
             if isUserDataset:
                 scope = "user.%s" % self.username
             self.logger.info("Looking up data location with Rucio in %s scope.", scope)
-            locationsMap = {}
             try:
-                for blockName in list(blocks):
-                    replicas = set()
-                    response = self.rucioClient.list_dataset_replicas(scope, blockName)
-                    for item in response:
-                        # same as complete='y' used for PhEDEx
-                        if item['state'].upper() == 'AVAILABLE':
-                            replicas.add(item['rse'])
-                    if replicas:  # only fill map for blocks which have at least one location
-                        locationsMap[blockName] = replicas
+                locationsMap = getBlocksLocations(rucioClient=self.rucioClient, config=self.config, scope=scope, blocks=blocks,
+                                                  threads=rucioThreads, logger=self.logger)
             except Exception as exc:
                 msg = "Rucio lookup failed with\n%s" % str(exc)
                 self.logger.warning(msg)
@@ -360,17 +377,10 @@ class DBSDataDiscovery(DataDiscovery):
                     )
             else:
                 self.logger.info("Trying data location of secondary dataset blocks with Rucio")
-                secondaryLocationsMap = {}
                 try:
-                    for blockName in list(secondaryBlocks):
-                        replicas = set()
-                        response = self.rucioClient.list_dataset_replicas(scope, blockName)
-                        for item in response:
-                            # same as complete='y' used for PhEDEx
-                            if item['state'].upper() == 'AVAILABLE':
-                                replicas.add(item['rse'])
-                        if replicas:  # only fill map for blocks which have at least one location
-                            secondaryLocationsMap[blockName] = replicas
+                    secondaryLocationsMap = getBlocksLocations(rucioClient=self.rucioClient, config=self.config, scope='cms',
+                                                               blocks=secondaryBlocks, threads=rucioThreads,
+                                                               logger=self.logger)
                 except Exception as exc:
                     msg = "Rucio lookup failed with\n%s" % str(exc)
                     self.logger.warning(msg)
@@ -415,16 +425,8 @@ class DBSDataDiscovery(DataDiscovery):
             if secondaryDataset:
                 moredetails = self.dbs.listDatasetFileDetails(secondaryDataset, getParents=False, getLumis=needLumiInfo, validFileOnly=0)
 
-                for secfilename, secinfos in moredetails.items():
-                    secinfos['lumiobj'] = LumiList(runsAndLumis=secinfos['Lumis'])
-
                 self.logger.info("Beginning to match files from secondary dataset")
-                for dummyFilename, infos in filedetails.items():
-                    infos['Parents'] = []
-                    lumis = LumiList(runsAndLumis=infos['Lumis'])
-                    for secfilename, secinfos in moredetails.items():
-                        if lumis & secinfos['lumiobj']:
-                            infos['Parents'].append(secfilename)
+                self.matchSecondaryFiles(filedetails, moredetails)
                 self.logger.info("Done matching files from secondary dataset")
                 kwargs['task']['tm_use_parent'] = 1
         except Exception as ex: #TODO should we catch HttpException instead?
@@ -4,19 +4,23 @@ Create a set of files for a DAG submission.
 Generates the condor submit files and the master DAG.
 """
 
+import io
 import os
 import re
 import json
+import time
 import shutil
 import pickle
 import random
+import zlib
 import tarfile
+import zipfile
 import hashlib
-import tempfile
 from ast import literal_eval
 
 from ServerUtilities import insertJobIdSid, MAX_DISK_SPACE, MAX_IDLE_JOBS, MAX_POST_JOBS, TASKLIFETIME
 from ServerUtilities import getLock, downloadFromS3
+from ServerUtilities import RUN_AND_LUMIS_ARCHIVE, INPUT_FILES_ARCHIVE, RUN_AND_LUMIS_TARBALL, INPUT_FILES_TARBALL
 
 import TaskWorker.WorkerExceptions
 import TaskWorker.DataObjects.Result
@@ -531,8 +535,8 @@ class DagmanCreator(TaskAction):
             raise TaskWorkerException("Cannot find TaskManagerRun.tar.gz inside the cwd: %s" % os.getcwd())
         if os.path.exists("sandbox.tar.gz"):
             info['additional_input_file'] += ", sandbox.tar.gz"
-        info['additional_input_file'] += ", run_and_lumis.tar.gz"
-        info['additional_input_file'] += ", input_files.tar.gz"
+        info['additional_input_file'] += ", %s" % RUN_AND_LUMIS_ARCHIVE
+        info['additional_input_file'] += ", %s" % INPUT_FILES_ARCHIVE
 
         info['max_disk_space'] = MAX_DISK_SPACE
 
@@ -702,6 +706,65 @@ class DagmanCreator(TaskAction):
         finally:
             tf.close()
 
+    @staticmethod
+    def archiveMode(fileName):
+        """ Append to the archives written for the previous stages of the task """
+        return 'a' if os.path.exists(fileName) else 'w'
+
+    @staticmethod
+    def gzipMember(data):
+        """ Compress data as one gzip member, always the same bytes for the same data """
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def appendToTarball(self, tarball, archive, members):
+        """
+        The crab client reads run_and_lumis.tar.gz from the webdir, and preparelocal extracts it and
+        input_files.tar.gz from InputFiles.tar.gz: keep them in sync with the zip archives by appending
+        only the members of the new jobs. The tarball is a sequence of gzip members: one for the jobs
+        of each stage and a last one with the tar end of archive marker, which is cut and written again
+        after the new jobs. gzip readers, tarfile and tar included, read a sequence of gzip members as
+        one stream, so this is a normal tar.gz
+        :param tarball: name of the tarball
+        :param archive: name of the zip archive with the same content
+        :param members: list of (name, content) of the files added to the zip archive
+        """
+        endMember = self.gzipMember(b'\0' * 2 * tarfile.BLOCKSIZE)
+        if os.path.exists(tarball):
+            with open(tarball, 'r+b') as fd:
+                fd.seek(0, os.SEEK_END)
+                endOffset = fd.tell() - len(endMember)
+                if endOffset >= 0:
+                    fd.seek(endOffset)
+                    if fd.read() == endMember:
+                        fd.seek(endOffset)
+                        fd.truncate()
+                        fd.write(self.gzipMember(self.tarMembers(members)) + endMember)
+                        self.logger.debug("Appended %d files to %s", len(members), tarball)
+                        return
+            # not written by this method, make it again with all the members of the zip archive
+            with zipfile.ZipFile(archive) as zfd:
+                members = [(zinfo.filename, zfd.read(zinfo)) for zinfo in zfd.infolist()]
+        tmpName = tarball + '.tmp'
+        with open(tmpName, 'wb') as fd:
+            fd.write(self.gzipMember(self.tarMembers(members)) + endMember)
+        os.rename(tmpName, tarball)
+        self.logger.debug("Wrote %s with %d files", tarball, len(members))
+
+    @staticmethod
+    def tarMembers(members):
+        """ Tar headers and contents of a list of (name, content), without the end of archive marker """
+        tarData = io.BytesIO()
+        now = time.time()
+        for name, content in members:
+            tinfo = tarfile.TarInfo(name)
+            tinfo.size = len(content)
+            tinfo.mtime = now
+            tarData.write(tinfo.tobuf())
+            tarData.write(content)
+            tarData.write(b'\0' * (-len(content) % tarfile.BLOCKSIZE))
+        return tarData.getvalue()
+
     def createSubdag(self, splitterResult, **kwargs):
 
         startjobid = kwargs.get('startjobid', 0)
@@ -970,44 +1033,25 @@ class DagmanCreator(TaskAction):
                     fd.write("")
                 subdags.append(subdag)
 
-        ## Create a tarball with all the job lumi files.
+        ## Append the lumis and the input files of each job to the indexed archives, so that
+        ## the jobs, the PreDAG and the PostJobs can read a single member without decompressing
+        ## the others, and the tail subdags do not need to rewrite what is already there.
         with getLock('splitting_data'):
-            self.logger.debug("Acquired lock on run and lumi tarball")
-
-            try:
-                tempDir = tempfile.mkdtemp()
-                tempDir2 = tempfile.mkdtemp()
-
-                try:
-                    tfd = tarfile.open('run_and_lumis.tar.gz', 'r:gz')
-                    tfd.extractall(tempDir)
-                    tfd.close()
-                except (tarfile.ReadError, IOError):
-                    self.logger.debug("First iteration: creating run and lumi from scratch")
-                try:
-                    tfd2 = tarfile.open('input_files.tar.gz', 'r:gz')
-                    tfd2.extractall(tempDir2)
-                    tfd2.close()
-                except (tarfile.ReadError, IOError):
-                    self.logger.debug("First iteration: creating inputfiles from scratch")
-                tfd = tarfile.open('run_and_lumis.tar.gz', 'w:gz')
-                tfd2 = tarfile.open('input_files.tar.gz', 'w:gz')
+            self.logger.debug("Acquired lock on run and lumi archives")
+            with zipfile.ZipFile(RUN_AND_LUMIS_ARCHIVE, self.archiveMode(RUN_AND_LUMIS_ARCHIVE),
+                                 zipfile.ZIP_DEFLATED, allowZip64=True) as zfd, \
+                 zipfile.ZipFile(INPUT_FILES_ARCHIVE, self.archiveMode(INPUT_FILES_ARCHIVE),
+                                 zipfile.ZIP_DEFLATED, allowZip64=True) as zfd2:
+                lumisMembers = []
+                inputFilesMembers = []
                 for dagSpec in dagSpecs:
-                    job_lumis_file = os.path.join(tempDir, 'job_lumis_'+ str(dagSpec['count']) +'.json')
-                    with open(job_lumis_file, "w") as fd:
-                        fd.write(str(dagSpec['runAndLumiMask']))
-                    ## Also creating a tarball with the dataset input files.
-                    ## Each .txt file in the tarball contains a list of dataset files to be used for the job.
-                    job_input_file_list = os.path.join(tempDir2, 'job_input_file_list_'+ str(dagSpec['count']) +'.txt')
-                    with open(job_input_file_list, "w") as fd2:
-                        fd2.write(str(dagSpec['inputFiles']))
-            finally:
-                tfd.add(tempDir, arcname='')
-                tfd.close()
-                shutil.rmtree(tempDir)
-                tfd2.add(tempDir2, arcname='')
-                tfd2.close()
-                shutil.rmtree(tempDir2)
+                    lumisMembers.append(('job_lumis_%s.json' % dagSpec['count'], str(dagSpec['runAndLumiMask'])))
+                    zfd.writestr(*lumisMembers[-1])
+                    ## Each .txt file contains the list of dataset files to be used by the job.
+                    inputFilesMembers.append(('job_input_file_list_%s.txt' % dagSpec['count'], str(dagSpec['inputFiles'])))
+                    zfd2.writestr(*inputFilesMembers[-1])
+            self.appendToTarball(RUN_AND_LUMIS_TARBALL, RUN_AND_LUMIS_ARCHIVE, lumisMembers)
+            self.appendToTarball(INPUT_FILES_TARBALL, INPUT_FILES_ARCHIVE, inputFilesMembers)
 
         if stage in ('probe', 'conventional'):
             name = "RunJobs.dag"
@@ -1220,7 +1264,7 @@ class DagmanCreator(TaskAction):
 
         inputFiles = ['gWMS-CMSRunAnalysis.sh', 'CMSRunAnalysis.sh', 'cmscp.py', 'RunJobs.dag', 'Job.submit', 'dag_bootstrap.sh',
                       'AdjustSites.py', 'site.ad', 'site.ad.json', 'datadiscovery.pkl', 'taskinformation.pkl', 'taskworkerconfig.pkl',
-                      'run_and_lumis.tar.gz', 'input_files.tar.gz']
+                      RUN_AND_LUMIS_ARCHIVE, INPUT_FILES_ARCHIVE, RUN_AND_LUMIS_TARBALL, INPUT_FILES_TARBALL]
 
         self.extractMonitorFiles(inputFiles, **kw)
 
@@ -32,8 +32,9 @@ class DataDiscovery(TaskAction):
         wmfiles = []
         event_counter = 0
         lumi_counter = 0
-        uniquelumis = set()
         datasetLumis = {}
+        ## PNNs to PSNs translations, which depend only on the set of locations of the block
+        psnsForLocations = {}
         blocksWithNoLocations = set()
         ## Loop over the sorted list of files.
         configDict = {"cacheduration": 1, "pycurl": True} # cache duration is in hours
@@ -69,19 +70,20 @@ class DataDiscovery(TaskAction):
                     checksums = infos['Checksums']
                 wmfile = File(lfn = lfn, events = infos['NumberOfEvents'], size = size, checksums = checksums, parents = infos['Parents'])
                 wmfile['block'] = infos['BlockName']
-                try:
-                    wmfile['locations'] = resourceCatalog.PNNstoPSNs(locations[wmfile['block']])
-                except Exception as ex:
-                    self.logger.error("Impossible translating %s to a CMS name through CMS Resource Catalog", locations[wmfile['block']] )
-                    self.logger.error("got this exception:\n %s", ex)
-                    raise
+                blockLocations = frozenset(locations[wmfile['block']])
+                if blockLocations not in psnsForLocations:
+                    try:
+                        psnsForLocations[blockLocations] = resourceCatalog.PNNstoPSNs(locations[wmfile['block']])
+                    except Exception as ex:
+                        self.logger.error("Impossible translating %s to a CMS name through CMS Resource Catalog", locations[wmfile['block']] )
+                        self.logger.error("got this exception:\n %s", ex)
+                        raise
+                wmfile['locations'] = list(psnsForLocations[blockLocations])
                 wmfile['workflow'] = requestname
                 event_counter += infos['NumberOfEvents']
                 for run, lumis in infos['Lumis'].iteritems():
                     datasetLumis.setdefault(run, []).extend(lumis)
                     wmfile.addRun(Run(run, *lumis))
-                    for lumi in lumis:
-                        uniquelumis.add((run, lumi))
                     lumi_counter += len(lumis)
                 wmfiles.append(wmfile)
 
@@ -90,17 +92,19 @@ class DataDiscovery(TaskAction):
             self.logger.warning(msg)
             self.uploadWarning(msg, task['user_proxy'], task['tm_taskname'])
 
-        uniquelumis = len(uniquelumis)
-        self.logger.debug('Tot events found: %d', event_counter)
-        self.logger.debug('Tot lumis found: %d', uniquelumis)
-        self.logger.debug('Duplicate lumis found: %d', (lumi_counter - uniquelumis))
-        self.logger.debug('Tot files found: %d', len(wmfiles))
-
         self.logger.debug("Starting to create compact lumilists for input dataset")
         datasetLumiList = LumiList(runsAndLumis=datasetLumis)
         datasetLumis = datasetLumiList.getCompactList()
         datasetDuplicateLumis = datasetLumiList.getDuplicates().getCompactList()
         self.logger.debug("Finished to create compact lumilists for input dataset")
+
+        ## the ranges of the compact list do not overlap, duplicates are kept apart
+        uniquelumis = sum(last - first + 1 for ranges in datasetLumis.itervalues() for first, last in ranges)
+        self.logger.debug('Tot events found: %d', event_counter)
+        self.logger.debug('Tot lumis found: %d', uniquelumis)
+        self.logger.debug('Duplicate lumis found: %d', (lumi_counter - uniquelumis))
+        self.logger.debug('Tot files found: %d', len(wmfiles))
+
         with open(os.path.join(tempDir, "input_dataset_lumis.json"), "w") as fd:
             json.dump(datasetLumis, fd)
         with open(os.path.join(tempDir, "input_dataset_duplicate_lumis.json"), "w") as fd:
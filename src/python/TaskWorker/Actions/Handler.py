@@ -155,6 +155,19 @@ class TaskHandler(object):
         return output
 
 
+def getCRABRest(resthost, dbInstance, config, procnum, clients=None):
+    """Return the REST session of the slave if available, otherwise a new one
+
+    :arg SlaveClients clients: the long lived clients of the slave process, or None
+    :return: a CRABRest object"""
+    if clients:
+        return clients.crabserver
+    crabserver = CRABRest(resthost, config.TaskWorker.cmscert, config.TaskWorker.cmskey, retry=20,
+                          logger=logging.getLogger(str(procnum)), userAgent='CRABTaskWorker', version=__version__)
+    crabserver.setDbInstance(dbInstance)
+    return crabserver
+
+
 def handleNewTask(resthost, dbInstance, config, task, procnum, *args, **kwargs):
     """Performs the injection of a new task
 
@@ -163,13 +176,13 @@ def handleNewTask(resthost, dbInstance, config, task, procnum, *args, **kwargs):
     :arg WMCore.Configuration config: input configuration
     :arg TaskWorker.DataObjects.Task task: the task to work on
     :arg int procnum: the process number taking care of the work
+    :arg SlaveClients clients: (in kwargs) long lived REST and Rucio clients of the slave, optional
     :*args and *kwargs: extra parameters currently not defined
     :return: the handler."""
-    crabserver = CRABRest(resthost, config.TaskWorker.cmscert, config.TaskWorker.cmskey, retry=20,
-                          logger=logging.getLogger(str(procnum)), userAgent='CRABTaskWorker', version=__version__)
-    crabserver.setDbInstance(dbInstance)
+    clients = kwargs.pop('clients', None)
+    crabserver = getCRABRest(resthost, dbInstance, config, procnum, clients)
     handler = TaskHandler(task, procnum, crabserver, config, 'handleNewTask', createTempDir=True)
-    rucioClient = getNativeRucioClient(config=config, logger=handler.logger)
+    rucioClient = clients.rucioClient if clients else getNativeRucioClient(config=config, logger=handler.logger)
     handler.addWork(MyProxyLogon(config=config, crabserver=crabserver, procnum=procnum, myproxylen=60 * 60 * 24))
     handler.addWork(StageoutCheck(config=config, crabserver=crabserver, procnum=procnum, rucioClient=rucioClient))
     if task['tm_job_type'] == 'Analysis':
@@ -197,11 +210,11 @@ def handleResubmit(resthost, dbInstance, config, task, procnum, *args, **kwargs)
     :arg WMCore.Configuration config: input configuration
     :arg TaskWorker.DataObjects.Task task: the task to work on
     :arg int procnum: the process number taking care of the work
+    :arg SlaveClients clients: (in kwargs) long lived REST and Rucio clients of the slave, optional
     :*args and *kwargs: extra parameters currently not defined
     :return: the result of the handler operation."""
-    crabserver = CRABRest(resthost, config.TaskWorker.cmscert, config.TaskWorker.cmskey, retry=20,
-                          logger=logging.getLogger(str(procnum)), userAgent='CRABTaskWorker', version=__version__)
-    crabserver.setDbInstance(dbInstance)
+    clients = kwargs.pop('clients', None)
+    crabserver = getCRABRest(resthost, dbInstance, config, procnum, clients)
     handler = TaskHandler(task, procnum, crabserver, config, 'handleResubmit')
     handler.addWork(MyProxyLogon(config=config, crabserver=crabserver, procnum=procnum, myproxylen=60 * 60 * 24))
     handler.addWork(DagmanResubmitter(config=config, crabserver=crabserver, procnum=procnum))
@@ -217,11 +230,11 @@ def handleKill(resthost, dbInstance, config, task, procnum, *args, **kwargs):
     :arg WMCore.Configuration config: input configuration
     :arg TaskWorker.DataObjects.Task task: the task to work on
     :arg int procnum: the process number taking care of the work
+    :arg SlaveClients clients: (in kwargs) long lived REST and Rucio clients of the slave, optional
     :*args and *kwargs: extra parameters currently not defined
     :return: the result of the handler operation."""
-    crabserver = CRABRest(resthost, config.TaskWorker.cmscert, config.TaskWorker.cmskey, retry=20,
-                          logger=logging.getLogger(str(procnum)), userAgent='CRABTaskWorker', version=__version__)
-    crabserver.setDbInstance(dbInstance)
+    clients = kwargs.pop('clients', None)
+    crabserver = getCRABRest(resthost, dbInstance, config, procnum, clients)
     handler = TaskHandler(task, procnum, crabserver, config, 'handleKill')
     handler.addWork(MyProxyLogon(config=config, crabserver=crabserver, procnum=procnum, myproxylen=60 * 5))
     handler.addWork(DagmanKiller(config=config, crabserver=crabserver, procnum=procnum))
@@ -74,7 +74,6 @@ import uuid
 import errno
 import pprint
 import signal
-import tarfile
 import hashlib
 import logging
 import logging.handlers
@@ -86,7 +85,8 @@ import tempfile
 import traceback
 import random
 import shutil
-from shutil import move
+import sqlite3
+import zipfile
 from httplib import HTTPException
 
 import htcondor
@@ -100,7 +100,7 @@ from TaskWorker import __version__
 from TaskWorker.Actions.RetryJob import RetryJob
 from TaskWorker.Actions.RetryJob import JOB_RETURN_CODES
 from ServerUtilities import isFailurePermanent, parseJobAd, mostCommon, TRANSFERDB_STATES, PUBLICATIONDB_STATES, encodeRequest, isCouchDBURL, oracleOutputMapping
-from ServerUtilities import getLock
+from ServerUtilities import getLock, RUN_AND_LUMIS_ARCHIVE
 from RESTInteractions import CRABRest
 
 ASO_JOB = None
@@ -108,8 +108,10 @@ G_JOB_REPORT_NAME = None
 G_JOB_REPORT_NAME_NEW = None
 G_WMARCHIVE_REPORT_NAME = None
 G_WMARCHIVE_REPORT_NAME_NEW = None
-G_ERROR_SUMMARY_FILE_NAME = "error_summary.json"
 G_FJR_PARSE_RESULTS_FILE_NAME = "task_process/fjr_parse_results.txt"
+G_ASO_STATUS_DB_NAME = "aso_status.db"
+## Maximum number of files in one filemetadata bulkinject request
+FILEMETADATA_BULK_SIZE = 100
 
 def sighandler(*args):
     if ASO_JOB:
@@ -134,9 +136,11 @@ def first_pj_execution():
 
 ##==============================================================================
 
-def prepareErrorSummary(logger, fsummary, job_id, crab_retry):
+def prepareErrorSummary(logger, job_id, crab_retry):
     """Parse the job_fjr file corresponding to the current PostJob. If an error
-       message is found, it is inserted into the error_summary.json file
+       message is found, it is appended to the fjr_parse_results journal. The
+       error_summary.json file served to the status API is not touched here, it
+       is rebuilt from the journal by the task_process
     """
 
     ## The job_id and crab_retry variables in PostJob are integers, while here we
@@ -230,35 +234,13 @@ def prepareErrorSummary(logger, fsummary, job_id, crab_retry):
             error_summary = [exit_code, exit_msg, {}]
             error_summary_changed = True
 
-    # Write the fjr report summary of this postjob to a file which task_process reads incrementally
+    # Append the fjr report summary of this postjob to the journal which task_process reads
+    # incrementally and periodically compacts into error_summary.json (see cache_status.py)
     if error_summary_changed:
         with getLock(G_FJR_PARSE_RESULTS_FILE_NAME):
             with open(G_FJR_PARSE_RESULTS_FILE_NAME, "a+") as fjr_parse_results:
                 fjr_parse_results.write(json.dumps({job_id : {crab_retry : error_summary}}) + "\n")
 
-    # Read, update and re-write the error_summary.json file
-    try:
-        error_summary_old_content = {}
-        if os.stat(G_ERROR_SUMMARY_FILE_NAME).st_size != 0:
-            fsummary.seek(0)
-            error_summary_old_content = json.load(fsummary)
-    except (IOError, ValueError):
-        ## There is nothing to do if the error_summary file doesn't exist or is invalid.
-        ## Just recreate it.
-        logger.info("File %s is empty, wrong or does not exist. Will create a new file." % (G_ERROR_SUMMARY_FILE_NAME))
-    error_summary_new_content = error_summary_old_content
-    error_summary_new_content[job_id] = {crab_retry : error_summary}
-
-    ## If we have updated the error summary, write it to the json file.
-    ## Use a temporary file and rename to avoid concurrent writing of the file.
-    if error_summary_changed:
-        logger.debug("Writing error summary file")
-        tempFilename = (G_ERROR_SUMMARY_FILE_NAME + ".%s") % os.getpid()
-        with open(tempFilename, "w") as tempFile:
-            json.dump(error_summary_new_content, tempFile)
-        move(tempFilename, G_ERROR_SUMMARY_FILE_NAME)
-        logger.debug("Written error summary file")
-
 def fixUpTempStorageSite(logger=None, siteName=None):
     """
     overrides the name of the site used for local stageout at WN in /store/temp/user
@@ -973,16 +955,107 @@ class ASOServerJob(object):
             "query_jobid": self.job_id,
             "results": {},
         }
+        self.store_transfers_cache(aso_info)
+
+    ##= = = = = ASOServerJob = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+    def store_transfers_cache(self, aso_info):
+        """
+        Save the result of a query of the transfer statuses of the whole task.
+        aso_status.json is what the status command reads from the webdir, while the post-jobs
+        read the same content from the aso_status.db sqlite file, indexed by document id,
+        so that each of them only loads its own documents.
+        """
         tmp_fname = "aso_status.%d.json" % (os.getpid())
         with open(tmp_fname, 'w') as fd:
             json.dump(aso_info, fd)
         os.rename(tmp_fname, "aso_status.json")
+        try:
+            if not os.path.exists(G_ASO_STATUS_DB_NAME):
+                self.create_transfers_cache()
+            conn = sqlite3.connect(G_ASO_STATUS_DB_NAME, timeout=60)
+            try:
+                with conn:
+                    conn.execute("DELETE FROM docs")
+                    conn.executemany("INSERT INTO docs VALUES (?, ?)",
+                                     ((doc_id, json.dumps(doc)) for doc_id, doc in aso_info['results'].items()))
+                    conn.execute("INSERT OR REPLACE INTO query VALUES (0, ?, ?, ?)",
+                                 (aso_info['query_timestamp'], aso_info['query_succeded'], str(aso_info['query_jobid'])))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            ## The other post-jobs will find an old query_timestamp and query the database again.
+            self.logger.exception("Failed to store the transfer statuses in %s.", G_ASO_STATUS_DB_NAME)
+
+    ##= = = = = ASOServerJob = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+    def create_transfers_cache(self):
+        """
+        Create aso_status.db with its tables. The schema is created in a temporary file which is
+        then linked into place, so that no post-job can open the file before the tables exist.
+        If another post-job created it in the meanwhile, its file is kept.
+        """
+        tmp_fname = "aso_status.%d.db" % (os.getpid())
+        conn = sqlite3.connect(tmp_fname)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS query (id INTEGER PRIMARY KEY, query_timestamp REAL,"
+                         " query_succeded INTEGER, query_jobid TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, doc TEXT)")
+            conn.commit()
+        finally:
+            conn.close()
+        try:
+            os.link(tmp_fname, G_ASO_STATUS_DB_NAME)
+        except OSError as ose:
+            if ose.errno != errno.EEXIST:
+                raise
+        finally:
+            os.unlink(tmp_fname)
+
+    ##= = = = = ASOServerJob = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+    def load_transfers_cache(self):
+        """
+        Load from aso_status.db the information about the last query of the transfer
+        statuses and the results for the documents of this post-job only.
+        """
+        doc_ids = [doc_info['doc_id'] for doc_info in self.docs_in_transfer]
+        results = {}
+        conn = sqlite3.connect(G_ASO_STATUS_DB_NAME, timeout=60)
+        try:
+            ## Read everything in one transaction, so that we see a single query result.
+            conn.isolation_level = None
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute("SELECT query_timestamp, query_succeded, query_jobid FROM query").fetchone()
+            except sqlite3.OperationalError as ex:
+                ## A file left without tables, e.g. by an older version: same as no cache.
+                if "no such table" not in str(ex):
+                    raise
+                self.logger.info("No transfer statuses in %s yet.", G_ASO_STATUS_DB_NAME)
+                return {}
+            for i in range(0, len(doc_ids), 500):
+                chunk = doc_ids[i:i + 500]
+                sql = "SELECT doc_id, doc FROM docs WHERE doc_id IN (%s)" % ", ".join(["?"] * len(chunk))
+                for doc_id, doc in conn.execute(sql, chunk):
+                    results[doc_id] = json.loads(doc)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        if not row:
+            return {}
+        return {
+            "query_timestamp": row[0],
+            "query_succeded": bool(row[1]),
+            "query_jobid": row[2],
+            "results": results,
+        }
 
     ##= = = = = ASOServerJob = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
     def get_transfers_statuses(self):
         """
-        Retrieve the status of all transfers from the cached file 'aso_status.json'
+        Retrieve the status of all transfers from the cached file 'aso_status.db'
         or by querying an ASO database view if the file is more than 5 minutes old
         or if we injected a document after the file was last updated. Calls to
         get_transfers_statuses_fallback() have been removed to not generate load
@@ -990,14 +1063,13 @@ class ASOServerJob(object):
         """
         statuses = []
         query_view = False
-        if not os.path.exists("aso_status.json"):
+        if not os.path.exists(G_ASO_STATUS_DB_NAME):
             query_view = True
         aso_info = {}
         if not query_view:
             query_view = True
             try:
-                with open("aso_status.json") as fd:
-                    aso_info = json.load(fd)
+                aso_info = self.load_transfers_cache()
             except:
                 msg = "Failed to load transfer cache."
                 self.logger.exception(msg)
@@ -1045,10 +1117,7 @@ class ASOServerJob(object):
                     "query_jobid": self.job_id,
                     "results": view_results_dict,
                 }
-                tmp_fname = "aso_status.%d.json" % (os.getpid())
-                with open(tmp_fname, 'w') as fd:
-                    json.dump(aso_info, fd)
-                os.rename(tmp_fname, "aso_status.json")
+                self.store_transfers_cache(aso_info)
             else:
                 self.logger.debug("Using cached ASO results.")
             #Is this ever happening?
@@ -1113,10 +1182,7 @@ class ASOServerJob(object):
                     "query_jobid": self.job_id,
                     "results": view_results_dict,
                 }
-                tmp_fname = "aso_status.%d.json" % (os.getpid())
-                with open(tmp_fname, 'w') as fd:
-                    json.dump(aso_info, fd)
-                os.rename(tmp_fname, "aso_status.json")
+                self.store_transfers_cache(aso_info)
             else:
                 self.logger.debug("Using cached ASO results.")
             if not aso_info:
@@ -1709,12 +1775,8 @@ class PostJob():
         ## Prepare the error report. Enclosing it in a try except as we don't want to
         ## fail jobs because this fails.
         self.logger.info("====== Starting to prepare error report.")
-        self.logger.debug("Acquiring lock on error summary file.")
         try:
-            with getLock(G_ERROR_SUMMARY_FILE_NAME):
-                self.logger.debug("Acquired lock on error summary file.")
-                with open(G_ERROR_SUMMARY_FILE_NAME, "a+") as fsummary:
-                    prepareErrorSummary(self.logger, fsummary, self.job_id, self.crab_retry)
+            prepareErrorSummary(self.logger, self.job_id, self.crab_retry)
         except Exception:
             msg = "Unknown error while preparing the error report."
             self.logger.exception(msg)
@@ -1868,17 +1930,9 @@ class PostJob():
         if self.stage == 'probe':
             return
         self.logger.info("====== Starting to parse the lumi file")
-        try:
-            tmpdir = tempfile.mkdtemp()
-            f = tarfile.open("run_and_lumis.tar.gz")
-            fn = "job_lumis_{0}.json".format(self.job_id)
-            f.extract(fn, path=tmpdir)
-            with open(os.path.join(tmpdir, fn)) as fd:
-                injson = json.load(fd)
-                inlumis = LumiList(compactList=injson)
-        finally:
-            f.close()
-            shutil.rmtree(tmpdir)
+        with zipfile.ZipFile(RUN_AND_LUMIS_ARCHIVE) as zfd:
+            injson = json.loads(zfd.read("job_lumis_{0}.json".format(self.job_id)))
+        inlumis = LumiList(compactList=injson)
 
         outlumis = LumiList()
         for input_ in self.job_report['steps']['cmsRun']['input']['source']:
@@ -2385,6 +2439,47 @@ class PostJob():
 
     ## = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
+    def upload_files_metadata(self, taskname, files_metadata, what):
+        """
+        Upload the metadata of the input or output files of the job, with one filemetadata
+        bulkinject request for up to FILEMETADATA_BULK_SIZE files. If the REST rejects it
+        (e.g. it does not support bulkinject yet), upload the files one by one.
+        """
+        rest_api = 'filemetadata'
+        for first in range(0, len(files_metadata), FILEMETADATA_BULK_SIZE):
+            chunk = files_metadata[first:first+FILEMETADATA_BULK_SIZE]
+            configreq = {'subresource': 'bulkinject', 'taskname': taskname, 'filemetadata': json.dumps(chunk)}
+            msg = "Uploading %s metadata for %d files to https://%s: %s" % (what, len(chunk), self.rest_url+rest_api, chunk)
+            self.logger.debug(msg)
+            try:
+                self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
+                continue
+            except HTTPException as hte:
+                msg = "Error uploading %s files metadata in bulk: %s" % (what, str(hte.headers))
+                self.logger.error(msg)
+                if not hte.headers.get('X-Error-Http', -1) == '400':
+                    raise
+            self.logger.info("Uploading the %s files metadata one by one", what)
+            for file_metadata in chunk:
+                configreq = [('taskname', taskname)]
+                for key, value in file_metadata.items():
+                    if isinstance(value, list):
+                        configreq.extend((key, item) for item in value)
+                    else:
+                        configreq.append((key, value))
+                msg = "Uploading %s metadata for %s to https://%s: %s" % (what, file_metadata['outlfn'], self.rest_url+rest_api, configreq)
+                self.logger.debug(msg)
+                try:
+                    self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
+                except HTTPException as hte:
+                    ## BrianB. Suppressing this exception is a tough decision.
+                    ## If the file made it back alright, I suppose we can proceed.
+                    msg = "Error uploading %s file metadata: %s" % (what, str(hte.headers))
+                    self.logger.error(msg)
+                    raise
+
+    ## = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
     def upload_input_files_metadata(self):
         """
         Upload the (primary) input files metadata. We care about the number of events
@@ -2399,6 +2494,7 @@ class PostJob():
             self.logger.info("Skipping input filemetadata upload as no inputs were found")
             return
         direct_stageout = int(self.job_report.get(u'direct_stageout', 0))
+        files_metadata = []
         for ifile in self.job_report['steps']['cmsRun']['input']['source']:
             if ifile['input_source_class'] != 'PoolSource' or ifile.get('input_type', '') != "primaryFiles":
                 continue
@@ -2408,8 +2504,7 @@ class PostJob():
             else:
                 lfn = ifile['lfn']
             lfn = lfn + "_" + str(self.job_id) ## jobs can analyze the same input
-            configreq = {"taskname"        : self.job_ad['CRAB_ReqName'],
-                         "globalTag"       : "None",
+            configreq = {"globalTag"       : "None",
                          "jobid"           : self.job_id,
                          "outsize"         : "0",
                          "publishdataname" : self.publish_name,
@@ -2427,26 +2522,13 @@ class PostJob():
                          "outdatasetname"  : "/FakeDataset/fakefile-FakePublish-5b6a581e4ddd41b130711a045d5fecb9/USER",
                          "directstageout"  : direct_stageout
                         }
-            configreq = configreq.items()
-            outfileruns = []
-            outfilelumis = []
+            configreq['outfileruns'] = []
+            configreq['outfilelumis'] = []
             for run, lumis in ifile[u'runs'].iteritems():
-                outfileruns.append(str(run))
-                outfilelumis.append(','.join(map(str, lumis)))
-            for run in outfileruns:
-                configreq.append(("outfileruns", run))
-            for lumis in outfilelumis:
-                configreq.append(("outfilelumis", lumis))
-
-            rest_api = 'filemetadata'
-            msg = "Uploading input metadata for %s to https://%s: %s" % (lfn, self.rest_url+rest_api, configreq)
-            self.logger.debug(msg)
-            try:
-                self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
-            except HTTPException as hte:
-                msg = "Error uploading input file metadata: %s" % (str(hte.headers))
-                self.logger.error(msg)
-                raise
+                configreq['outfileruns'].append(str(run))
+                configreq['outfilelumis'].append(','.join(map(str, lumis)))
+            files_metadata.append(configreq)
+        self.upload_files_metadata(self.job_ad['CRAB_ReqName'], files_metadata, 'input')
 
     ## = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -2462,6 +2544,7 @@ class PostJob():
                 edm_file_count += 1
         multiple_edm = edm_file_count > 1
         output_datasets = set()
+        files_metadata = []
         for file_info in self.output_files_info:
             publishname = self.publish_name
             if 'pset_hash' in file_info:
@@ -2482,8 +2565,7 @@ class PostJob():
 
             else:
                 outdataset = '/FakeDataset/fakefile-FakePublish-5b6a581e4ddd41b130711a045d5fecb9/USER'
-            configreq = {'taskname'        : self.reqname,
-                         'jobid'      : self.job_id,
+            configreq = {'jobid'      : self.job_id,
                          'outsize'         : file_info['outsize'],
                          'publishdataname' : publishname,
                          'appver'          : self.job_sw,
@@ -2501,31 +2583,13 @@ class PostJob():
                          'directstageout'  : int(file_info['direct_stageout']),
                          'globalTag'       : 'None'
                         }
-            configreq = configreq.items()
-            if 'outfileruns' in file_info:
-                for run in file_info['outfileruns']:
-                    configreq.append(("outfileruns", run))
-            if 'outfilelumis' in file_info:
-                for lumis in file_info['outfilelumis']:
-                    configreq.append(("outfilelumis", lumis))
-            if 'inparentlfns' in file_info:
-                for lfn in file_info['inparentlfns']:
-                    # If the user specified a PFN as input, then the LFN is an empty string
-                    # and does not pass validation.
-                    if lfn:
-                        configreq.append(("inparentlfns", lfn))
-            filename = file_info['pfn'].split('/')[-1]
-            rest_api = 'filemetadata'
-            msg = "Uploading output metadata for %s to https://%s: %s" % (filename, self.rest_url+rest_api, configreq)
-            self.logger.debug(msg)
-            try:
-                self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
-            except HTTPException as hte:
-                ## BrianB. Suppressing this exception is a tough decision.
-                ## If the file made it back alright, I suppose we can proceed.
-                msg = "Error uploading output file metadata: %s" % (str(hte.headers))
-                self.logger.error(msg)
-                raise
+            configreq['outfileruns'] = list(file_info.get('outfileruns', []))
+            configreq['outfilelumis'] = list(file_info.get('outfilelumis', []))
+            # If the user specified a PFN as input, then the LFN is an empty string
+            # and does not pass validation.
+            configreq['inparentlfns'] = [lfn for lfn in file_info.get('inparentlfns', []) if lfn]
+            files_metadata.append(configreq)
+        self.upload_files_metadata(self.reqname, files_metadata, 'output')
 
         if not os.path.exists('output_datasets') and output_datasets:
             configreq = [('subresource', 'addoutputdatasets'),
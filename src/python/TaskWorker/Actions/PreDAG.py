@@ -26,10 +26,8 @@ import json
 import copy
 import errno
 import pickle
-import shutil
 import logging
-import tarfile
-import tempfile
+import zipfile
 import functools
 import subprocess
 
@@ -38,7 +36,7 @@ import classad
 from ast import literal_eval
 from WMCore.DataStructs.LumiList import LumiList
 
-from ServerUtilities import getLock, newX509env, MAX_IDLE_JOBS, MAX_POST_JOBS
+from ServerUtilities import getLock, newX509env, MAX_IDLE_JOBS, MAX_POST_JOBS, RUN_AND_LUMIS_ARCHIVE
 from RucioUtils import getNativeRucioClient
 from TaskWorker.Actions.Splitter import Splitter
 from TaskWorker.Actions.DagmanCreator import DagmanCreator
@@ -306,21 +304,12 @@ class PreDAG(object):
             with open(os.path.join(missingDir, missingFile)) as fd:
                 self.logger.info("Adding missing lumis from job %s", missingFile)
                 missing = missing + LumiList(compactList=literal_eval(fd.read()))
-        for failedId in failed:
-            f = None
-            try:
-                tmpdir = tempfile.mkdtemp()
-                f = tarfile.open("run_and_lumis.tar.gz")
-                fn = "job_lumis_{0}.json".format(failedId)
-                f.extract(fn, path=tmpdir)
-                with open(os.path.join(tmpdir, fn)) as fd:
-                    injson = json.load(fd)
+        if failed:
+            with zipfile.ZipFile(RUN_AND_LUMIS_ARCHIVE) as zfd:
+                for failedId in failed:
+                    injson = json.loads(zfd.read("job_lumis_{0}.json".format(failedId)))
                     missing = missing + LumiList(compactList=injson)
                     self.logger.info("Adding lumis from failed job %s", failedId)
-            finally:
-                if f:
-                    f.close()
-                shutil.rmtree(tmpdir)
         missing_compact = missing.getCompactList()
         runs = missing.getRuns()
         # Compact list is like
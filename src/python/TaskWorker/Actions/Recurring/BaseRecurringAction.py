@@ -4,7 +4,7 @@ import os
 
 from TaskWorker.DataObjects.Result import Result
 
-def handleRecurring(resthost, dbInstance, config, task, procnum, action):
+def handleRecurring(resthost, dbInstance, config, task, procnum, action, **kwargs): #pylint: disable=unused-argument
     actionClass = action.split('.')[-1]
     mod = __import__(action, fromlist=actionClass)
     getattr(mod, actionClass)(config.TaskWorker.logsDir).execute(resthost, dbInstance, config, task, procnum)
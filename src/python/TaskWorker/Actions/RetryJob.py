@@ -2,10 +2,15 @@ import os
 import re
 import sys
 import json
+import time
 import shutil
 import subprocess
+import htcondor
 import classad
 from collections import namedtuple
+
+from ServerUtilities import MAX_DISK_SPACE, MAX_WALLTIME, MAX_MEMORY, JOB_AD_CACHE_DIR, updateJobAd
+
 JOB_RETURN_CODES = namedtuple('JobReturnCodes', 'OK RECOVERABLE_ERROR FATAL_ERROR')(0, 1, 2)
 
 # Without this environment variable set, HTCondor takes a write lock per logfile entry
@@ -44,7 +49,6 @@ class RetryJob(object):
         self.validreport         = True
         self.integrated_job_time = 0
 
-        from ServerUtilities import MAX_DISK_SPACE, MAX_WALLTIME, MAX_MEMORY
         self.MAX_DISK_SPACE = MAX_DISK_SPACE
         self.MAX_WALLTIME   = MAX_WALLTIME
         self.MAX_MEMORY     = MAX_MEMORY
@@ -84,6 +88,73 @@ class RetryJob(object):
 
     ##= = = = = RetryJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
+    def get_job_ad_from_cache(self):
+        """
+        Load the job ad from the per-job ad cache which task_process/cache_status_jel.py
+        fills while parsing job_log (and get_job_ad_from_job_log for the jobs it did not
+        parse yet), to avoid copying and scanning the whole job_log with condor_q.
+        Return False if the job is not in the cache (yet).
+        """
+        job_ad_file = os.path.join(JOB_AD_CACHE_DIR, str(self.dag_jobid))
+        if not os.path.isfile(job_ad_file):
+            return False
+        try:
+            with open(job_ad_file) as fd:
+                ad = classad.parseOld(fd)
+        except Exception:
+            msg = "Unable to parse classads from file %s." % (job_ad_file)
+            self.logger.warning(msg)
+            return False
+        if not ad:
+            return False
+        self.ads.append(ad)
+        self.ad = ad
+        return True
+
+    ##= = = = = RetryJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+    def get_job_ad_from_job_log(self):
+        """
+        The task process fills the job ad cache every few minutes, so the job which just ended
+        is usually not there yet. Rebuild its ad from its events in job_log as the task process
+        does, reading job_log in place instead of copying it for condor_q -userlog, and store it
+        in the cache for the next runs of the post-job.
+        Return False if job_log does not tell that the job completed or was removed.
+        """
+        if self.dag_clusterid == -1:
+            return False
+        job = self.dag_clusterid, int(self.dag_jobid.split(".")[1])
+        job_ads = {}
+        try:
+            for event in htcondor.JobEventLog("job_log").events(0):
+                if (event['Cluster'], event['Proc']) != job:
+                    continue
+                event_time = time.mktime(time.strptime(event['EventTime'], "%Y-%m-%dT%H:%M:%S"))
+                updateJobAd(event, event_time, job_ads)
+                if job_ads.get(job, {}).get('JobStatus') in (3, 4):
+                    break
+        except Exception as ex:
+            msg = "Unable to read the events of job %s from job_log: %s" % (self.dag_jobid, ex)
+            self.logger.warning(msg)
+            return False
+        if job_ads.get(job, {}).get('JobStatus') not in (3, 4):
+            return False
+        self.ad = classad.ClassAd(job_ads[job])
+        self.ads.append(self.ad)
+        job_ad_file = os.path.join(JOB_AD_CACHE_DIR, str(self.dag_jobid))
+        try:
+            if not os.path.isdir(JOB_AD_CACHE_DIR):
+                os.makedirs(JOB_AD_CACHE_DIR)
+            with open(job_ad_file + ".tmp", 'w') as fd:
+                fd.write(self.ad.printOld())
+            os.rename(job_ad_file + ".tmp", job_ad_file)
+        except (IOError, OSError) as ex:
+            msg = "Unable to store the job ad in %s: %s" % (job_ad_file, ex)
+            self.logger.warning(msg)
+        return True
+
+    ##= = = = = RetryJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
     def get_job_ad_from_file(self):
         """
         Need a doc string here
@@ -422,6 +493,12 @@ class RetryJob(object):
             msg = "Job ads already present. Will not use condor_q, but will load previous jobs ads."
             self.logger.debug(msg)
             self.get_job_ad_from_file()
+        elif self.get_job_ad_from_cache():
+            msg = "Loaded the finished job ad from the job ad cache of the task process."
+            self.logger.debug(msg)
+        elif self.get_job_ad_from_job_log():
+            msg = "Rebuilt the finished job ad from its events in job_log."
+            self.logger.debug(msg)
         else:
             msg = "Will use condor_q command to get finished job ads from job_log."
             self.logger.debug(msg)
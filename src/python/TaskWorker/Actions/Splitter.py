@@ -1,4 +1,11 @@
+import os
+import time
+import signal
+import traceback
+import multiprocessing
+
 from WMCore.DataStructs.Workflow import Workflow
+from WMCore.DataStructs.JobGroup import JobGroup
 from WMCore.DataStructs.Subscription import Subscription
 from WMCore.JobSplitting.SplitterFactory import SplitterFactory
 
@@ -7,10 +14,103 @@ from TaskWorker.Actions.TaskAction import TaskAction
 from TaskWorker.WorkerExceptions import TaskWorkerException
 
 
+def splitterProcess(conn, wmsubs, splitparam, maxJobs):
+    """ Body of the process running the splitting: send back to the slave the jobs of each
+        job group as soon as they are ready, stopping once more than maxJobs have been created.
+        The job groups are not sent as they are, since they refer to the whole subscription.
+    """
+    try:
+        jobfactory = SplitterFactory()(subscription=wmsubs)
+        numJobs = 0
+        for jobgroup in jobfactory(**splitparam):
+            jobs = jobgroup.getJobs()
+            numJobs += len(jobs)
+            if numJobs > maxJobs:
+                conn.send(('toomany', numJobs))
+                return
+            conn.send(('jobs', jobs))
+        lumiChecker = getattr(jobfactory, 'lumiChecker', None)
+        splitLumiFiles = list(lumiChecker.splitLumiFiles.keys()) if lumiChecker and lumiChecker.splitLumiFiles else []
+        conn.send(('done', splitLumiFiles))
+    except RuntimeError:
+        conn.send(('toomany', None))
+    except Exception:  # pylint: disable=broad-except
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def getRSS(pid):
+    """ Resident set size of a process in MB, 0 if it cannot be read """
+    try:
+        with open('/proc/%d/status' % pid) as fd:
+            for line in fd:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) // 1024
+    except (IOError, ValueError):
+        pass
+    return 0
+
+
 class Splitter(TaskAction):
     """Performing the split operation depending on the
        recevied input and arguments"""
 
+    def splitInSubprocess(self, wmsubs, splitparam, maxJobs):
+        """ Run the splitting in a child process whose resident memory is capped at
+            TaskWorker.splitterMaxRSS MB, so that a huge task cannot take down this slave
+            and the other tasks it handles. Job groups are collected while they are created
+            and the child is stopped as soon as the task goes beyond maxJobs.
+            Returns the list of job groups and the list of files with lumis split across files.
+        """
+        maxRSS = getattr(self.config.TaskWorker, 'splitterMaxRSS', 4000)
+        start = time.time()
+        parentConn, childConn = multiprocessing.Pipe(duplex=False)
+        proc = multiprocessing.Process(target=splitterProcess, args=(childConn, wmsubs, splitparam, maxJobs))
+        proc.start()
+        childConn.close()
+        jobgroups = []
+        numJobs = 0
+        peakRSS = 0
+        try:
+            while True:
+                if parentConn.poll(0.5):
+                    try:
+                        kind, payload = parentConn.recv()
+                    except EOFError:
+                        proc.join()
+                        raise TaskWorkerException("The splitting process of your task died unexpectedly (exit code %s)." % proc.exitcode)
+                    if kind == 'jobs':
+                        jobgroup = JobGroup(subscription=wmsubs, jobs=payload)
+                        jobgroup.commit()
+                        jobgroups.append(jobgroup)
+                        numJobs += len(payload)
+                    elif kind == 'done':
+                        splitLumiFiles = payload
+                        break
+                    elif kind == 'toomany':
+                        msg = "The splitting on your task generated more than {0} jobs (the maximum).".format(maxJobs)
+                        raise TaskWorkerException(msg)
+                    else:
+                        self.logger.error("Splitting process failed with:\n%s", payload)
+                        raise TaskWorkerException("The CRAB3 server backend failed to split your task.")
+                rss = getRSS(proc.pid)
+                peakRSS = max(peakRSS, rss)
+                if rss > maxRSS:
+                    msg = "The splitting of your task needs more than %d MB of memory, the maximum allowed." % maxRSS
+                    msg += " Please, split the input dataset in smaller tasks or use larger jobs."
+                    raise TaskWorkerException(msg)
+                if not proc.is_alive() and not parentConn.poll():
+                    raise TaskWorkerException("The splitting process of your task died unexpectedly (exit code %s)." % proc.exitcode)
+        finally:
+            parentConn.close()
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGKILL)
+            proc.join()
+        self.logger.info("Splitting process created %d jobs in %d job groups in %.1f sec, peak RSS %d MB",
+                         numJobs, len(jobgroups), time.time() - start, peakRSS)
+        return jobgroups, splitLumiFiles
+
     def execute(self, *args, **kwargs):
         wmwork = Workflow(name=kwargs['task']['tm_taskname'])
 
@@ -51,14 +151,20 @@ class Splitter(TaskAction):
         wmsubs = Subscription(fileset=data, workflow=wmwork,
                                split_algo=splitparam['algorithm'],
                                type=self.jobtypeMapper[kwargs['task']['tm_job_type']])
-        try:
-            splitter = SplitterFactory()
-            jobfactory = splitter(subscription=wmsubs)
-            factory = jobfactory(**splitparam)
+        if getattr(self.config.TaskWorker, 'splitInSubprocess', False):
+            factory, splitLumiFiles = self.splitInSubprocess(wmsubs, splitparam, maxJobs)
             numJobs = sum([len(jobgroup.getJobs()) for jobgroup in factory])
-        except RuntimeError:
-            msg = "The splitting on your task generated more than {0} jobs (the maximum).".format(maxJobs)
-            raise TaskWorkerException(msg)
+        else:
+            try:
+                splitter = SplitterFactory()
+                jobfactory = splitter(subscription=wmsubs)
+                factory = jobfactory(**splitparam)
+                numJobs = sum([len(jobgroup.getJobs()) for jobgroup in factory])
+            except RuntimeError:
+                msg = "The splitting on your task generated more than {0} jobs (the maximum).".format(maxJobs)
+                raise TaskWorkerException(msg)
+            lumiChecker = getattr(jobfactory, 'lumiChecker', None)
+            splitLumiFiles = lumiChecker.splitLumiFiles.keys() if lumiChecker and lumiChecker.splitLumiFiles else []
         if numJobs == 0:
             msg  = "The CRAB3 server backend could not submit any job to the Grid scheduler:"
             msg += " splitting task %s" % (kwargs['task']['tm_taskname'])
@@ -78,9 +184,8 @@ class Splitter(TaskAction):
             raise TaskWorkerException(msg)
 
         #printing duplicated lumis if any
-        lumiChecker = getattr(jobfactory, 'lumiChecker', None)
-        if lumiChecker and lumiChecker.splitLumiFiles:
-            self.logger.warning("The input dataset contains the following duplicated lumis %s", lumiChecker.splitLumiFiles.keys())
+        if splitLumiFiles:
+            self.logger.warning("The input dataset contains the following duplicated lumis %s", splitLumiFiles)
             msg = "The CRAB3 server backend detected lumis split across files in the input dataset."
             msg += " Will apply the necessary corrections in the splitting algorithm. You can ignore this message."
             self.uploadWarning(msg, kwargs['task']['user_proxy'], kwargs['task']['tm_taskname'])
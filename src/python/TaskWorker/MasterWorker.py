@@ -19,7 +19,7 @@ from WMCore.Configuration import loadConfigurationFile
 #CRAB dependencies
 from RESTInteractions import CRABRest
 import HTCondorLocator
-from ServerUtilities import newX509env
+from ServerUtilities import newX509env, encodeRequest
 from ServerUtilities import SERVICE_INSTANCES
 from TaskWorker import __version__
 from TaskWorker.TestWorker import TestWorker
@@ -224,6 +224,14 @@ class MasterWorker(object):
             self.config.TaskWorker.retry_interval = [retry*20*2 for retry in range(self.config.TaskWorker.max_retry)]
         if not len(self.config.TaskWorker.retry_interval) == self.config.TaskWorker.max_retry:
             raise ConfigException("No correct max_retry and retry_interval specified; len of retry_interval must be equal to max_retry.")
+        # Scheduling mode: with eventDrivenPolling the master wakes up as soon as a slave
+        # returns a result, and otherwise waits an adaptive time between minPolling and polling
+        if not hasattr(self.config.TaskWorker, 'eventDrivenPolling'):
+            self.config.TaskWorker.eventDrivenPolling = False
+        if not hasattr(self.config.TaskWorker, 'minPolling'):
+            self.config.TaskWorker.minPolling = 1
+        if self.config.TaskWorker.minPolling > self.config.TaskWorker.polling:
+            raise ConfigException("No correct minPolling specified; minPolling must not be larger than polling.")
         # use the config to pass some useful global stuff to all workers
         # will use TaskWorker.cmscert/key to talk with CMSWEB
         self.config.TaskWorker.envForCMSWEB = newX509env(X509_USER_CERT=self.config.TaskWorker.cmscert,
@@ -310,6 +318,37 @@ class MasterWorker(object):
         return False #failure
 
 
+    def updateWorks(self, works):
+        """ Bulk version of updateWork: update status and command of many tasks with a single
+            call to the bulkstate subresource of the REST.
+
+        :arg list works: list of (taskname, command, status) tuples
+        :return set: the tasknames whose update succeded. Empty if the whole call failed
+        """
+        if not works:
+            return set()
+        configreq = {'subresource': 'bulkstate',
+                     'workflows': [taskname for taskname, _, _ in works],
+                     'commands': [command for _, command, _ in works],
+                     'statuses': [status for _, _, status in works]}
+        try:
+            result = self.crabserver.post(api='workflowdb',
+                                          data=encodeRequest(configreq, listParams=['workflows', 'commands', 'statuses']))[0]['result']
+        except HTTPException as hte:
+            msg = "HTTP Error during updateWorks: %s\n" % str(hte)
+            msg += "HTTP Headers are %s: " % hte.headers
+            self.logger.error(msg)
+            return set()
+        except Exception: #pylint: disable=broad-except
+            self.logger.exception("Server could not process the updateWorks request for %d tasks", len(works))
+            return set()
+        updated = set(res['workflow'] for res in result if res['updated'])
+        for taskname, _, status in works:
+            if taskname not in updated:
+                self.logger.error("Task %s could not be updated to %s by the bulk update", taskname, status)
+        return updated
+
+
     def restartQueuedTasks(self):
         """ This method is used at the TW startup and it restarts QUEUED tasks
             setting them  back again to NEW.
@@ -320,7 +359,11 @@ class MasterWorker(object):
             pendingwork = self.getWork(limit=limit, getstatus='QUEUED')
             for task in pendingwork:
                 self.logger.debug("Restarting QUEUED task %s", task['tm_taskname'])
-                self.updateWork(task['tm_taskname'], task['tm_task_command'], 'NEW')
+            updated = self.updateWorks([(task['tm_taskname'], task['tm_task_command'], 'NEW') for task in pendingwork])
+            if pendingwork and not updated:
+                # nothing could be restarted, avoid fetching the same chunk of tasks over and over
+                self.logger.error("Could not restart any of the %d QUEUED tasks, giving up", len(pendingwork))
+                break
             if not pendingwork:
                 self.logger.info("Finished restarting QUEUED tasks (total %s)", total)
                 break #too bad "do..while" does not exist in python...
@@ -351,6 +394,20 @@ class MasterWorker(object):
             return True
         return False
 
+    def nextWaitTime(self, waitTime, acquired):
+        """ Adaptive timer used when eventDrivenPolling is enabled. If some work was acquired
+            in this cycle we are probably in a burst of submissions, so come back after
+            minPolling seconds. Otherwise back off doubling the previous wait time up
+            to the polling value from the configuration.
+
+        :arg float waitTime: the time waited in the previous cycle
+        :arg int acquired: number of tasks acquired in this cycle
+        :return float: the number of seconds to wait for in this cycle
+        """
+        if acquired:
+            return self.config.TaskWorker.minPolling
+        return min(waitTime * 2, self.config.TaskWorker.polling)
+
     def algorithm(self):
         """I'm the intelligent guy taking care of getting the work
            and distributing it to the slave processes."""
@@ -358,6 +415,7 @@ class MasterWorker(object):
         self.logger.debug("Restarting QUEUED tasks before startup.")
         self.restartQueuedTasks()
         self.logger.debug("Master Worker Starting Main Cycle.")
+        waitTime = self.config.TaskWorker.minPolling
         while not self.STOP:
             limit = self.slaves.queueableTasks()
             if not self._lockWork(limit=limit, getstatus='NEW', setstatus='HOLDING'):
@@ -372,11 +430,11 @@ class MasterWorker(object):
                 self.logger.info("Retrieved a total of %d works", len(pendingwork))
                 self.logger.debug("Retrieved the following works: \n%s", str(tasksInfo))
 
+            goodTasks = [task for task in pendingwork if not self.failBannedTask(task)]
+            queued = self.updateWorks([(task['tm_taskname'], task['tm_task_command'], 'QUEUED') for task in goodTasks])
             toInject = []
-            for task in pendingwork:
-                if self.failBannedTask(task):
-                    continue
-                if self.updateWork(task['tm_taskname'], task['tm_task_command'], 'QUEUED'):
+            for task in goodTasks:
+                if task['tm_taskname'] in queued:
                     worktype, failstatus = STATE_ACTIONS_MAP[task['tm_task_command']]
                     toInject.append((worktype, task, failstatus, None))
                 else:
@@ -396,9 +454,13 @@ class MasterWorker(object):
             self.logger.info(' - acquired tasks: %d', self.slaves.queuedTasks())
             self.logger.info(' - tasks pending in queue: %d', self.slaves.pendingTasks())
 
-            time.sleep(self.config.TaskWorker.polling)
-
-            dummyFinished = self.slaves.checkFinished()
+            if self.config.TaskWorker.eventDrivenPolling:
+                waitTime = self.nextWaitTime(waitTime, len(pendingwork))
+                self.logger.debug("Waiting up to %s seconds for a slave to finish its work", waitTime)
+                dummyFinished = self.slaves.waitFinished(waitTime)
+            else:
+                time.sleep(self.config.TaskWorker.polling)
+                dummyFinished = self.slaves.checkFinished()
 
         self.logger.debug("Master Worker Exiting Main Cycle.")
 
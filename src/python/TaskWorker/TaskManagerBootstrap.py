@@ -8,16 +8,20 @@ import types
 import pickle
 import pprint
 
-import classad
+from TaskWorker.TaskManagerServer import FORWARDED_COMMANDS, SERVER_FLAG, forwardToServer
 
-import TaskWorker.Actions.PostJob as PostJob
-import TaskWorker.Actions.PreJob as PreJob
-import TaskWorker.Actions.PreDAG as PreDAG
-import HTCondorUtils
+def bootstrap():
+    # imported here, so that the requests forwarded to the task manager server
+    # do not pay for them (they are already imported in the server)
+    import classad
 
-import WMCore.Configuration as Configuration
+    import TaskWorker.Actions.PostJob as PostJob
+    import TaskWorker.Actions.PreJob as PreJob
+    import TaskWorker.Actions.PreDAG as PreDAG
+    import HTCondorUtils
+
+    import WMCore.Configuration as Configuration
 
-def bootstrap():
     print("Entering TaskManagerBootstrap with args: %s" % sys.argv)
     command = sys.argv[1]
     if command == "POSTJOB":
@@ -81,6 +85,11 @@ def bootstrap():
     return 0
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in FORWARDED_COMMANDS and os.path.exists(SERVER_FLAG):
+        retval = forwardToServer(sys.argv)
+        if retval is not None:
+            print("Ended TaskManagerBootstrap in the task manager server with code %s" % retval)
+            sys.exit(retval)
     try:
         retval = bootstrap()
         print("Ended TaskManagerBootstrap with code %s" % retval)
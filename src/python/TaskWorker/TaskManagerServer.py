@@ -0,0 +1,503 @@
+"""
+Optional per-task server which runs the PostJob and PreJob of the task DAG nodes
+in processes forked from a warm interpreter, so that WMCore, htcondor, classad,
+CMSCouch and the REST clients are not imported again for every job retry.
+
+The mode is enabled by dag_bootstrap_startup.sh creating the USE_BOOTSTRAP_SERVER
+flag in the spool dir. TaskManagerBootstrap then forwards POSTJOB and PREJOB to
+the server listening on a UNIX socket in the spool dir (see forwardToServer).
+When the server is not there the request runs in-process as before and a new
+server is started in the background for the next ones. The server exits after
+IDLE_TIMEOUT seconds without requests.
+
+Each request runs in its own child, with the cwd, environment and arguments of
+the DAG script, through TaskManagerBootstrap.bootstrap(): the output which is not
+redirected to the post/pre-job log files and the exit code are relayed back to
+the DAG script, so DAGMan sees the same semantics and exit codes (e.g. DEFER).
+The signals DAGMan sends to the DAG script are forwarded to the child, and the
+child is killed if the DAG script goes away.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import select
+import signal
+import socket
+import struct
+import logging
+import traceback
+import subprocess
+
+SERVER_FLAG = 'USE_BOOTSTRAP_SERVER'
+# relative paths: the clients and the server work in the spool dir, and this avoids
+# the 108 characters limit of the UNIX socket names
+SOCKET_NAME = 'task_manager_server.sock'
+LOCK_NAME = 'task_manager_server.lock'
+LOG_NAME = 'task_manager_server.log'
+FORWARDED_COMMANDS = ('POSTJOB', 'PREJOB')
+IDLE_TIMEOUT = 1800
+REQUEST_TIMEOUT = 30
+# seconds between the SIGTERM and the SIGKILL to a child whose client went away
+KILL_GRACE_TIME = 10
+FORWARDED_SIGNALS = (signal.SIGHUP, signal.SIGINT, signal.SIGTERM)
+# exit code of the DAG script if the server goes away while running the request:
+# the PostJob is deferred by DAGMan and runs again, like after any other DEFER
+POSTJOB_DEFER_EXIT_CODE = 4
+
+# the server sends frames made of a type, the payload length and the payload.
+# The payload of FRAME_STARTED is the pid of the child running the request
+FRAME_HEADER = struct.Struct('!cI')
+FRAME_STARTED = b'S'
+FRAME_OUTPUT = b'O'
+FRAME_EXIT = b'X'
+
+
+def sendFrame(sock, kind, payload=b''):
+    """ Send one frame of the server protocol """
+    sock.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def recvExactly(sock, size):
+    """ Read size bytes from the socket, return None if the connection is closed before """
+    chunks = []
+    while size:
+        try:
+            chunk = sock.recv(size)
+        except socket.error as ex:
+            # interrupted by a signal forwarded to the child
+            if ex.args[0] == errno.EINTR:
+                continue
+            raise
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recvFrame(sock):
+    """ Read one frame of the server protocol, return (type, payload) or None at EOF """
+    header = recvExactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    kind, size = FRAME_HEADER.unpack(header)
+    payload = recvExactly(sock, size) if size else b''
+    if payload is None:
+        return None
+    return kind, payload
+
+
+def startServer():
+    """
+    Start the server in the background for the next requests of the task, detached from
+    the DAG script. If another one is already starting it will exit as soon as it finds
+    the lock taken
+    """
+    with open(os.devnull) as devnull, open(LOG_NAME, 'a') as log:
+        subprocess.Popen([sys.executable, '-m', 'TaskWorker.TaskManagerServer'], stdin=devnull, stdout=log,
+                         stderr=subprocess.STDOUT, close_fds=True, preexec_fn=os.setsid)
+
+
+def forwardSignals(pid):
+    """
+    Forward the signals sent by DAGMan to the DAG script to the child running the request,
+    return the previous handlers
+    """
+    def forward(signum, _frame):
+        """ Signal handler """
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+    previous = {}
+    for signum in FORWARDED_SIGNALS:
+        previous[signum] = signal.signal(signum, forward)
+    return previous
+
+
+def forwardToServer(argv):
+    """
+    Run the DAG script request in argv in the task server.
+    Return the exit code of the request, or None if the server could not take it and
+    the caller has to run it in-process
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_NAME)
+    except socket.error as ex:
+        sock.close()
+        print("Task manager server not available (%s), running in-process and starting it" % ex)
+        try:
+            startServer()
+        except (OSError, IOError) as ex:
+            print("Failed to start the task manager server: %s" % ex)
+        return None
+    started = False
+    previousHandlers = {}
+    try:
+        request = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        while True:
+            frame = recvFrame(sock)
+            if frame is None:
+                break
+            kind, payload = frame
+            if kind == FRAME_STARTED:
+                started = True
+                previousHandlers = forwardSignals(int(payload))
+            elif kind == FRAME_OUTPUT:
+                sys.stdout.write(payload.decode('utf-8', 'replace'))
+                sys.stdout.flush()
+            elif kind == FRAME_EXIT:
+                return int(payload)
+    except socket.error as ex:
+        print("Error talking to the task manager server: %s" % ex)
+    finally:
+        sock.close()
+        for signum, handler in previousHandlers.items():
+            signal.signal(signum, handler)
+    if not started:
+        print("The task manager server did not take the request, running in-process")
+        return None
+    # the request may have run (partially): do not run it again here
+    print("Lost the connection to the task manager server while running the request")
+    return POSTJOB_DEFER_EXIT_CODE if argv[1] == 'POSTJOB' else 1
+
+
+def toNative(value):
+    """ json gives unicode strings in python 2, PostJob and PreJob expect the native str """
+    return value if isinstance(value, str) else value.encode('utf-8')
+
+
+def exitCode(retval):
+    """ The exit code of the interpreter for sys.exit(retval) """
+    if retval is None:
+        return 0
+    if isinstance(retval, int):
+        return retval
+    print(retval, file=sys.stderr)
+    return 1
+
+
+class Request(object):
+    """
+    A DAG script request: first read from the connection without blocking the server,
+    then running in a child of the server
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.connected = time.time()
+        self.data = b''
+        self.pid = None
+        self.pipe = None
+        self.exitCode = None
+        self.clientGone = False
+        self.killTime = None
+
+
+class TaskManagerServer(object):
+    """ Accept the requests of the DAG scripts of the task and run each of them in a forked child """
+
+    def __init__(self, logger, idleTimeout=IDLE_TIMEOUT):
+        self.logger = logger
+        self.idleTimeout = idleTimeout
+        self.listener = None
+        self.pending = []
+        self.requests = []
+        self.importEnv = {}
+        self.warmHandlers = {}
+        self.lastRequest = time.time()
+        self.stopping = False
+
+    def warmUp(self):
+        """
+        Import once what every PostJob and PreJob needs. Some modules set environment variables
+        and signal handlers at import time, remember them to restore them in the children
+        """
+        startEnv = dict(os.environ)
+        import TaskWorker.TaskManagerBootstrap  # pylint: disable=unused-variable
+        import TaskWorker.Actions.PostJob  # pylint: disable=unused-variable
+        import TaskWorker.Actions.PreJob  # pylint: disable=unused-variable
+        self.importEnv = dict((key, value) for key, value in os.environ.items() if startEnv.get(key) != value)
+        for signum in FORWARDED_SIGNALS:
+            self.warmHandlers[signum] = signal.getsignal(signum)
+            signal.signal(signum, self.stop)
+
+    def stop(self, signum, _frame):
+        """ Signal handler """
+        self.logger.info("Got signal %s, stopping", signum)
+        self.stopping = True
+
+    def accept(self):
+        """ Accept a new connection, its request is read by readRequest when the data arrives """
+        conn, _ = self.listener.accept()
+        self.lastRequest = time.time()
+        conn.setblocking(0)
+        self.pending.append(Request(conn))
+
+    def readRequest(self, request):
+        """ Read the available data of a pending request, start it once complete """
+        try:
+            data = request.conn.recv(65536)
+        except socket.error as ex:
+            if ex.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            data = None
+            self.logger.error("Error reading a request: %s", ex)
+        if not data:
+            self.logger.error("Client went away before sending its request")
+            self.dropPending(request)
+            return
+        request.data += data
+        if b'\n' in request.data:
+            self.pending.remove(request)
+            self.start(request)
+
+    def dropPending(self, request):
+        """ Close a connection whose request will not run, the client runs it in-process """
+        request.conn.close()
+        self.pending.remove(request)
+
+    def expirePending(self):
+        """ Drop the connections which did not send their request in REQUEST_TIMEOUT """
+        for request in self.pending[:]:
+            if time.time() - request.connected > REQUEST_TIMEOUT:
+                self.logger.error("Timeout reading a request")
+                self.dropPending(request)
+
+    def start(self, request):
+        """ Fork a child to run a complete request """
+        try:
+            params = json.loads(request.data.split(b'\n', 1)[0].decode('utf-8'))
+        except ValueError as ex:
+            self.logger.error("Invalid request: %s", ex)
+            request.conn.close()
+            return
+        if len(params['argv']) < 2 or params['argv'][1] not in FORWARDED_COMMANDS:
+            self.logger.error("Refusing request %s", params['argv'])
+            request.conn.close()
+            return
+        request.conn.setblocking(1)
+        readFd, writeFd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readFd)
+            self.runChild(params, writeFd)
+        os.close(writeFd)
+        self.logger.info("Running %s in child %d", ' '.join(params['argv'][1:]), pid)
+        request.pid = pid
+        request.pipe = readFd
+        self.requests.append(request)
+        try:
+            sendFrame(request.conn, FRAME_STARTED, str(pid).encode('ascii'))
+        except socket.error as ex:
+            self.orphaned(request, ex)
+
+    def orphaned(self, request, reason):
+        """
+        The DAG script of a running request went away, e.g. removed by DAGMan: stop the child
+        like the signals of DAGMan would stop the in-process request, and kill it if it does not exit
+        """
+        if request.clientGone:
+            return
+        request.clientGone = True
+        self.logger.warning("Client of child %d went away (%s), terminating it", request.pid, reason)
+        self.kill(request, signal.SIGTERM)
+        request.killTime = time.time()
+
+    def kill(self, request, signum):
+        """ Send a signal to the child of a request, if still running """
+        if request.exitCode is None:
+            try:
+                os.kill(request.pid, signum)
+            except OSError:
+                pass
+
+    def checkClient(self, request):
+        """
+        The clients send nothing after the request, so the connection of a running request
+        becomes readable only when the client closes it
+        """
+        try:
+            data = request.conn.recv(1)
+        except socket.error as ex:
+            if ex.args[0] == errno.EINTR:
+                return
+            data = None
+        if data:
+            self.logger.error("Unexpected data from the client of child %d", request.pid)
+        self.orphaned(request, 'connection closed')
+
+    def runChild(self, params, outFd):
+        """ Body of the forked child: run the request as the DAG script would, never returns """
+        code = 1
+        try:
+            self.listener.close()
+            for other in self.pending + self.requests:
+                other.conn.close()
+                if other.pipe is not None:
+                    os.close(other.pipe)
+            for signum, handler in self.warmHandlers.items():
+                signal.signal(signum, handler)
+            os.dup2(outFd, 1)
+            os.dup2(outFd, 2)
+            os.close(outFd)
+            os.chdir(params['cwd'])
+            os.environ.clear()
+            for key, value in params['env'].items():
+                os.environ[toNative(key)] = toNative(value)
+            os.environ.update(self.importEnv)
+            sys.argv = [toNative(arg) for arg in params['argv']]
+            from TaskWorker.TaskManagerBootstrap import bootstrap
+            retval = bootstrap()
+            print("Ended TaskManagerBootstrap with code %s" % retval)
+            code = exitCode(retval)
+        except SystemExit as ex:
+            code = exitCode(ex.code)
+        except BaseException:  # pylint: disable=broad-except
+            print("Got a fatal exception:")
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)  # pylint: disable=protected-access
+
+    def relay(self, request):
+        """ Send the output of a child to its client """
+        data = os.read(request.pipe, 65536)
+        if not data:
+            os.close(request.pipe)
+            request.pipe = None
+            return
+        if request.clientGone:
+            # keep draining the pipe, the child must not block until it exits
+            return
+        try:
+            sendFrame(request.conn, FRAME_OUTPUT, data)
+        except socket.error as ex:
+            self.orphaned(request, ex)
+
+    def reap(self):
+        """ Collect the children which are done and send their exit code """
+        for request in self.requests[:]:
+            if request.exitCode is None:
+                pid, status = os.waitpid(request.pid, os.WNOHANG)
+                if not pid:
+                    if request.killTime and time.time() - request.killTime > KILL_GRACE_TIME:
+                        self.logger.warning("Child %d still running, killing it", request.pid)
+                        self.kill(request, signal.SIGKILL)
+                        request.killTime = None
+                    continue
+                if os.WIFSIGNALED(status):
+                    request.exitCode = 128 + os.WTERMSIG(status)
+                else:
+                    request.exitCode = os.WEXITSTATUS(status)
+                self.logger.info("Child %d exited with %d", request.pid, request.exitCode)
+            if request.pipe is not None:
+                # the child is gone, but its output may not be completely relayed yet
+                continue
+            if not request.clientGone:
+                try:
+                    sendFrame(request.conn, FRAME_EXIT, str(request.exitCode).encode('ascii'))
+                except socket.error as ex:
+                    self.logger.warning("Cannot send the exit code of child %d: %s", request.pid, ex)
+            request.conn.close()
+            self.requests.remove(request)
+
+    def done(self):
+        """
+        Stop accepting requests after a signal, after idleTimeout without requests, or
+        if the task spool dir is gone
+        """
+        if self.stopping:
+            return True
+        if not os.path.exists(SERVER_FLAG):
+            self.logger.info("%s not found, the task is gone", SERVER_FLAG)
+            return True
+        if self.pending or self.requests or time.time() - self.lastRequest < self.idleTimeout:
+            return False
+        # last check for a client which connected in the meantime
+        return not select.select([self.listener], [], [], 0)[0]
+
+    def run(self):
+        """ Main loop """
+        lockFd = os.open(LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lockFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as ex:
+            if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            self.logger.info("Another task manager server is running, exiting")
+            return
+        self.warmUp()
+        if os.path.exists(SOCKET_NAME):
+            os.remove(SOCKET_NAME)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(SOCKET_NAME)
+        self.listener.listen(64)
+        self.logger.info("Task manager server listening on %s/%s", os.getcwd(), SOCKET_NAME)
+        try:
+            accepting = True
+            while accepting or self.requests:
+                if accepting and self.done():
+                    # new clients find no server and run in-process, the running requests are completed
+                    accepting = False
+                    self.listener.close()
+                    os.remove(SOCKET_NAME)
+                    for request in self.pending[:]:
+                        self.dropPending(request)
+                pipes = dict((request.pipe, request) for request in self.requests if request.pipe is not None)
+                pending = dict((request.conn, request) for request in self.pending)
+                clients = dict((request.conn, request) for request in self.requests
+                               if not request.clientGone and request.exitCode is None)
+                # poll quickly for the exit of the children which already closed their output
+                timeout = 0.05 if len(pipes) < len(self.requests) else 1
+                try:
+                    ready = select.select(([self.listener] if accepting else []) + list(pipes) +
+                                          list(pending) + list(clients), [], [], timeout)[0]
+                except select.error as ex:
+                    if ex.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd in ready:
+                    if fd is self.listener:
+                        self.accept()
+                    elif fd in pending:
+                        self.readRequest(pending[fd])
+                    elif fd in clients:
+                        self.checkClient(clients[fd])
+                    else:
+                        self.relay(pipes[fd])
+                self.expirePending()
+                self.reap()
+        finally:
+            if accepting:
+                self.listener.close()
+                os.remove(SOCKET_NAME)
+            for request in self.pending[:]:
+                self.dropPending(request)
+            os.close(lockFd)
+        self.logger.info("Task manager server exiting")
+
+
+def main():
+    """ Entry point of the server, started by forwardToServer in the task spool dir """
+    logger = logging.getLogger('TaskManagerServer')
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    TaskManagerServer(logger).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+import time
+
+
 class TestWorker(object):
     """ TestWorker class providing a sequential execution of the work in the same thread of the caller
         This is useful for debugging purposes because because there are problems executing pdb with
@@ -35,5 +38,9 @@ class TestWorker(object):
     def checkFinished(self):
         return []
 
+    def waitFinished(self, timeout):
+        time.sleep(timeout)
+        return []
+
     def end(self):
         pass
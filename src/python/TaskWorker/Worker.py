@@ -12,6 +12,8 @@ from httplib import HTTPException
 from logging.handlers import TimedRotatingFileHandler
 
 from RESTInteractions import CRABRest
+from RucioUtils import getNativeRucioClient
+from TaskWorker import __version__
 from TaskWorker.DataObjects.Result import Result
 from ServerUtilities import truncateError, executeCommand
 from TaskWorker.WorkerExceptions import WorkerHandlerException, TapeDatasetException
@@ -65,8 +67,63 @@ def removeTaskLogHandler(logger, taskhandler):
     logger.removeHandler(taskhandler)
 
 
+class SlaveClients(object):
+    """ Long lived clients owned by a slave process and shared by all the works it executes:
+        a keep-alive CRABRest session and a native Rucio client. They are created the first
+        time they are needed and recreated only when the service certificate or key on disk
+        change (i.e. the credentials have been renewed), or after reset() is called.
+    """
+
+    def __init__(self, resthost, dbInstance, config, logger):
+        self.resthost = resthost
+        self.dbInstance = dbInstance
+        self.config = config
+        self.logger = logger
+        self._crabserver = None
+        self._rucioClient = None
+        self._credStamp = self._credentialsStamp()
+
+    def _credentialsStamp(self):
+        """ Modification times of the service certificate and key """
+        try:
+            return tuple(os.path.getmtime(f) for f in (self.config.TaskWorker.cmscert, self.config.TaskWorker.cmskey))
+        except OSError:
+            return None
+
+    def _checkCredentials(self):
+        """ Drop the clients if the credentials changed since they were created """
+        stamp = self._credentialsStamp()
+        if stamp != self._credStamp:
+            self.logger.info("Service credentials changed on disk, recreating REST and Rucio clients")
+            self._credStamp = stamp
+            self.reset()
+
+    def reset(self):
+        """ Forget the current clients, new ones will be created at the next access """
+        self._crabserver = None
+        self._rucioClient = None
+
+    @property
+    def crabserver(self):
+        self._checkCredentials()
+        if self._crabserver is None:
+            self._crabserver = CRABRest(self.resthost, self.config.TaskWorker.cmscert, self.config.TaskWorker.cmskey,
+                                        retry=20, logger=self.logger, userAgent='CRABTaskWorker', version=__version__,
+                                        keepAlive=True)
+            self._crabserver.setDbInstance(self.dbInstance)
+        return self._crabserver
+
+    @property
+    def rucioClient(self):
+        self._checkCredentials()
+        if self._rucioClient is None:
+            self._rucioClient = getNativeRucioClient(config=self.config, logger=self.logger)
+        return self._rucioClient
+
+
 def processWorkerLoop(inputs, results, resthost, dbInstance, procnum, logger, logsDir):
     procName = "Process-%s" % procnum
+    clients = SlaveClients(resthost, dbInstance, WORKER_CONFIG, logger)
     while True:
         try:
             ## Get (and remove) an item from the input queue. If the queue is empty, wait
@@ -91,7 +148,7 @@ def processWorkerLoop(inputs, results, resthost, dbInstance, procnum, logger, lo
         logger.debug("%s: Starting %s on %s", procName, str(work), task['tm_taskname'])
         try:
             msg = None
-            outputs = work(resthost, dbInstance, WORKER_CONFIG, task, procnum, inputargs)
+            outputs = work(resthost, dbInstance, WORKER_CONFIG, task, procnum, inputargs, clients=clients)
         except TapeDatasetException as tde:
             outputs = Result(task=task, err=str(tde))
         except WorkerHandlerException as we:
@@ -103,12 +160,11 @@ def processWorkerLoop(inputs, results, resthost, dbInstance, procnum, logger, lo
             msg += "\n\tworkid=" + str(workid)
             msg += "\n\ttask=" + str(task['tm_taskname'])
             msg += "\n" + str(traceback.format_exc())
+            # do not keep using clients which may be in a bad state after an unexpected error
+            clients.reset()
         finally:
             if msg:
-                crabserver = CRABRest(resthost, WORKER_CONFIG.TaskWorker.cmscert, WORKER_CONFIG.TaskWorker.cmskey,
-                                      retry=20, logger=logger, userAgent='CRABTaskWorker')
-                crabserver.setDbInstance(dbInstance)
-                failTask(task['tm_taskname'], crabserver, msg, logger, failstatus)
+                failTask(task['tm_taskname'], clients.crabserver, msg, logger, failstatus)
         t1 = time.time()
         workType = task.get('tm_task_command', 'RECURRING')
         #log entry below is used for logs parsing, therefore, changing it might require to update logstash configuration
@@ -238,6 +294,26 @@ class Worker(object):
             workid += 1
         self.logger.debug("Injection completed.")
 
+    def _collectResult(self, out, allout):
+        """Bookkeeping for one item taken from the results queue: remove the work
+           from the working list and add the Result(s) to allout"""
+        # getting output from queue returns the workid in the queue and
+        # the Result object from the action handler
+        workid = out['workid']
+        result = out['out']
+        if result:
+            taskname = result.task['tm_taskname']
+            self.logger.debug('Completed work %d on %s', workid, taskname)
+        else:
+            # recurring actions do not return a Result object
+            self.logger.debug('Completed work %s', str(out))
+
+        if isinstance(out['out'], list):
+            allout.extend(out['out'])
+        else:
+            allout.append(out['out'])
+        del self.working[out['workid']]
+
     def checkFinished(self):
         """Verifies if there are any finished jobs in the output queue
 
@@ -253,22 +329,28 @@ class Worker(object):
             except Empty:
                 pass
             if out is not None:
-                # getting output from queue returns the workid in the queue and
-                # the Result object from the action handler
-                workid = out['workid']
-                result = out['out']
-                if result:
-                    taskname = result.task['tm_taskname']
-                    self.logger.debug('Completed work %d on %s', workid, taskname)
-                else:
-                    # recurring actions do not return a Result object
-                    self.logger.debug('Completed work %s', str(out))
-
-                if isinstance(out['out'], list):
-                    allout.extend(out['out'])
-                else:
-                    allout.append(out['out'])
-                del self.working[out['workid']]
+                self._collectResult(out, allout)
+        return allout
+
+    def waitFinished(self, timeout):
+        """Blocks until a slave puts a result in the output queue or until timeout
+           seconds have passed, then collects everything which is ready.
+           Used by the MasterWorker to wake up as soon as a slave becomes free
+           instead of always sleeping for the full polling time.
+
+           :arg float timeout: maximum number of seconds to wait
+           :return Result: the output of the work completed."""
+        if len(self.working.keys()) == 0:
+            # nothing can arrive in the results queue, just wait
+            time.sleep(timeout)
+            return []
+        allout = []
+        try:
+            out = self.results.get(timeout=timeout)
+        except Empty:
+            return allout
+        self._collectResult(out, allout)
+        allout.extend(self.checkFinished())
         return allout
 
     def freeSlaves(self):
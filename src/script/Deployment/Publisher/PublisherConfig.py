@@ -25,6 +25,8 @@ config.General.pollInterval = 1800
 config.General.block_closure_timeout = 9400
 config.General.max_files_per_block = 100
 config.General.max_slaves = 5
+# a worker which spends more than this number of seconds on one task is killed and replaced
+config.General.task_timeout = 7200
 config.General.serviceCert = '/data/certs/servicecert.pem'
 config.General.serviceKey = '/data/certs/servicekey.pem'
 config.General.taskFilesDir = '/data/srv/Publisher_files/'
@@ -36,3 +38,7 @@ config.section_('TaskPublisher')
 config.TaskPublisher.DBShost = 'cmsweb-prod.cern.ch'
 config.TaskPublisher.logMsgFormat = '%(asctime)s:%(levelname)s: %(message)s'
 config.TaskPublisher.dryRun = False
+# number of threads used to look up in DBS the blocks of the parent files
+config.TaskPublisher.parentLookupThreads = 8
+# seconds to wait for the migrations of parent blocks before deferring the files which need them
+config.TaskPublisher.migrationWaitTime = 60
@@ -54,10 +54,22 @@ config.TaskWorker.dbInstance = 'dev'
 ############################################################################
 
 config.TaskWorker.polling = 30 #seconds
+## if True the master wakes up as soon as a slave finishes its work and acquires new tasks,
+## otherwise waits an adaptive time between minPolling and polling seconds
+config.TaskWorker.eventDrivenPolling = False
+config.TaskWorker.minPolling = 1 #seconds
 
 config.TaskWorker.scratchDir = '/data/srv/tmp' #make sure this directory exists
 config.TaskWorker.logsDir = './logs'
 
+## if True the splitting runs in a child process of the slave which is killed
+## if its resident memory goes beyond splitterMaxRSS MB
+config.TaskWorker.splitInSubprocess = False
+config.TaskWorker.splitterMaxRSS = 4000
+
+## number of concurrent Rucio calls used in data discovery to find where the blocks are
+config.TaskWorker.rucioLookupThreads = 8
+
 ## the parameters here below are used to contact cmsweb services for the REST-DB interactions
 config.TaskWorker.cmscert = '/data/certs/servicecert.pem'
 config.TaskWorker.cmskey = '/data/certs/servicekey.pem'
@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+""" Test module for the task selection of the schedd task_process daemon
+"""
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../scripts/task_process'))
+import task_proc_daemon  # pylint: disable=wrong-import-position
+from task_proc_daemon import TaskProcessDaemon, DAEMON_FLAG, RUNNING_FLAG, ONE_DAY  # pylint: disable=wrong-import-position
+
+
+class FakeArgs(object):
+    """ The command line options used by the scheduling """
+    maxWorkers = 2
+    cycle = 300
+    queryInterval = 600
+    statusTimeout = 3600
+    transfersTimeout = 900
+    tick = 1
+
+
+class TaskProcDaemonTest(unittest.TestCase):
+    """ _TaskProcDaemonTest_
+
+    """
+
+    def setUp(self):
+        self.spoolDir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.spoolDir, 'task_process'))
+        for name in (DAEMON_FLAG, RUNNING_FLAG, 'task_process/cache_status.py'):
+            open(os.path.join(self.spoolDir, name), 'w').close()
+        with mock.patch.object(task_proc_daemon.htcondor, 'Schedd'):
+            self.daemon = TaskProcessDaemon(FakeArgs(), logging.getLogger('TaskProcDaemonTest'))
+        # a DAG completed for more than one day, still in the queue
+        self.daemon.schedd.query.return_value = [{'CRAB_ReqName': 'task', 'TaskType': 'ROOT', 'Iwd': self.spoolDir,
+                                                  'ClusterId': 1, 'JobStatus': 4,
+                                                  'EnteredCurrentStatus': int(time.time()) - 2 * ONE_DAY}]
+
+    def tearDown(self):
+        shutil.rmtree(self.spoolDir)
+
+    def testRetiredTaskNotAddedBack(self):
+        """ A task retired by the daemon is not managed again while its DAG is in the queue """
+        now = time.time()
+        self.daemon.queryDags(now)
+        task = self.daemon.tasks['task']
+        self.assertTrue(task.retiring)
+        # the last cycle caches the status once more and forgets the task
+        task.steps = []
+        task.lastCycle = True
+        self.daemon.stepDone(task, now)
+        self.assertNotIn('task', self.daemon.tasks)
+        self.assertFalse(os.path.exists(os.path.join(self.spoolDir, RUNNING_FLAG)))
+        self.daemon.queryDags(now + FakeArgs.queryInterval)
+        self.assertNotIn('task', self.daemon.tasks)
+
+    def testNotStartedTaskIgnored(self):
+        """ A task whose DAG did not create task_process_running is not managed """
+        os.remove(os.path.join(self.spoolDir, RUNNING_FLAG))
+        self.daemon.queryDags(time.time())
+        self.assertNotIn('task', self.daemon.tasks)
+
+
+if __name__ == '__main__':
+    unittest.main()